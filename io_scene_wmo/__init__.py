@@ -38,7 +38,7 @@ bl_info = {
 import importlib
 
 import bpy
-from bpy.props import StringProperty, BoolProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty
 from bpy_extras.io_utils import ExportHelper
 
 from .wmo.ui import enums
@@ -66,7 +66,24 @@ class WMOPreferences(bpy.types.AddonPreferences):
 
     wow_path = StringProperty(
         name="WoW Client Path",
-        subtype='DIR_PATH'
+        subtype='DIR_PATH',
+        update=mpq.update_wow_path
+    )
+
+    file_cache_size = bpy.props.IntProperty(
+        name="Game File Cache (MB)",
+        description="Maximum size of decompressed game files kept in memory for reuse",
+        default=256,
+        min=0,
+        update=mpq.update_file_cache_size
+    )
+
+    texture_cache_size = bpy.props.IntProperty(
+        name="Texture Cache (MB)",
+        description="Maximum disk space used by converted textures shared between projects",
+        default=1024,
+        min=0,
+        update=mpq.update_texture_cache_size
     )
 
     fileinfo_path = StringProperty(
@@ -121,6 +138,12 @@ class WMOPreferences(bpy.types.AddonPreferences):
 
     def draw(self, context):
         self.layout.prop(self, "wow_path")
+        self.layout.prop(self, "file_cache_size")
+        row = self.layout.row(align=True)
+        row.prop(self, "texture_cache_size")
+        row.operator("scene.wow_texture_cache", text="Statistics").action = 'STATS'
+        row.operator("scene.wow_texture_cache", text="Trim").action = 'TRIM'
+        row.operator("scene.wow_texture_cache", text="Clear").action = 'CLEAR'
         self.layout.prop(self, "wmv_path")
         self.layout.prop(self, "blp_path")
         self.layout.prop(self, "fileinfo_path")
@@ -159,8 +182,15 @@ class WMOImporter(bpy.types.Operator):
         default=False,
         )
 
+    parallel_reading = BoolProperty(
+        name="Parallel reading",
+        description="Read WMO group files in multiple threads",
+        default=False,
+        )
+
     def execute(self, context):
-        import_wmo.import_wmo_to_blender_scene(self.filepath, self.load_textures, self.import_doodads, self.group_objects)
+        import_wmo.import_wmo_to_blender_scene(self.filepath, self.load_textures, self.import_doodads,
+                                               self.group_objects, self.parallel_reading)
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -194,9 +224,41 @@ class WMOExporter(bpy.types.Operator, ExportHelper):
         default=True,
         )
 
+    bsp_split_strategy = EnumProperty(
+        name="BSP split",
+        description="Strategy used to split nodes of collision BSP trees",
+        items=enums.bsp_split_strategy_enum,
+        default='MIDPOINT',
+        )
+
+    compare_bsp_strategies = BoolProperty(
+        name="Compare BSP strategies",
+        description="Additionally build BSP trees with other split strategies and report their quality",
+        default=False,
+        )
+
+    incremental_export = BoolProperty(
+        name="Incremental export",
+        description="Reuse geometry of groups unchanged since the previous export, "
+                    "kept in a cache folder next to the WMO file",
+        default=False,
+        )
+
+    parallel_writing = BoolProperty(
+        name="Parallel writing",
+        description="Serialize WMO group files in multiple threads while other groups are being saved",
+        default=False,
+        )
 
     def execute(self, context):
-        export_wmo.export_wmo_from_blender_scene(self.filepath, self.autofill_textures, self.export_selected)
+        bsp_stats = export_wmo.export_wmo_from_blender_scene(self.filepath, self.autofill_textures,
+                                                             self.export_selected, self.bsp_split_strategy,
+                                                             self.compare_bsp_strategies, self.incremental_export,
+                                                             self.parallel_writing)
+
+        for strategy, stats in bsp_stats.items():
+            self.report({'INFO'}, "BSP {}: depth {}, {} nodes, face duplication {:.2f}".format(
+                strategy, stats['depth'], stats['nodes'], stats['duplication']))
 
         return {'FINISHED'}
 
@@ -0,0 +1,116 @@
+import os
+import threading
+
+
+class DiskCache:
+    """ Machine-wide cache of files in a directory, keyed by hex digests and bounded by total size in bytes.
+    Files are evicted least recently used first, using their modification time as last use time. """
+
+    # extension of cached files
+    extension = ""
+
+    # name of cached items in messages
+    item_name = "cache"
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.extension)
+
+    def get(self, key):
+        """ Get path of a cached file and mark it as recently used, None if it is not cached """
+        path = self.get_path(key)
+
+        try:
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, data):
+        """ Store file data and evict old files if the cache grew over its limit, returns path of the file """
+        path = self.get_path(key)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+
+            os.replace(tmp_path, path)
+
+        except OSError as e:
+            print("\nWARNING: failed to write {} cache file <<{}>>: {}".format(self.item_name, path, e))
+            return None
+
+        with self.lock:
+            if self.size is None:
+                self.size = self.scan()[1]
+            else:
+                self.size += len(data)
+
+            if self.size > self.max_size:
+                self.evict(self.max_size)
+
+        return path
+
+    def list_files(self):
+        """ Get (last use time, size, path) of all cached files """
+        files = []
+
+        if not os.path.isdir(self.cache_dir):
+            return files
+
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith(self.extension):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return files
+
+    def scan(self):
+        """ Get count and total size of cached files """
+        files = self.list_files()
+        return len(files), sum(file[1] for file in files)
+
+    def evict(self, max_size):
+        """ Remove least recently used files until the cache fits the given size """
+        files = sorted(self.list_files())
+        size = sum(file[1] for file in files)
+        n_removed = 0
+
+        for mtime, file_size, path in files:
+            if size <= max_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            size -= file_size
+            n_removed += 1
+
+        self.size = size
+        return n_removed
+
+    def clear(self):
+        """ Remove all cached files, returns amount of removed files """
+        with self.lock:
+            return self.evict(0)
@@ -15,14 +15,20 @@ def m2_to_blender_mesh(dir, filepath, filedata):
     m2_path = os.path.splitext(filepath)[0] + ".m2"
     skin_path = os.path.splitext(filepath)[0] + "00.skin"
 
-    m2_file = filedata.read_file(m2_path)
-    skin_file = filedata.read_file(skin_path)
+    m2_file = filedata.open_file(m2_path)
+    skin_file = filedata.open_file(skin_path)
 
-    m2 = m2_.M2File((m2_file, os.path.basename(m2_path)))
-    skin = skin_.SkinFile((skin_file, os.path.basename(skin_path)))
+    if not m2_file or not skin_file:
+        for file in (m2_file, skin_file):
+            if file:
+                file.close()
 
-    if not m2 or not skin:
-        print("Failed to import: <<" + filepath + ">> Model import seems to have failed.")
+        raise FileNotFoundError("\nFailed to import: <<" + filepath + ">> Model or skin file was not found.")
+
+    # only blocks referenced by the headers are read, the rest of big files stays compressed
+    with m2_file, skin_file:
+        m2 = m2_.M2File((m2_file, os.path.basename(m2_path)))
+        skin = skin_.SkinFile((skin_file, os.path.basename(skin_path)))
 
     name = m2.name.decode("utf-8")
 
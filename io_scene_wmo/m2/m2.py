@@ -1128,7 +1128,7 @@ def CreateAnimFileName(a_name, anim, animfile):
 class M2File:
     def __init__(self, file):
 
-        f = open(file, "r+b") if type(file) == type("") else io.BytesIO(file[0])
+        f = open(file, "r+b") if type(file) == type("") else file[0] if hasattr(file[0], "read") else io.BytesIO(file[0])
         filename = file[1]
 
         self.hdr = M2Header()
@@ -126,7 +126,7 @@ class Propertie:
 
 class SkinFile:
     def __init__(self, file):
-        f = open(file,"r+b") if type(file) == type("") else io.BytesIO(file[0])
+        f = open(file,"r+b") if type(file) == type("") else file[0] if hasattr(file[0], "read") else io.BytesIO(file[0])
 
         self.header = SkinHeader()
         self.header.unpack(f)
@@ -0,0 +1,317 @@
+import struct
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+BLP_COMPRESSION_JPEG = 0
+BLP_COMPRESSION_PALETTE = 1
+BLP_COMPRESSION_DXT = 2
+BLP_COMPRESSION_ARGB = 3
+
+
+class UnsupportedBLPError(Exception):
+    """ Texture is valid but uses a compression the decoder does not handle, e.g. JPEG """
+
+
+class BLPHeader:
+    """ Common description of BLP1 and BLP2 texture headers """
+
+    def __init__(self):
+        self.version = 2
+        self.compression = BLP_COMPRESSION_PALETTE
+        self.alpha_depth = 0
+        self.alpha_type = 0
+        self.width = 0
+        self.height = 0
+        self.mip_offsets = ()
+        self.mip_sizes = ()
+        self.palette = None
+
+    def read(self, data):
+        magic = bytes(data[:4])
+
+        if magic == b'BLP2':
+            self.version = 2
+            content_type, self.compression, self.alpha_depth, self.alpha_type, has_mips, self.width, self.height \
+                = struct.unpack_from("<IBBBBII", data, 4)
+            pos = 20
+
+            if content_type == 0:
+                self.compression = BLP_COMPRESSION_JPEG
+
+        elif magic == b'BLP1':
+            self.version = 1
+            compression, self.alpha_depth, self.width, self.height, picture_type, has_mips \
+                = struct.unpack_from("<6I", data, 4)
+            self.compression = BLP_COMPRESSION_PALETTE if compression == 1 else BLP_COMPRESSION_JPEG
+            self.alpha_type = 0
+            pos = 28
+
+        else:
+            raise ValueError("\nInvalid BLP magic: <<{}>>".format(magic))
+
+        self.mip_offsets = struct.unpack_from("<16I", data, pos)
+        self.mip_sizes = struct.unpack_from("<16I", data, pos + 64)
+        pos += 128
+
+        if self.compression == BLP_COMPRESSION_PALETTE:
+            self.palette = bytes(data[pos:pos + 1024])
+
+        return self
+
+    def get_mip_size(self, mip):
+        return max(self.width >> mip, 1), max(self.height >> mip, 1)
+
+    def get_dxt_format(self):
+        """ Get DXT variant of a DXT compressed texture: 1, 3 or 5 """
+        if self.alpha_type == 7:
+            return 5
+        if self.alpha_depth > 1:
+            return 3
+        return 1
+
+
+def expand_alpha(alpha_data, alpha_depth, n_pixels):
+    """ Unpack 1, 4 or 8 bit alpha plane of a palettized texture to one byte per pixel """
+    if alpha_depth == 0:
+        return bytes(b'\xff' * n_pixels)
+
+    if numpy is not None:
+        packed = numpy.frombuffer(alpha_data, dtype=numpy.uint8)
+
+        if alpha_depth == 1:
+            alpha = (packed[:, None] >> numpy.arange(8, dtype=numpy.uint8) & 1).ravel()[:n_pixels] * 255
+        elif alpha_depth == 4:
+            alpha = numpy.empty(packed.size * 2, dtype=numpy.uint8)
+            alpha[0::2] = packed & 0x0F
+            alpha[1::2] = packed >> 4
+            alpha = alpha[:n_pixels] * 17
+        else:
+            alpha = packed[:n_pixels]
+
+        return alpha.astype(numpy.uint8).tobytes()
+
+    if alpha_depth == 1:
+        return bytes(255 if alpha_data[i >> 3] >> (i & 7) & 1 else 0 for i in range(n_pixels))
+    elif alpha_depth == 4:
+        return bytes((alpha_data[i >> 1] >> ((i & 1) << 2) & 0x0F) * 17 for i in range(n_pixels))
+
+    return bytes(alpha_data[:n_pixels])
+
+
+def decode_palette(header, data, width, height):
+    """ Decode palettized pixels, colors are stored in BGRA palette and alpha in a separate plane """
+    n_pixels = width * height
+    indices = data[:n_pixels]
+    alpha = expand_alpha(data[n_pixels:], header.alpha_depth, n_pixels)
+
+    if numpy is not None:
+        palette = numpy.frombuffer(header.palette, dtype=numpy.uint8).reshape(256, 4)[:, 2::-1]
+        pixels = numpy.empty((n_pixels, 4), dtype=numpy.uint8)
+        pixels[:, :3] = palette[numpy.frombuffer(indices, dtype=numpy.uint8)]
+        pixels[:, 3] = numpy.frombuffer(alpha, dtype=numpy.uint8)
+        return pixels.tobytes()
+
+    palette = [header.palette[i * 4:i * 4 + 3][::-1] for i in range(256)]
+    pixels = bytearray(n_pixels * 4)
+    for i in range(n_pixels):
+        pixels[i * 4:i * 4 + 3] = palette[indices[i]]
+        pixels[i * 4 + 3] = alpha[i]
+
+    return bytes(pixels)
+
+
+def decode_argb(data, width, height):
+    """ Convert uncompressed BGRA pixels to RGBA """
+    n_pixels = width * height
+
+    if numpy is not None:
+        pixels = numpy.frombuffer(data, dtype=numpy.uint8, count=n_pixels * 4).reshape(n_pixels, 4)
+        return pixels[:, [2, 1, 0, 3]].tobytes()
+
+    pixels = bytearray(data[:n_pixels * 4])
+    pixels[0::4], pixels[2::4] = pixels[2::4], pixels[0::4]
+    return bytes(pixels)
+
+
+def rgb565(color):
+    """ Expand a 16-bit 565 color to 8 bits per channel """
+    r = color >> 11 & 0x1F
+    g = color >> 5 & 0x3F
+    b = color & 0x1F
+    return r << 3 | r >> 2, g << 2 | g >> 4, b << 3 | b >> 2
+
+
+def decode_dxt_python(data, width, height, dxt_format, has_alpha):
+    """ Decode DXT1/3/5 blocks one by one """
+    block_size = 8 if dxt_format == 1 else 16
+    blocks_x = (width + 3) // 4
+    blocks_y = (height + 3) // 4
+
+    pixels = bytearray(width * height * 4)
+
+    for block_y in range(blocks_y):
+        for block_x in range(blocks_x):
+            pos = (block_y * blocks_x + block_x) * block_size
+            alphas = [255] * 16
+
+            if dxt_format == 3:
+                alpha_bits = int.from_bytes(data[pos:pos + 8], 'little')
+                alphas = [(alpha_bits >> (i * 4) & 0x0F) * 17 for i in range(16)]
+                pos += 8
+
+            elif dxt_format == 5:
+                a0, a1 = data[pos], data[pos + 1]
+                if a0 > a1:
+                    levels = [a0, a1] + [((7 - i) * a0 + i * a1) // 7 for i in range(1, 7)]
+                else:
+                    levels = [a0, a1] + [((5 - i) * a0 + i * a1) // 5 for i in range(1, 5)] + [0, 255]
+
+                alpha_bits = int.from_bytes(data[pos + 2:pos + 8], 'little')
+                alphas = [levels[alpha_bits >> (i * 3) & 7] for i in range(16)]
+                pos += 8
+
+            c0, c1, color_bits = struct.unpack_from("<HHI", data, pos)
+            color0 = rgb565(c0)
+            color1 = rgb565(c1)
+
+            if c0 > c1 or dxt_format != 1:
+                colors = [color0 + (255,), color1 + (255,),
+                          tuple((2 * a + b) // 3 for a, b in zip(color0, color1)) + (255,),
+                          tuple((a + 2 * b) // 3 for a, b in zip(color0, color1)) + (255,)]
+            else:
+                colors = [color0 + (255,), color1 + (255,),
+                          tuple((a + b) // 2 for a, b in zip(color0, color1)) + (255,),
+                          (0, 0, 0, 0 if has_alpha else 255)]
+
+            for i in range(16):
+                x = block_x * 4 + (i & 3)
+                y = block_y * 4 + (i >> 2)
+                if x >= width or y >= height:
+                    continue
+
+                color = colors[color_bits >> (i * 2) & 3]
+                offset = (y * width + x) * 4
+                pixels[offset:offset + 3] = bytes(color[:3])
+                pixels[offset + 3] = min(color[3], alphas[i])
+
+    return bytes(pixels)
+
+
+def decode_dxt_numpy(data, width, height, dxt_format, has_alpha):
+    """ Decode all DXT1/3/5 blocks of a texture at once """
+    block_size = 8 if dxt_format == 1 else 16
+    blocks_x = (width + 3) // 4
+    blocks_y = (height + 3) // 4
+    n_blocks = blocks_x * blocks_y
+
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=n_blocks * block_size).reshape(n_blocks, block_size)
+    color_blocks = blocks[:, block_size - 8:]
+    shifts = numpy.arange(16, dtype=numpy.uint64)
+
+    # color endpoints and 2-bit indices of every pixel
+    c0 = color_blocks[:, 0].astype(numpy.int32) | color_blocks[:, 1].astype(numpy.int32) << 8
+    c1 = color_blocks[:, 2].astype(numpy.int32) | color_blocks[:, 3].astype(numpy.int32) << 8
+    color_bits = color_blocks[:, 4:8].copy().view('<u4').astype(numpy.uint64)
+    color_indices = (color_bits >> (shifts * 2) & 3).astype(numpy.intp)
+
+    def expand(color):
+        r = color >> 11 & 0x1F
+        g = color >> 5 & 0x3F
+        b = color & 0x1F
+        return numpy.stack((r << 3 | r >> 2, g << 2 | g >> 4, b << 3 | b >> 2), axis=1)
+
+    color0 = expand(c0)
+    color1 = expand(c1)
+
+    palette = numpy.empty((n_blocks, 4, 4), dtype=numpy.int32)
+    palette[:, 0, :3] = color0
+    palette[:, 1, :3] = color1
+    palette[:, :, 3] = 255
+
+    four_colors = (c0 > c1) | (dxt_format != 1)
+    palette[:, 2, :3] = numpy.where(four_colors[:, None], (2 * color0 + color1) // 3, (color0 + color1) // 2)
+    palette[:, 3, :3] = numpy.where(four_colors[:, None], (color0 + 2 * color1) // 3, 0)
+    if has_alpha and dxt_format == 1:
+        palette[:, 3, 3] = numpy.where(four_colors, 255, 0)
+
+    pixels = palette[numpy.arange(n_blocks)[:, None], color_indices]
+
+    if dxt_format == 3:
+        alpha_bits = blocks[:, :8].copy().view('<u8')
+        pixels[:, :, 3] = (alpha_bits >> (shifts * 4) & 0x0F).astype(numpy.int32) * 17
+
+    elif dxt_format == 5:
+        a0 = blocks[:, 0].astype(numpy.int32)[:, None]
+        a1 = blocks[:, 1].astype(numpy.int32)[:, None]
+        steps = numpy.arange(8, dtype=numpy.int32)
+
+        levels7 = ((7 - steps[2:] + 1) * a0 + (steps[2:] - 1) * a1) // 7
+        levels5 = ((5 - steps[2:6] + 1) * a0 + (steps[2:6] - 1) * a1) // 5
+
+        levels = numpy.empty((n_blocks, 8), dtype=numpy.int32)
+        levels[:, 0:1] = a0
+        levels[:, 1:2] = a1
+        levels[:, 2:] = numpy.where(a0 > a1, levels7, numpy.concatenate(
+            (levels5, numpy.zeros((n_blocks, 1), numpy.int32), numpy.full((n_blocks, 1), 255, numpy.int32)), axis=1))
+
+        alpha_bytes = numpy.zeros((n_blocks, 8), dtype=numpy.uint8)
+        alpha_bytes[:, :6] = blocks[:, 2:8]
+        alpha_bits = alpha_bytes.view('<u8')
+        alpha_indices = (alpha_bits >> (shifts * 3) & 7).astype(numpy.intp)
+
+        pixels[:, :, 3] = levels[numpy.arange(n_blocks)[:, None], alpha_indices]
+
+    # blocks of 4x4 pixels to rows of pixels, cropping padding of textures smaller than a block
+    pixels = pixels.reshape(blocks_y, blocks_x, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    pixels = pixels.reshape(blocks_y * 4, blocks_x * 4, 4)[:height, :width]
+
+    return pixels.astype(numpy.uint8).tobytes()
+
+
+def decode_dxt(data, width, height, dxt_format, has_alpha):
+    """ Decode DXT1/3/5 compressed pixels to RGBA """
+    if numpy is not None:
+        return decode_dxt_numpy(data, width, height, dxt_format, has_alpha)
+    return decode_dxt_python(data, width, height, dxt_format, has_alpha)
+
+
+def decode_blp(data, mip=0):
+    """ Decode a mipmap of a BLP texture. Returns width, height and RGBA pixels, rows from top to bottom """
+    header = BLPHeader().read(data)
+
+    if header.compression == BLP_COMPRESSION_JPEG:
+        raise UnsupportedBLPError("\nJPEG compressed BLP textures are not supported.")
+
+    width, height = header.get_mip_size(mip)
+    offset = header.mip_offsets[mip]
+    mip_data = memoryview(data)[offset:offset + header.mip_sizes[mip]]
+
+    if header.compression == BLP_COMPRESSION_PALETTE:
+        pixels = decode_palette(header, bytes(mip_data), width, height)
+    elif header.compression == BLP_COMPRESSION_DXT:
+        pixels = decode_dxt(bytes(mip_data), width, height, header.get_dxt_format(), header.alpha_depth > 0)
+    elif header.compression == BLP_COMPRESSION_ARGB:
+        pixels = decode_argb(bytes(mip_data), width, height)
+    else:
+        raise UnsupportedBLPError("\nUnknown BLP compression type: {}".format(header.compression))
+
+    return width, height, pixels
+
+
+def encode_png(width, height, pixels):
+    """ Encode RGBA pixels, rows from top to bottom, as a PNG image """
+    stride = width * 4
+    raw = b''.join(b'\x00' + pixels[y * stride:(y + 1) * stride] for y in range(height))
+
+    def chunk(tag, content):
+        return struct.pack(">I", len(content)) + tag + content + struct.pack(">I", zlib.crc32(tag + content))
+
+    return b'\x89PNG\r\n\x1a\n' \
+        + chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(raw, 6)) \
+        + chunk(b'IEND', b'')
@@ -10,10 +10,14 @@ from __future__ import print_function
 import bz2
 import os
 import struct
+import sys
+import threading
 import zlib
 import re
+from array import array
 from collections import namedtuple
-from io import BytesIO
+from functools import lru_cache
+import io
 
 
 __author__ = "Aku Kotkavuo"
@@ -29,6 +33,9 @@ MPQ_FILE_DELETE_MARKER  = 0x02000000
 MPQ_FILE_SECTOR_CRC     = 0x04000000
 MPQ_FILE_EXISTS         = 0x80000000
 
+MPQ_HASH_ENTRY_EMPTY    = 0xFFFFFFFF
+MPQ_HASH_ENTRY_DELETED  = 0xFFFFFFFE
+
 MPQFileHeader = namedtuple('MPQFileHeader',
     '''
     magic
@@ -85,22 +92,201 @@ MPQBlockTableEntry = namedtuple('MPQBlockTableEntry',
 MPQBlockTableEntry.struct_format = '4I'
 
 
+def decompress(data):
+    """Read the compression type and decompress file data."""
+    compression_type = ord(data[0:1])
+    if compression_type == 0:
+        return data
+    elif compression_type == 2:
+        return zlib.decompress(data[1:], 15)
+    elif compression_type == 16:
+        return bz2.decompress(data[1:])
+    else:
+        raise RuntimeError("Unsupported compression type.")
+
+
+class MPQFileStream(io.RawIOBase):
+    """Read-only stream over a file stored in a MPQ archive.
+
+    Sectors are read and decompressed only when a read touches them,
+    so parsing a header or a few chunks of a big file does not unpack
+    the whole file.
+    """
+
+    # Amount of sectors decompressed by one task of an executor.
+    parallel_chunk_sectors = 16
+
+    def __init__(self, archive, block_entry, force_decompress=False,
+                 executor=None):
+        if block_entry.flags & MPQ_FILE_ENCRYPTED:
+            raise NotImplementedError("Encryption is not supported yet.")
+
+        self.archive = archive
+        self.block_entry = block_entry
+        self.force_decompress = force_decompress
+        self.executor = executor
+        self.offset = block_entry.offset + archive.header['offset']
+        self.size = block_entry.size
+        self.position = 0
+
+        # Last decompressed sector, small sequential reads mostly hit it.
+        self.cached_sector_index = None
+        self.cached_sector = b''
+
+        if block_entry.flags & MPQ_FILE_SINGLE_UNIT:
+            self.sector_size = max(block_entry.size, 1)
+            self.sector_positions = (0, block_entry.archived_size)
+        else:
+            self.sector_size = 512 << archive.header['sector_size_shift']
+            self.sector_positions = None
+
+        self.sector_count = -(-self.size // self.sector_size)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence ({}).".format(whence))
+
+        if position < 0:
+            raise ValueError("Negative seek position {}.".format(position))
+
+        self.position = position
+        return position
+
+    def read_sector_positions(self):
+        """Read the sector offset table of a multi-sector file."""
+        if self.block_entry.flags & (MPQ_FILE_COMPRESS | MPQ_FILE_IMPLODE):
+            count = self.sector_count + 1
+            with self.archive.lock:
+                self.archive.file.seek(self.offset)
+                data = self.archive.file.read(4 * count)
+            self.sector_positions = struct.unpack('<%dI' % count, data)
+        else:
+            # Uncompressed files have no offset table.
+            self.sector_positions = tuple(
+                min(i * self.sector_size, self.size)
+                for i in range(self.sector_count + 1))
+
+    def read_sectors(self, first, last):
+        """Read and decompress sectors first to last (inclusive)."""
+        if self.sector_positions is None:
+            self.read_sector_positions()
+        positions = self.sector_positions
+
+        with self.archive.lock:
+            self.archive.file.seek(self.offset + positions[first])
+            data = self.archive.file.read(positions[last + 1] - positions[first])
+
+        indices = range(first, last + 1)
+        chunk = self.parallel_chunk_sectors
+
+        if self.executor is not None and len(indices) > chunk:
+            # zlib and bz2 release the GIL, so chunks decompress in parallel.
+            chunks = [indices[i:i + chunk] for i in range(0, len(indices), chunk)]
+            sectors = []
+            for chunk_sectors in self.executor.map(
+                    lambda chunk_indices: self.decompress_sectors(data, first, chunk_indices),
+                    chunks):
+                sectors.extend(chunk_sectors)
+        else:
+            sectors = self.decompress_sectors(data, first, indices)
+
+        self.cached_sector_index = last
+        self.cached_sector = sectors[-1]
+        return sectors
+
+    def decompress_sectors(self, data, first, indices):
+        """Decompress sectors read into data, starting with sector first."""
+        positions = self.sector_positions
+        base = positions[first]
+        sectors = []
+
+        for i in indices:
+            sector = data[positions[i] - base:positions[i + 1] - base]
+
+            # Sectors are stored compressed only when it saves space.
+            expected_size = min(self.sector_size, self.size - i * self.sector_size)
+            if (self.block_entry.flags & MPQ_FILE_COMPRESS and
+                (self.force_decompress or expected_size > len(sector))):
+                sector = decompress(sector)
+
+            sectors.append(sector)
+
+        return sectors
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if self.position >= end:
+            return 0
+
+        first = self.position // self.sector_size
+        last = (end - 1) // self.sector_size
+
+        if first == last == self.cached_sector_index:
+            sectors = [self.cached_sector]
+        else:
+            sectors = self.read_sectors(first, last)
+
+        data = b''.join(sectors) if len(sectors) > 1 else sectors[0]
+        start = self.position - first * self.sector_size
+        size = end - self.position
+
+        memoryview(buffer)[:size] = memoryview(data)[start:start + size]
+        self.position = end
+        return size
+
+    def readall(self):
+        data = bytearray(max(self.size - self.position, 0))
+        size = self.readinto(data)
+        return bytes(data[:size])
+
+
 class MPQArchive(object):
 
-    def __init__(self, filename, listfile=True):
+    def __init__(self, filename, listfile=True, hash_index=False,
+                 read_tables=True):
         """Create a MPQArchive object.
 
         You can skip reading the listfile if you pass listfile=False
         to the constructor. The 'files' attribute will be unavailable
         if you do this.
+
+        Pass hash_index=True to build a dictionary of hash table entries,
+        which makes file lookups independent of the hash table size at
+        the cost of some memory.
+
+        Pass read_tables=False to defer reading and decrypting the hash
+        and block tables until the first lookup by filename. Blocks can
+        still be read by their entries in the meantime.
         """
         if hasattr(filename, 'read'):
             self.file = filename
         else:
             self.file = open(filename, 'rb')
         self.header = self.read_header()
-        self.hash_table = self.read_table('hash')
-        self.block_table = self.read_table('block')
+        # Guards the shared file position of concurrent reads.
+        self.lock = threading.RLock()
+        self.hash_table = None
+        self.block_table = None
+        self.hash_index = None
+        if read_tables or listfile or hash_index:
+            self.load_tables()
+        if hash_index:
+            self.hash_index = self.build_hash_index()
         if listfile:
             self.files = self.read_file('(listfile)').splitlines()
         else:
@@ -172,77 +358,92 @@ class MPQArchive(object):
 
         return [unpack_entry(i) for i in range(table_entries)]
 
+    def load_tables(self):
+        """Read the hash and block tables if they were not read yet."""
+        with self.lock:
+            if self.hash_table is None:
+                self.hash_table = self.read_table('hash')
+                self.block_table = self.read_table('block')
+
+    def build_hash_index(self):
+        """Map (hash_a, hash_b) pairs to hash table entries.
+
+        When several entries share the same hashes (e.g. localized
+        versions of a file), the first one in table order is kept.
+        """
+        self.load_tables()
+        index = {}
+        for entry in self.hash_table:
+            if entry.block_table_index in (MPQ_HASH_ENTRY_EMPTY,
+                                           MPQ_HASH_ENTRY_DELETED):
+                continue
+            index.setdefault((entry.hash_a, entry.hash_b), entry)
+        return index
+
     def get_hash_table_entry(self, filename):
         """Get the hash table entry corresponding to a given filename."""
         hash_a = self._hash(filename, 'HASH_A')
         hash_b = self._hash(filename, 'HASH_B')
-        for entry in self.hash_table:
-            if (entry.hash_a == hash_a and entry.hash_b == hash_b):
+
+        if self.hash_index is not None:
+            return self.hash_index.get((hash_a, hash_b))
+
+        self.load_tables()
+        table_size = len(self.hash_table)
+        if not table_size:
+            return None
+
+        # Entries are placed at the slot given by the table offset hash
+        # or at the next free one, so probing stops at an empty slot.
+        start = self._hash(filename, 'TABLE_OFFSET') & (table_size - 1)
+        for i in range(table_size):
+            entry = self.hash_table[(start + i) % table_size]
+            if entry.block_table_index == MPQ_HASH_ENTRY_EMPTY:
+                return None
+            if (entry.hash_a == hash_a and entry.hash_b == hash_b and
+                    entry.block_table_index != MPQ_HASH_ENTRY_DELETED):
                 return entry
 
     def read_file(self, filename, force_decompress=False):
         """Read a file from the MPQ archive."""
-
-        def decompress(data):
-            """Read the compression type and decompress file data."""
-            compression_type = ord(data[0:1])
-            if compression_type == 0:
-                return data
-            elif compression_type == 2:
-                return zlib.decompress(data[1:], 15)
-            elif compression_type == 16:
-                return bz2.decompress(data[1:])
-            else:
-                raise RuntimeError("Unsupported compression type.")
-
         hash_entry = self.get_hash_table_entry(filename)
         if hash_entry is None:
             return None
         block_entry = self.block_table[hash_entry.block_table_index]
 
-        # Read the block.
+        return self.read_block(block_entry, force_decompress)
+
+    def read_block(self, block_entry, force_decompress=False, executor=None):
+        """Read a file from the MPQ archive by its block table entry.
+
+        Sectors of big files are decompressed concurrently when an
+        executor (e.g. a ThreadPoolExecutor) is passed.
+        """
         if block_entry.flags & MPQ_FILE_EXISTS:
             if block_entry.archived_size == 0:
                 return None
 
-            offset = block_entry.offset + self.header['offset']
-            self.file.seek(offset)
-            file_data = self.file.read(block_entry.archived_size)
-
-            if block_entry.flags & MPQ_FILE_ENCRYPTED:
-                raise NotImplementedError("Encryption is not supported yet.")
-
-            if not block_entry.flags & MPQ_FILE_SINGLE_UNIT:
-                # File consists of many sectors. They all need to be
-                # decompressed separately and united.
-                sector_size = 512 << self.header['sector_size_shift']
-                sectors = block_entry.size // sector_size + 1
-                if block_entry.flags & MPQ_FILE_SECTOR_CRC:
-                    crc = True
-                    sectors += 1
-                else:
-                    crc = False
-                positions = struct.unpack('<%dI' % (sectors + 1),
-                                          file_data[:4*(sectors+1)])
-                result = BytesIO()
-                sector_bytes_left = block_entry.size
-                for i in range(len(positions) - (2 if crc else 1)):
-                    sector = file_data[positions[i]:positions[i+1]]
-                    if (block_entry.flags & MPQ_FILE_COMPRESS and
-                        (force_decompress or sector_bytes_left > len(sector))):
-                        sector = decompress(sector)
-
-                    sector_bytes_left -= len(sector)
-                    result.write(sector)
-                file_data = result.getvalue()
-            else:
-                # Single unit files only need to be decompressed, but
-                # compression only happens when at least one byte is gained.
-                if (block_entry.flags & MPQ_FILE_COMPRESS and
-                    (force_decompress or block_entry.size > block_entry.archived_size)):
-                    file_data = decompress(file_data)
-
-            return file_data
+            stream = MPQFileStream(self, block_entry, force_decompress, executor)
+            return stream.readall()
+
+    def open_file(self, filename, force_decompress=False):
+        """Open a file from the MPQ archive as a read-only stream.
+
+        Returns None if the file does not exist.
+        """
+        hash_entry = self.get_hash_table_entry(filename)
+        if hash_entry is None:
+            return None
+        block_entry = self.block_table[hash_entry.block_table_index]
+
+        return self.open_block(block_entry, force_decompress)
+
+    def open_block(self, block_entry, force_decompress=False):
+        """Open a file from the MPQ archive by its block table entry."""
+        if not block_entry.flags & MPQ_FILE_EXISTS or block_entry.archived_size == 0:
+            return None
+
+        return MPQFileStream(self, block_entry, force_decompress)
 
     def extract(self):
         """Extract all the files inside the MPQ archive in memory."""
@@ -315,47 +516,37 @@ class MPQArchive(object):
 
     def _hash(self, string, hash_type):
         """Hash a string using MPQ's hash function."""
-        hash_types = {
-            'TABLE_OFFSET': 0,
-            'HASH_A': 1,
-            'HASH_B': 2,
-            'TABLE': 3
-        }
-        seed1 = 0x7FED7FED
-        seed2 = 0xEEEEEEEE
-
-        for ch in string.upper():
-            if not isinstance(ch, int): ch = ord(ch)
-            value = self.encryption_table[(hash_types[hash_type] << 8) + ch]
-            seed1 = (value ^ (seed1 + seed2)) & 0xFFFFFFFF
-            seed2 = ch + seed1 + seed2 + (seed2 << 5) + 3 & 0xFFFFFFFF
-
-        return seed1
+        return hash_string(string, hash_type)
 
     def _decrypt(self, data, key):
         """Decrypt hash or block table or a sector."""
         seed1 = key
         seed2 = 0xEEEEEEEE
-        result = BytesIO()
+        table = self.encryption_table
 
-        for i in range(len(data) // 4):
-            seed2 += self.encryption_table[0x400 + (seed1 & 0xFF)]
-            seed2 &= 0xFFFFFFFF
-            value = struct.unpack("<I", data[i*4:i*4+4])[0]
-            value = (value ^ (seed1 + seed2)) & 0xFFFFFFFF
+        # Every word depends on the previous one through the seeds, so
+        # the loop stays sequential, but all words are converted at once.
+        words = array('I')
+        words.frombytes(memoryview(data)[:len(data) // 4 * 4])
+        if sys.byteorder == 'big':
+            words.byteswap()
 
-            seed1 = ((~seed1 << 0x15) + 0x11111111) | (seed1 >> 0x0B)
-            seed1 &= 0xFFFFFFFF
-            seed2 = value + seed2 + (seed2 << 5) + 3 & 0xFFFFFFFF
+        for i in range(len(words)):
+            seed2 = seed2 + table[0x400 + (seed1 & 0xFF)] & 0xFFFFFFFF
+            value = (words[i] ^ (seed1 + seed2)) & 0xFFFFFFFF
+            words[i] = value
 
-            result.write(struct.pack("<I", value))
+            seed1 = (((~seed1 << 0x15) + 0x11111111) | (seed1 >> 0x0B)) & 0xFFFFFFFF
+            seed2 = value + seed2 + (seed2 << 5) + 3 & 0xFFFFFFFF
 
-        return result.getvalue()
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words.tobytes()
 
     def _prepare_encryption_table():
         """Prepare encryption table for MPQ hash function."""
         seed = 0x00100001
-        crypt_table = {}
+        crypt_table = array('I', bytes(0x500 * 4))
 
         for i in range(256):
             index = i
@@ -374,6 +565,34 @@ class MPQArchive(object):
 
     encryption_table = _prepare_encryption_table()
 
+
+HASH_TYPES = {
+    'TABLE_OFFSET': 0,
+    'HASH_A': 1,
+    'HASH_B': 2,
+    'TABLE': 3
+}
+
+
+@lru_cache(maxsize=65536)
+def hash_string(string, hash_type):
+    """Hash a string using MPQ's hash function.
+
+    Results are memoized, as the same paths are usually looked up in
+    several archives.
+    """
+    table = MPQArchive.encryption_table
+    offset = HASH_TYPES[hash_type] << 8
+    seed1 = 0x7FED7FED
+    seed2 = 0xEEEEEEEE
+
+    for ch in string.upper():
+        if not isinstance(ch, int): ch = ord(ch)
+        seed1 = (table[offset + ch] ^ (seed1 + seed2)) & 0xFFFFFFFF
+        seed2 = ch + seed1 + seed2 + (seed2 << 5) + 3 & 0xFFFFFFFF
+
+    return seed1
+
 def main():
     import argparse
     description = "mpyq reads and extracts MPQ archives."
@@ -0,0 +1,19 @@
+import hashlib
+from ..disk_cache import DiskCache
+
+
+class TextureCache(DiskCache):
+    """ Machine-wide cache of converted textures, keyed by content hash of the source texture """
+
+    extension = ".png"
+    item_name = "texture"
+
+    @staticmethod
+    def get_key(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def get_stats(self):
+        """ Get textual statistics of the cache """
+        count, size = self.scan()
+        return "{} textures, {:.1f} of {:.1f} MB, {} hits, {} misses".format(
+            count, size / 1048576, self.max_size / 1048576, self.hits, self.misses)
@@ -1,85 +1,435 @@
+import io
 import re
 import os
 import bpy
+import mmap
 import time
+import zlib
+import shutil
+import struct
+import threading
 import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from . import blp
 from . import mpyq
+from .texture_cache import TextureCache
 from .mpyq import *
 
+
+class FileCache:
+    """ Least recently used cache of file payloads bounded by their total size in bytes """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Get cached payload and mark it as recently used, None if it is not cached """
+        with self.lock:
+            data = self.entries.get(key)
+
+            if data is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """ Cache payload, evicting least recently used ones. Payloads bigger than the limit are not cached """
+        if len(data) > self.max_size:
+            return
+
+        with self.lock:
+            old_data = self.entries.pop(key, None)
+            if old_data is not None:
+                self.size -= len(old_data)
+
+            self.entries[key] = data
+            self.size += len(data)
+            self.trim()
+
+    def trim(self):
+        while self.size > self.max_size and self.entries:
+            self.size -= len(self.entries.popitem(last=False)[1])
+
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            self.trim()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __str__(self):
+        return "{} files, {:.1f} of {:.1f} MB, {} hits, {} misses".format(
+            len(self.entries), self.size / 1048576, self.max_size / 1048576, self.hits, self.misses)
+
+
 class WoWFileData():
-    def __init__(self, wow_path, blp_path):
+    def __init__(self, wow_path, blp_path, cache_size=256 * 1048576, texture_cache=None):
         self.wow_path = wow_path
         self.files = self.open_game_resources(self.wow_path)
+        self.file_index = self.build_file_index(self.files) if self.files else {}
         self.converter = BLPConverter(blp_path) if blp_path else None
+        self.cache = FileCache(cache_size)
+        self.texture_cache = texture_cache
+        self.executor = None
+        self.background_executor = None
 
     def __del__(self):
         print("\nUnloading game data...")
 
-    def read_file(self, filepath, force_decompress=False):
-        """ Read the latest version of the file from loaded archives and directories. """
-        file = None
-        for pair in self.files:
-            storage = pair[0]
-            type = pair[1]
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+        if self.background_executor:
+            self.background_executor.shutdown(wait=False)
+
+    def get_executor(self):
+        """ Get thread pool used to decompress files, created on first use """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        return self.executor
+
+    def invalidate_cache(self):
+        """ Drop all cached file payloads """
+        print("\nClearing game file cache: {}".format(self.cache))
+        self.cache.clear()
+
+    @staticmethod
+    def get_file_key(filepath):
+        """ Get case and separator independent lookup key of a game file path """
+        filepath = filepath.replace('/', '\\')
+        return mpyq.hash_string(filepath, 'HASH_A'), mpyq.hash_string(filepath, 'HASH_B')
+
+    # binary index cache layout: file header, then per archive a record header, its path
+    # and (hash_a, hash_b, offset, archived_size, size, flags) records of files it provides
+    index_cache_magic = b'WIDX'
+    index_cache_version = 1
+    index_cache_header = struct.Struct('<4sII')
+    index_cache_archive = struct.Struct('<QqII')
+    index_cache_entry = struct.Struct('<6I')
+
+    def get_index_cache_path(self):
+        """ Get path of the file index cache of this client in the user configuration directory """
+        cache_dir = bpy.utils.user_resource('CONFIG', path='io_scene_wmo', create=True)
+        name = "game_data_index_{:08x}.bin".format(zlib.crc32(os.path.abspath(self.wow_path).encode('utf-8')))
+        return os.path.join(cache_dir, name)
+
+    def load_index_cache(self, cache_path):
+        """ Load cached archive entries as {path: (size, mtime, entries)}, empty if the cache is missing or invalid """
+        archives = {}
+
+        if not os.path.isfile(cache_path):
+            return archives
+
+        try:
+            with open(cache_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, version, n_archives = self.index_cache_header.unpack_from(data, 0)
+                if magic != self.index_cache_magic or version != self.index_cache_version:
+                    return archives
+
+                pos = self.index_cache_header.size
+                for _ in range(n_archives):
+                    size, mtime, path_length, n_entries = self.index_cache_archive.unpack_from(data, pos)
+                    pos += self.index_cache_archive.size
+
+                    path = data[pos:pos + path_length].decode('utf-8')
+                    pos += path_length
+
+                    end = pos + n_entries * self.index_cache_entry.size
+                    if end > len(data):
+                        raise ValueError("truncated archive entries")
+
+                    entries = [((entry[0], entry[1]), mpyq.MPQBlockTableEntry._make(entry[2:]))
+                               for entry in self.index_cache_entry.iter_unpack(data[pos:end])]
+                    pos = end
+
+                    archives[path] = (size, mtime, entries)
+
+        except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+            print("\nWARNING: game data index cache is corrupted and will be rebuilt: {}".format(e))
+            return {}
+
+        return archives
+
+    def save_index_cache(self, cache_path, archives):
+        """ Write archive entries to the cache file, replacing it atomically """
+        tmp_path = cache_path + '.tmp'
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.index_cache_header.pack(self.index_cache_magic, self.index_cache_version, len(archives)))
+
+                for path, (size, mtime, entries) in archives.items():
+                    path = path.encode('utf-8')
+                    f.write(self.index_cache_archive.pack(size, mtime, len(path), len(entries)))
+                    f.write(path)
+                    f.write(b''.join(self.index_cache_entry.pack(key[0], key[1], *block_entry)
+                                     for key, block_entry in entries))
+
+            os.replace(tmp_path, cache_path)
+
+        except OSError as e:
+            print("\nWARNING: failed to write game data index cache: {}".format(e))
+
+    @staticmethod
+    def get_archive_entries(archive):
+        """ Get (key, block entry) pairs of files an archive provides. Deleted and empty files are skipped """
+        entries = []
+
+        for key, hash_entry in archive.build_hash_index().items():
+            block_entry = archive.block_table[hash_entry.block_table_index]
+
+            # deleted and empty files do not override files of lower priority storages
+            if block_entry.flags & mpyq.MPQ_FILE_EXISTS and block_entry.archived_size:
+                entries.append((key, block_entry))
+
+        return entries
+
+    def build_file_index(self, resources):
+        """ Map keys of all files in loaded archives and directories to the storage providing their latest version.
+        Archive entries are reused from the index cache when the archive file did not change """
+        start_time = time.time()
+        file_index = {}
+
+        cache_path = self.get_index_cache_path()
+        cached_archives = self.load_index_cache(cache_path)
+        archives = {}
+        n_rebuilt = 0
+
+        # resources are ordered from the lowest to the highest priority, patches override files of earlier storages
+        for storage, is_archive in resources:
+            if is_archive:
+                path = os.path.abspath(storage.file.name)
+                stat = os.stat(path)
+
+                cached = cached_archives.get(path)
+                if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                    entries = cached[2]
+                else:
+                    entries = self.get_archive_entries(storage)
+                    n_rebuilt += 1
+
+                archives[path] = (stat.st_size, stat.st_mtime_ns, entries)
 
-            if type:
-                file = storage.read_file(filepath, force_decompress)
+                for key, block_entry in entries:
+                    file_index[key] = (storage, block_entry)
             else:
-                abs_path = os.path.join(storage, filepath)
-                if os.path.exists(abs_path) and os.path.isfile(abs_path):
-                    file = open(abs_path, "rb").read()
-            if file:
-                return file
+                for root, dirs, filenames in os.walk(storage):
+                    for filename in filenames:
+                        abs_path = os.path.join(root, filename)
+                        key = WoWFileData.get_file_key(os.path.relpath(abs_path, storage))
+                        file_index[key] = abs_path
+
+        if n_rebuilt or set(archives) != set(cached_archives):
+            self.save_index_cache(cache_path, archives)
+
+        print("\nIndexed {} game files in {:.2f} seconds, {} of {} archives reindexed.".format(
+            len(file_index), time.time() - start_time, n_rebuilt, len(archives)))
+        return file_index
+
+    def read_file(self, filepath, force_decompress=False, parallel=True):
+        """ Read the latest version of the file from loaded archives and directories.
+        Sectors of big archived files are decompressed in parallel unless disabled. """
+        key = self.get_file_key(filepath)
+        file = self.read_location(key, self.file_index.get(key), force_decompress, parallel)
+
+        if file:
+            return file
 
         print("\nRequested file <<" + filepath + ">> not found in MPQ archives.")
         return None
 
-    def extract_files(self, dir, filenames, force_decompress=False):
-        """ Read the latest version of the files from loaded archives and directories and
-        extract them to provided working directory. """
+    def read_location(self, key, location, force_decompress=False, parallel=True):
+        """ Read file data from its file index location, going through the file cache """
+        file = self.cache.get((key, force_decompress))
+        if file:
+            return file
+
+        if isinstance(location, tuple):
+            storage, block_entry = location
+            file = storage.read_block(block_entry, force_decompress, self.get_executor() if parallel else None)
+        elif location:
+            with open(location, "rb") as f:
+                file = f.read()
+
+        if file:
+            self.cache.put((key, force_decompress), file)
+
+        return file
+
+    # files up to this size are read whole through the file cache when opened, bigger ones are streamed
+    max_cached_stream_size = 4 * 1048576
+
+    @staticmethod
+    def get_location_size(location):
+        """ Get uncompressed size of a file at its file index location """
+        if isinstance(location, tuple):
+            return location[1].size
+        return os.path.getsize(location)
+
+    def open_file(self, filepath, force_decompress=False):
+        """ Open the latest version of the file from loaded archives and directories as a read-only stream.
+        Small files are read through the file cache, big archived files are decompressed sector by sector
+        as they are read. """
+        key = self.get_file_key(filepath)
+        location = self.file_index.get(key)
+
+        if not location:
+            print("\nRequested file <<" + filepath + ">> not found in MPQ archives.")
+            return None
 
-        result = False
+        if self.get_location_size(location) <= self.max_cached_stream_size:
+            file = self.read_location(key, location, force_decompress)
+            return io.BytesIO(file) if file else None
+
+        file = self.cache.get((key, force_decompress))
+        if file:
+            return io.BytesIO(file)
+
+        if isinstance(location, tuple):
+            storage, block_entry = location
+            return storage.open_block(block_entry, force_decompress)
+
+        return open(location, "rb")
+
+    def read_files(self, filepaths, force_decompress=False):
+        """ Read the latest versions of many files at once, decompressing them concurrently.
+        Returns an ordered mapping of paths to file data, None for files that were not found. """
+
+        # each file is decompressed by one worker, workers must not wait for tasks queued behind them
+        files = self.get_executor().map(lambda filepath: self.read_file(filepath, force_decompress, False), filepaths)
+        return OrderedDict(zip(filepaths, files))
+
+    def extract_files_batch(self, dir, filenames, force_decompress=False):
+        """ Extract the latest versions of many files to provided working directory at once.
+        Returns an ordered mapping of requested paths to extracted file paths, None for files that failed. """
+
+        result = OrderedDict()
+        requests = OrderedDict()
+
+        # paths differing only in case or separators refer to the same file, it is extracted once
         for filename in filenames:
-            file = self.read_file(filename, force_decompress)
-            if not file:
-                continue
+            key = self.get_file_key(filename)
+            result[filename] = key
+            requests.setdefault(key, filename)
+
+        archive_order = {id(storage): i for i, (storage, is_archive) in enumerate(self.files or ())}
+
+        def request_order(key):
+            # group by archive and read each archive front to back, folder patch files go last
+            location = self.file_index.get(key)
+            if isinstance(location, tuple):
+                return archive_order[id(location[0])], location[1].offset
+            return len(archive_order), 0
+
+        keys = sorted((key for key in requests if key in self.file_index), key=request_order)
+
+        for key in requests:
+            if key not in self.file_index:
+                print("\nRequested file <<" + requests[key] + ">> not found in MPQ archives.")
+
+        local_dirs = set(os.path.dirname(os.path.join(dir, requests[key])) for key in keys)
+        for local_dir in local_dirs:
+            os.makedirs(local_dir, exist_ok=True)
 
-            abs_path = os.path.join(dir, filename)
-            local_dir = os.path.dirname(abs_path)
+        def extract(key):
+            abs_path = os.path.join(dir, requests[key])
 
-            if not os.path.exists(local_dir):
-                os.makedirs(local_dir)
+            try:
+                file = self.read_location(key, self.file_index[key], force_decompress, False)
+                if not file:
+                    return None
 
-            f = open(abs_path, 'wb')
-            f.write(file or b'')
-            f.close()
+                with open(abs_path, 'wb') as f:
+                    f.write(file)
 
-            result = True
+            except Exception as e:
+                print("\nFailed to extract file <<" + requests[key] + ">>: {}".format(e))
+                return None
+
+            return abs_path
+
+        extracted = dict(zip(keys, self.get_executor().map(extract, keys)))
+
+        for filename, key in result.items():
+            result[filename] = extracted.get(key)
 
         return result
 
+    def extract_files(self, dir, filenames, force_decompress=False):
+        """ Read the latest version of the files from loaded archives and directories and
+        extract them to provided working directory. """
+        return any(self.extract_files_batch(dir, filenames, force_decompress).values())
+
     def extract_textures_as_png(self, dir, filenames, force_decompress=False):
         """ Read the latest version of the texture files from loaded archives and directories and
         extract them to current working directory as PNG images. """
-        if self.converter:
-            blp_paths = []
+        # paths differing only in case or separators refer to the same texture, it is converted once
+        requests = OrderedDict()
+        for filename in filenames:
+            requests.setdefault(self.get_file_key(filename), filename)
+
+        filenames = [filename for filename in requests.values()
+                     if not os.path.exists(os.path.splitext(os.path.join(dir, filename))[0] + ".png")]
+
+        def convert(filename):
+            # textures are decoded in memory, only those the decoder does not support are left to the converter
+            file = self.read_file(filename, force_decompress, False)
+            if not file:
+                return None
+
+            png_path = os.path.splitext(os.path.join(dir, filename))[0] + ".png"
+            os.makedirs(os.path.dirname(png_path), exist_ok=True)
+
+            # identical textures are decoded once per machine, other projects copy them from the texture cache
+            key = TextureCache.get_key(file) if self.texture_cache else None
+            cached_path = self.texture_cache.get(key) if key else None
 
-            for filename in filenames:
-                abs_path = os.path.join(dir, filename)
-                if not os.path.exists(os.path.splitext(abs_path)[0] + ".png"):
-                    file = self.read_file(filename, force_decompress)
-                    if not file:
-                        continue
-                    local_dir = os.path.dirname(abs_path)
+            if cached_path:
+                shutil.copyfile(cached_path, png_path)
+                return None
 
-                    if not os.path.exists(local_dir):
-                        os.makedirs(local_dir)
+            try:
+                width, height, pixels = blp.decode_blp(file)
+            except blp.UnsupportedBLPError:
+                return filename
+            except (ValueError, IndexError, struct.error) as e:
+                # a damaged texture must not abort extraction of the others
+                print("\nFailed to decode texture <<{}>>: {}".format(filename, e))
+                return filename
 
-                    f = open(abs_path, 'wb')
-                    f.write(file or b'')
-                    f.close()
+            png = blp.encode_png(width, height, pixels)
 
-                    blp_paths.append(abs_path)
+            with open(png_path, 'wb') as f:
+                f.write(png)
+
+            if key:
+                self.texture_cache.put(key, png)
+
+            return None
+
+        unsupported = [filename for filename in self.get_executor().map(convert, filenames) if filename]
+
+        if not unsupported:
+            return
+
+        if self.converter:
+            blp_paths = [abs_path for abs_path in self.extract_files_batch(dir, unsupported, force_decompress).values()
+                         if abs_path]
+            blp_paths = list(OrderedDict.fromkeys(blp_paths))
 
             self.converter.convert(blp_paths)
 
@@ -87,11 +437,22 @@ class WoWFileData():
                 os.remove(blp_path)
 
         else:
-            print("\nPNG texture extraction failed. No converter executable specified or found")
+            print("\nPNG texture extraction failed for {} textures. No converter executable specified or found"
+                  .format(len(unsupported)))
+
+    def extract_textures_as_png_async(self, dir, filenames, force_decompress=False):
+        """ Extract textures as PNG images in background, returns a future finished when all textures are extracted """
+
+        # a separate thread, extraction itself waits for tasks of the main pool
+        if self.background_executor is None:
+            self.background_executor = ThreadPoolExecutor(max_workers=1)
+
+        return self.background_executor.submit(self.extract_textures_as_png, dir, list(filenames), force_decompress)
 
     @staticmethod
     def list_game_data_paths(path):
-        """List files and directories in a directory that correspond to WoW patch naming rules."""
+        """List files and directories in a directory that correspond to WoW patch naming rules,
+        ordered from the lowest to the highest priority."""
         dir_files = []
         for f in os.listdir(path):
             cur_path = os.path.join(path, f)
@@ -102,12 +463,17 @@ class WoWFileData():
             and re.match(r'patch-\w.mpq', f.lower()):
                 dir_files.append(cur_path)
 
-        map(lambda x: x.lower(), dir_files)
-
-        dir_files.sort(key=lambda s: os.path.splitext(s)[0])
+        dir_files.sort(key=WoWFileData.get_resource_priority)
 
         return dir_files
 
+    @staticmethod
+    def get_resource_priority(path):
+        """ Get sort key ordering game data paths from the lowest to the highest priority: base archives,
+        then patch.MPQ and numbered patches, a folder patch overriding an archive of the same name """
+        name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0].lower()
+        return name.startswith('patch'), name, not os.path.isfile(path)
+
     @staticmethod
     def is_wow_path_valid(wow_path):
         """Check if a given path is a path to WoW client."""
@@ -129,7 +495,7 @@ class WoWFileData():
 
             for package in data_packages:
                 if os.path.isfile(package):
-                    resource_map.append((mpyq.MPQArchive(package, listfile=False), True))
+                    resource_map.append((mpyq.MPQArchive(package, listfile=False, read_tables=False), True))
                     print("\nLoaded MPQ: " + os.path.basename(package))
                 else:
                     resource_map.append((package, False))
@@ -143,39 +509,123 @@ class WoWFileData():
             return None
 
 class BLPConverter:
-    def __init__(self, toolPath):
+    def __init__(self, toolPath, max_workers=None):
         if os.path.exists(toolPath):
             self.toolPath = toolPath
+            self.max_workers = max_workers or os.cpu_count() or 1
             print("\nFound BLP Converter executable: " + toolPath)
         else:
             raise Exception("\nNo BLPConverter found at given path: " + toolPath)
 
-    def convert(self, filepaths, alwaysReplace = False):
+    def get_batches(self, filepaths):
+        """ Split files into batches fitting the command line length limit, spread evenly among workers """
         init_length = len(self.toolPath) + 4
-        init_command = self.toolPath
+        batch_size = max(-(-len(filepaths) // self.max_workers), 1)
+        batches = []
         cur_length = 0
         cur_args = []
 
         for filepath in filepaths:
-            if alwaysReplace or not os.path.exists(os.path.splitext(filepath)[0] + ".png"):
-                length = len(filepath)
+            length = len(filepath)
 
-                if 2047 - (cur_length + init_length) < length + 2:
-                    final_command = [init_command, '/M']
-                    final_command.extend(cur_args)
-                    if subprocess.call(final_command):
-                        raise Exception("\nBLP convertion failed.")
-                    cur_length = 0
-                    cur_args = []
+            if cur_args and (2047 - (cur_length + init_length) < length + 2 or len(cur_args) >= batch_size):
+                batches.append(cur_args)
+                cur_length = 0
+                cur_args = []
 
-                cur_length += length + 3
-                cur_args.append(filepath)
+            cur_length += length + 3
+            cur_args.append(filepath)
 
-        if cur_length:
-            final_command = [init_command, '/M']
-            final_command.extend(cur_args)
-            if subprocess.call(final_command):
-                raise Exception("\nBLP convertion failed.")
+        if cur_args:
+            batches.append(cur_args)
+
+        return batches
+
+    def convert(self, filepaths, alwaysReplace = False):
+        """ Convert BLP files to PNG running batches in parallel processes. Returns files of failed batches """
+        filepaths = [filepath for filepath in filepaths
+                     if alwaysReplace or not os.path.exists(os.path.splitext(filepath)[0] + ".png")]
+
+        def run(batch):
+            final_command = [self.toolPath, '/M']
+            final_command.extend(batch)
+
+            try:
+                return subprocess.call(final_command)
+            except OSError as e:
+                print("\nFailed to run BLP converter: {}".format(e))
+                return -1
+
+        batches = self.get_batches(filepaths)
+        failed = []
+
+        # a failed batch does not stop the others
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch, return_code in zip(batches, executor.map(run, batches)):
+                if return_code:
+                    print("\nBLP convertion failed for {} files, starting with <<{}>>.".format(len(batch), batch[0]))
+                    failed.extend(batch)
+
+        return failed
+
+
+def update_wow_path(self, context):
+    """ Cached files belong to the previous client, drop them """
+    game_data = getattr(bpy, "wow_game_data", None)
+    if game_data and game_data.wow_path != self.wow_path:
+        game_data.invalidate_cache()
+
+
+def update_file_cache_size(self, context):
+    game_data = getattr(bpy, "wow_game_data", None)
+    if game_data:
+        game_data.cache.resize(self.file_cache_size * 1048576)
+
+
+def get_texture_cache(preferences):
+    """ Get texture cache in the user data directory, sized according to addon preferences """
+    cache_dir = bpy.utils.user_resource('DATAFILES', path=os.path.join('io_scene_wmo', 'textures'), create=True)
+    return TextureCache(cache_dir, preferences.texture_cache_size * 1048576)
+
+
+def update_texture_cache_size(self, context):
+    game_data = getattr(bpy, "wow_game_data", None)
+    if game_data and game_data.texture_cache:
+        game_data.texture_cache.max_size = self.texture_cache_size * 1048576
+
+
+class WOW_TEXTURE_CACHE_OP(bpy.types.Operator):
+    bl_idname = 'scene.wow_texture_cache'
+    bl_label = 'Texture Cache'
+    bl_description = 'Show statistics of the converted texture cache or clean it up'
+    bl_options = {'REGISTER'}
+
+    action = bpy.props.EnumProperty(
+        name="Action",
+        items=[('STATS', "Statistics", "Report size of the texture cache"),
+               ('TRIM', "Trim", "Remove least recently used textures exceeding the cache size"),
+               ('CLEAR', "Clear", "Remove all cached textures")],
+        default='STATS'
+    )
+
+    def execute(self, context):
+        game_data = getattr(bpy, "wow_game_data", None)
+
+        if game_data and game_data.texture_cache:
+            texture_cache = game_data.texture_cache
+        else:
+            texture_cache = get_texture_cache(context.user_preferences.addons.get("io_scene_wmo").preferences)
+
+        if self.action == 'CLEAR':
+            self.report({'INFO'}, "Removed {} cached textures.".format(texture_cache.clear()))
+        elif self.action == 'TRIM':
+            with texture_cache.lock:
+                n_removed = texture_cache.evict(texture_cache.max_size)
+            self.report({'INFO'}, "Removed {} cached textures.".format(n_removed))
+        else:
+            self.report({'INFO'}, "Texture cache: {}".format(texture_cache.get_stats()))
+
+        return {'FINISHED'}
 
 
 class WOW_FILESYSTEM_LOAD_OP(bpy.types.Operator):
@@ -195,7 +645,9 @@ class WOW_FILESYSTEM_LOAD_OP(bpy.types.Operator):
 
             preferences = bpy.context.user_preferences.addons.get("io_scene_wmo").preferences
 
-            bpy.wow_game_data = WoWFileData(preferences.wow_path, preferences.blp_path)
+            bpy.wow_game_data = WoWFileData(preferences.wow_path, preferences.blp_path,
+                                            preferences.file_cache_size * 1048576,
+                                            get_texture_cache(preferences))
 
             if not bpy.wow_game_data.files:
                 self.report({'ERROR'}, "WoW game data is not loaded. Check settings.")
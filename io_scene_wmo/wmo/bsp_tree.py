@@ -4,136 +4,327 @@ from .wmo_format import *
 from . import collision
 from .collision import *
 
+from ..disk_cache import DiskCache
+
+import bpy
 import mathutils
 from mathutils import *
 
-import sys
+import os
+import array
+import bisect
+import struct
+import hashlib
 
 
-class BSPTree:
-    def __init__(self):
-        self.Nodes = []
-        self.Faces = []
-        pass
-
-    # split box in two smaller, at dist calculated internally
-    def split_box(self, box, facesInBox, vertices, indices, axis):
-        # compute average of vertice positions
-        """count = 0
-        sum = 0
-        for iFace in range(len(facesInBox)):
-            sum += vertices[indices[facesInBox[iFace] * 3]][axis]
-            sum += vertices[indices[facesInBox[iFace] * 3 + 1]][axis]
-            sum += vertices[indices[facesInBox[iFace] * 3 + 2]][axis]
-            count += 1
-        splitDist = sum / count
-
-        # if split is out of box, just split in half
-        if(splitDist <= box[0][axis] or splitDist >= box[1][axis]):"""
-        split_dist = (box[0][axis] + box[1][axis]) / 2
+def to_float32(value):
+    """ Round a float to single precision, the way split planes are stored in MOBN """
+    return struct.unpack('f', struct.pack('f', value))[0]
 
-        new_box1 = (Vector((box[0][0], box[0][1], box[0][2])), Vector((box[1][0], box[1][1], box[1][2])))
-        new_box1[1][axis] = split_dist
 
-        new_box2 = (Vector((box[0][0], box[0][1], box[0][2])), Vector((box[1][0], box[1][1], box[1][2])))
-        new_box2[0][axis] = split_dist
-
-        # split dist absolute coordinate on split axis
-        # ret_splitDist = splitDist - ((box[0][axis] + box[1][axis]) / 2)
-        return split_dist, new_box1, new_box2
+class BSPTree:
 
-    # return index of add
-    def add_node(self, box, faces_in_box, vertices, indices, max_face_count):
+    # MIDPOINT splits the bigger box side in half, MEDIAN splits it at the median of face centroids,
+    # SAH picks the cheapest of binned candidate planes on all axes by surface area heuristic
+    split_strategies = ('MIDPOINT', 'MEDIAN', 'SAH')
 
-        node = BSP_Node()
+    # amount of candidate planes per axis evaluated by SAH
+    sah_bins = 16
 
-        i_node = len(self.Nodes)
-        self.Nodes.append(node)
+    # amount of consecutive splits which keep all faces of a node in one child before it is made a leaf.
+    # protects from endless splitting of degenerate geometry
+    max_stall_depth = 32
 
-        # part contain less than 30 polygons, lets end this, add final node
-        if len(faces_in_box) <= max_face_count:
-            node.PlaneType = BSP_PLANE_TYPE.Leaf
-            node.Children = (-1, -1)
-            node.NumFaces = len(faces_in_box)
-            node.FirstFace = len(self.Faces)
-            node.Dist = 0
+    def __init__(self, split_strategy='MIDPOINT'):
+        if split_strategy not in self.split_strategies:
+            raise ValueError("\nUnknown BSP split strategy: <<{}>>".format(split_strategy))
 
-            self.Faces.extend(faces_in_box)
-            return i_node
+        self.Nodes = []
+        self.Faces = []
+        self.split_strategy = split_strategy
+        self.n_faces = 0
 
-        # split bigger side
+    @staticmethod
+    def get_split_plane(box):
+        """ Get plane type splitting the bigger side of a box """
         box_size_x = box[1][0] - box[0][0]
         box_size_y = box[1][1] - box[0][1]
         box_size_z = box[1][2] - box[0][2]
 
         if box_size_x > box_size_y and box_size_x > box_size_z:
             # split on axis X (YZ plane)
-            plane_type = BSP_PLANE_TYPE.YZ_plane
+            return BSP_PLANE_TYPE.YZ_plane
         elif box_size_y > box_size_x and box_size_y > box_size_z:
             # split on axis Y (XZ plane)
-            plane_type = BSP_PLANE_TYPE.XZ_plane
-        else:
-            # split on axis Z (XY plane)
-            plane_type = BSP_PLANE_TYPE.XY_plane
+            return BSP_PLANE_TYPE.XZ_plane
 
-        split_result = self.split_box(box, faces_in_box, vertices, indices, plane_type)
+        # split on axis Z (XY plane)
+        return BSP_PLANE_TYPE.XY_plane
 
-        split_dist = split_result[0]
+    @staticmethod
+    def split_box(box, axis, split_dist):
+        """ Split box in two smaller ones at the given distance on the given axis """
+        new_box1 = (list(box[0]), list(box[1]))
+        new_box1[1][axis] = to_float32(split_dist)
 
-        child1_box = split_result[1]
-        child1_faces = []
+        new_box2 = (list(box[0]), list(box[1]))
+        new_box2[0][axis] = to_float32(split_dist)
 
-        # calculate faces in child1 box
-        for f in faces_in_box:
-            tri = (Vector((vertices[indices[f * 3]])),
-                   Vector((vertices[indices[f * 3 + 1]])),
-                   Vector((vertices[indices[f * 3 + 2]])))
+        return new_box1, new_box2
 
-            if collide_box_tri(child1_box, tri):
-                child1_faces.append(f)
+    def find_split(self, box, faces, triangles):
+        """ Get plane type and distance of the plane splitting a node, according to the split strategy """
+        if self.split_strategy == 'SAH':
+            split = self.find_sah_split(box, faces, triangles)
+            if split is not None:
+                return split
 
-        child2_box = split_result[2]
-        child2_faces = []
+        axis = self.get_split_plane(box)
+        split_dist = (box[0][axis] + box[1][axis]) / 2
 
-        # calculate faces in child2 box
-        for f in faces_in_box:
-            tri = (Vector((vertices[indices[f * 3]])),
-                   Vector((vertices[indices[f * 3 + 1]])),
-                   Vector((vertices[indices[f * 3 + 2]])))
+        if self.split_strategy == 'MEDIAN':
+            centroids = sorted(triangles.get_centroids(faces, axis))
+            median = centroids[len(centroids) // 2]
 
-            if collide_box_tri(child2_box, tri):
-                child2_faces.append(f)
+            # if split is out of box, just split in half
+            if box[0][axis] < median < box[1][axis]:
+                split_dist = median
 
-        # dont add child if there is no faces inside
-        if len(child1_faces) == 0:
-            i_child1 = -1
-        else:
-            i_child1 = self.add_node(child1_box, child1_faces, vertices, indices, max_face_count)
+        return axis, split_dist
 
-        if len(child2_faces) == 0:
-            i_child2 = -1
-        else:
-            i_child2 = self.add_node(child2_box, child2_faces, vertices, indices, max_face_count)
+    def find_sah_split(self, box, faces, triangles):
+        """ Find the split plane with the lowest surface area heuristic cost, None if no plane separates faces """
+        size = [box[1][i] - box[0][i] for i in range(3)]
+        n_faces = len(faces)
 
-        # node = BSP_Node()
-        node.PlaneType = plane_type
-        node.Children = (i_child1, i_child2)
-        node.NumFaces = 0
-        node.FirstFace = 0
-        node.Dist = split_dist
+        best_cost = None
+        best_split = None
 
-        return i_node
+        for axis in range(3):
+            if size[axis] <= 0:
+                continue
 
-    def GenerateBSP(self, vertices, indices, max_face_count):
-        resurs_limit = sys.getrecursionlimit()
-        sys.setrecursionlimit(100000)
+            faces_min, faces_max = triangles.get_bounds(faces, axis)
+            faces_min.sort()
+            faces_max.sort()
+
+            for i_bin in range(1, self.sah_bins):
+                split_dist = box[0][axis] + size[axis] * i_bin / self.sah_bins
+
+                # faces are duplicated to both children when they straddle the plane
+                n_left = bisect.bisect_right(faces_min, split_dist)
+                n_right = n_faces - bisect.bisect_left(faces_max, split_dist)
+
+                if n_left == n_faces and n_right == n_faces:
+                    continue
+
+                left = list(size)
+                left[axis] = split_dist - box[0][axis]
+                right = list(size)
+                right[axis] = box[1][axis] - split_dist
+
+                cost = n_left * (left[0] * left[1] + left[1] * left[2] + left[2] * left[0]) \
+                     + n_right * (right[0] * right[1] + right[1] * right[2] + right[2] * right[0])
+
+                if best_cost is None or cost < best_cost:
+                    best_cost = cost
+                    best_split = (axis, split_dist)
 
-        faces = []
-        for iFace in range(len(indices) // 3):
-            faces.append(iFace)
+        return best_split
+
+    def get_stats(self):
+        """ Get depth, node count, leaf count and face duplication ratio of the tree """
+        depth = 0
+        n_leaves = 0
+
+        stack = [(0, 1)] if self.Nodes else []
+        while stack:
+            i_node, node_depth = stack.pop()
+            depth = max(depth, node_depth)
+
+            node = self.Nodes[i_node]
+            if node.PlaneType == BSP_PLANE_TYPE.Leaf:
+                n_leaves += 1
+                continue
+
+            for i_child in node.Children:
+                if i_child >= 0:
+                    stack.append((i_child, node_depth + 1))
+
+        return {'depth': depth,
+                'nodes': len(self.Nodes),
+                'leaves': n_leaves,
+                'faces': self.n_faces,
+                'face_refs': len(self.Faces),
+                'duplication': len(self.Faces) / self.n_faces if self.n_faces else 0.0}
+
+    def GenerateBSP(self, vertices, indices, max_face_count):
+        """ Build BSP tree of triangles, nodes are stored in preorder """
+        n_faces = len(indices) // 3
+        self.n_faces = n_faces
+
+        # box independent parts of the triangle-box test are computed once for the whole tree
+        triangles = TriangleBatch([tuple(vertices[indices[i_face * 3]])
+                                   + tuple(vertices[indices[i_face * 3 + 1]])
+                                   + tuple(vertices[indices[i_face * 3 + 2]]) for i_face in range(n_faces)])
+
+        def faces_share_point(faces):
+            # any box containing a common point of all faces collides with all of them, so splitting never ends
+            points = set(tuple(vertices[i]) for i in indices[faces[0] * 3:faces[0] * 3 + 3])
+            for face in faces[1:]:
+                points.intersection_update(tuple(vertices[i]) for i in indices[face * 3:face * 3 + 3])
+                if not points:
+                    return False
+            return True
 
         box = calculate_bounding_box(vertices)
-        self.add_node(box, faces, vertices, indices, max_face_count)
+        box = (list(box[0]), list(box[1]))
+
+        # (box, faces, parent node, child slot, stall depth). Node index is assigned when popped,
+        # first child is pushed last so nodes end up in the same preorder as with recursive building
+        stack = [(box, list(range(n_faces)), None, 0, 0)]
+
+        while stack:
+            box, faces_in_box, parent, slot, stall_depth = stack.pop()
 
-        sys.setrecursionlimit(resurs_limit)
+            node = BSP_Node()
+
+            i_node = len(self.Nodes)
+            self.Nodes.append(node)
+
+            if parent is not None:
+                children = list(parent.Children)
+                children[slot] = i_node
+                parent.Children = tuple(children)
+
+            # part contain less than max_face_count polygons, lets end this, add final node
+            if len(faces_in_box) <= max_face_count or stall_depth > self.max_stall_depth \
+            or stall_depth and faces_share_point(faces_in_box):
+                node.PlaneType = BSP_PLANE_TYPE.Leaf
+                node.Children = (-1, -1)
+                node.NumFaces = len(faces_in_box)
+                node.FirstFace = len(self.Faces)
+                node.Dist = 0
+
+                self.Faces.extend(faces_in_box)
+                continue
+
+            plane_type, split_dist = self.find_split(box, faces_in_box, triangles)
+            child1_box, child2_box = self.split_box(box, plane_type, split_dist)
+
+            child1_mask, child2_mask = triangles.collide_split(child1_box, child2_box, faces_in_box)
+
+            child1_faces = [face for face, collides in zip(faces_in_box, child1_mask) if collides]
+            child2_faces = [face for face, collides in zip(faces_in_box, child2_mask) if collides]
+
+            # dont add child if there is no faces inside
+            node.PlaneType = plane_type
+            node.Children = (-1, -1)
+            node.NumFaces = 0
+            node.FirstFace = 0
+            node.Dist = split_dist
+
+            for child_slot, child_box, child_faces in ((1, child2_box, child2_faces), (0, child1_box, child1_faces)):
+                if child_faces:
+                    child_stall_depth = stall_depth + 1 if len(child_faces) == len(faces_in_box) else 0
+                    stack.append((child_box, child_faces, node, child_slot, child_stall_depth))
+
+
+class BSPCache(DiskCache):
+    """ Disk cache of BSP trees keyed by hash of the collision geometry, node size and split strategy """
+
+    extension = ".bsp"
+    item_name = "BSP"
+
+    # bump when trees built from the same input change
+    version = 1
+
+    # magic, version, face count, node count, face reference count
+    header = struct.Struct('4sIIII')
+    node = struct.Struct('hhhHIf')
+
+    def __init__(self, cache_dir, max_size=256 * 1048576):
+        DiskCache.__init__(self, cache_dir, max_size)
+
+    @classmethod
+    def for_user(cls):
+        """ Get cache located in the user data directory """
+        return cls(bpy.utils.user_resource('DATAFILES', path=os.path.join('io_scene_wmo', 'bsp'), create=True))
+
+    def get_key(self, vertices, indices, max_face_count, split_strategy):
+        sha = hashlib.sha1()
+        sha.update(pack_records('f', 3, vertices))
+        sha.update(array.array('H', indices).tobytes())
+        sha.update(repr((self.version, max_face_count, split_strategy)).encode('ascii'))
+        return sha.hexdigest()
+
+    def get(self, key, split_strategy):
+        """ Load a cached tree and mark it as recently used, None if it is not cached """
+        path = DiskCache.get(self, key)
+        if not path:
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(data) < self.header.size:
+            return None
+
+        magic, version, n_faces, n_nodes, n_face_refs = self.header.unpack_from(data)
+        if magic != b'WBSP' or version != self.version \
+        or len(data) != self.header.size + n_nodes * self.node.size + n_face_refs * 2:
+            return None
+
+        tree = BSPTree(split_strategy)
+        tree.n_faces = n_faces
+
+        for plane_type, child1, child2, num_faces, first_face, dist in \
+                self.node.iter_unpack(data[self.header.size:self.header.size + n_nodes * self.node.size]):
+            node = BSP_Node()
+            node.PlaneType = plane_type
+            node.Children = (child1, child2)
+            node.NumFaces = num_faces
+            node.FirstFace = first_face
+            node.Dist = dist
+            tree.Nodes.append(node)
+
+        faces = array.array('H')
+        faces.frombytes(data[self.header.size + n_nodes * self.node.size:])
+        tree.Faces = faces.tolist()
+
+        return tree
+
+    def put(self, key, tree):
+        """ Store a tree and evict old trees if the cache grew over its limit """
+        data = bytearray(self.header.pack(b'WBSP', self.version, tree.n_faces, len(tree.Nodes), len(tree.Faces)))
+
+        for node in tree.Nodes:
+            data += self.node.pack(node.PlaneType, node.Children[0], node.Children[1],
+                                   node.NumFaces, node.FirstFace, node.Dist)
+
+        data += array.array('H', tree.Faces).tobytes()
+
+        return DiskCache.put(self, key, data)
+
+
+def generate_bsp_tree(vertices, indices, max_face_count, split_strategy='MIDPOINT', cache=None):
+    """ Build BSP tree of triangles, or load it from cache if the same geometry was processed before """
+    if cache is None:
+        tree = BSPTree(split_strategy)
+        tree.GenerateBSP(vertices, indices, max_face_count)
+        return tree
+
+    key = cache.get_key(vertices, indices, max_face_count, split_strategy)
+    tree = cache.get(key, split_strategy)
+
+    if tree is None:
+        tree = BSPTree(split_strategy)
+        tree.GenerateBSP(vertices, indices, max_face_count)
+        cache.put(key, tree)
+    else:
+        print("\nLoaded cached BSP tree ({})".format(split_strategy))
 
+    return tree
@@ -0,0 +1,184 @@
+import io
+import mmap
+import struct
+
+from collections import namedtuple
+
+
+# offset points to the chunk header, size is the size of the chunk payload
+ChunkEntry = namedtuple('ChunkEntry', 'magic offset size')
+
+
+class ChunkDirectory:
+    """ Index of all chunks of a chunked WoW file, built in a single pass over its data """
+
+    # chunks that consist of a fixed-size header followed by nested chunks (magic: header size)
+    nested_chunks = {'PGOM': 68}
+
+    def __init__(self, data):
+        self.data = data
+        self.stream = data if isinstance(data, mmap.mmap) else io.BytesIO(data)
+        self.file = None
+        self.chunks = {}
+
+        self.scan()
+
+    @classmethod
+    def open(cls, filepath):
+        """ Memory-map a file from disk and index its chunks """
+        f = open(filepath, 'rb')
+
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            f.close()
+            raise Exception("\nFile <<{}>> is empty or corrupted.\a".format(filepath))
+
+        directory = cls(data)
+        directory.file = f
+        return directory
+
+    @classmethod
+    def from_file(cls, f):
+        """ Index chunks of an already opened binary file, mapping it when possible.
+        The file stays owned by the caller, close() only releases the mapping """
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+            data = f.read()
+
+        return cls(data)
+
+    def scan(self):
+        """ Walk chunk headers and record magic, offset and size of every chunk """
+        self.chunks = {}
+
+        pos = 0
+        end = len(self.data)
+
+        while pos + 8 <= end:
+            magic, size = struct.unpack_from("4sI", self.data, pos)
+            magic = magic.decode('ascii', 'replace')
+
+            nested_size = self.nested_chunks.get(magic)
+            if nested_size is not None:
+                size = nested_size
+
+            if pos + 8 + size > end:
+                print("\nWARNING: chunk <<{}>> at offset {} is truncated.".format(magic, pos))
+                break
+
+            self.chunks.setdefault(magic, []).append(ChunkEntry(magic, pos, size))
+            pos += 8 + size
+
+    def __contains__(self, magic):
+        return magic in self.chunks
+
+    def find(self, magic, index=0):
+        """ Get the entry of n-th chunk with the given magic, None if there is no such chunk """
+        entries = self.chunks.get(magic)
+        if entries is None or index >= len(entries):
+            return None
+        return entries[index]
+
+    def read_chunk(self, chunk, magic, index=0):
+        """ Decode a chunk with its own read method, return False if the chunk is not present """
+        entry = self.find(magic, index)
+        if entry is None:
+            return False
+
+        self.stream.seek(entry.offset)
+        chunk.read(self.stream)
+        return True
+
+    def view(self, magic, index=0):
+        """ Get a zero-copy memoryview of chunk payload, None if the chunk is not present """
+        entry = self.find(magic, index)
+        if entry is None:
+            return None
+
+        start = entry.offset + 8
+        return memoryview(self.data)[start:start + entry.size]
+
+    def close(self):
+        """ Release the mapping and the file opened by open(). Mappings with memoryviews still alive
+        are left to the garbage collector """
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                pass
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class LazyChunkFile:
+    """ Base for files which decode chunks from a ChunkDirectory on first attribute access """
+
+    # (attribute name, chunk magic, occurrence index) triplets
+    chunk_attributes = ()
+
+    def bind_directory(self, directory):
+        """ Attach a chunk directory, chunk attributes present in it are decoded on first access """
+        self.__dict__['chunk_directory'] = directory
+        pending = self.__dict__.setdefault('pending_chunks', {})
+
+        for attr, magic, index in self.chunk_attributes:
+            if directory.find(magic, index) is not None and attr in self.__dict__:
+                pending[attr] = (self.__dict__.pop(attr), magic, index)
+
+        if not pending:
+            self.release_directory()
+
+    def read_chunks(self, directory, lazy=False):
+        """ Dispatch chunks found in a directory to chunk attributes. Unknown chunks are skipped """
+        self.bind_directory(directory)
+
+        if not lazy:
+            LazyChunkFile.close(self)
+
+    def __getattr__(self, name):
+        pending = self.__dict__.get('pending_chunks')
+
+        if not pending or name not in pending:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+        chunk, magic, index = pending.pop(name)
+        self.__dict__[name] = chunk
+        self.decode_chunk(name, chunk, magic, index)
+
+        # only this file's own mapping is released, files it owns stay lazy until closed explicitly
+        if not pending:
+            self.release_directory()
+
+        return chunk
+
+    def decode_chunk(self, name, chunk, magic, index):
+        """ Decode a pending chunk. Override to prepare chunks that depend on other chunks """
+        self.chunk_directory.read_chunk(chunk, magic, index)
+
+    def raw_chunk(self, magic, index=0):
+        """ Get raw chunk payload as a memoryview without decoding it """
+        directory = self.__dict__.get('chunk_directory')
+        return directory.view(magic, index) if directory else None
+
+    def close(self):
+        """ Release the underlying file. Chunks that were not accessed yet are decoded first """
+        pending = self.__dict__.get('pending_chunks')
+        while pending:
+            name = next(iter(pending))
+            if name in self.__dict__:
+                # chunk was replaced by the caller, no need to decode it
+                del pending[name]
+            else:
+                getattr(self, name)
+
+        self.release_directory()
+
+    def release_directory(self):
+        """ Release the chunk directory once no chunk is pending """
+        directory = self.__dict__.pop('chunk_directory', None)
+        if directory:
+            directory.close()
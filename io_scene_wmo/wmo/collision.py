@@ -1,145 +1,27 @@
 from mathutils import Vector
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def proj_overlap(poly1_min, poly1_max, poly2_min, poly2_max):
     """ Return true if projections of 2 polygons are overlapping """
     return False if poly1_max < poly2_min or poly2_max < poly1_min else True
 
 
-# return min coordinate and max coordinate of a vertex list in a tuple
-def get_min_max(vertList):
-    min = Vector(vertList[0])
-    max = Vector(vertList[0])
-    for v in vertList:
-        if v.x < min.x:
-            min.x = v.x
-        elif v.x > max.x:
-            max.x = v.x
-        if v.y < min.y:
-            min.y = v.y
-        elif v.y > max.y:
-            max.y = v.y
-        if v.z < min.z:
-            min.z = v.z
-        elif v.z > max.z:
-            max.z = v.z
-    return min, max
-
-
-def project_point(pt, v):
-    """ Return projection of point with given direction vector """
-    proj = Vector()
-    # project on X
-    if v.y == 0:
-        l = 0
-    else:
-        l = - pt.y / v.y
-    proj.z = pt.x + l * v.x
-    # project on Y
-    if v.z == 0:
-        l = 0
-    else:
-        l = - pt.z / v.z
-    proj.y = pt.x + l * v.x
-    # project on Z
-    proj.x = pt.y + l * v.y
-    return proj
-
-
-def plane_box_overlap(normal, vert, box):
-    v_min = Vector()
-    v_max = Vector()
-    for q in range(0, 3):
-        v = vert[q]
-        if normal[q] > 0.0:
-            v_min[q] = box[0][q] - v
-            v_max[q] = box[1][q] - v
-        else:
-            v_min[q] = box[1][q] - v
-            v_max[q] = box[0][q] - v
-
-    return True if normal.dot(v_max) >= 0.0 else False
-
-
-def collide_box_tri(box, triangle):
-    """ Return True if AABB and triangle overlap """
-
-    triangle_min_max = get_min_max(triangle)
-    # check if overlap on box axis
-    if not proj_overlap(box[0].x, box[1].x, triangle_min_max[0].x, triangle_min_max[1].x) \
-    or not proj_overlap(box[0].y, box[1].y, triangle_min_max[0].y, triangle_min_max[1].y) \
-    or not proj_overlap(box[0].z, box[1].z, triangle_min_max[0].z, triangle_min_max[1].z):
-       return False
-
-    pt_box = [
-        Vector(box[0].xyz),
-        Vector((box[0].x, box[1].y, box[0].z)),
-        Vector((box[1].x, box[1].y, box[0].z)),
-        Vector((box[1].x, box[0].y, box[0].z)),
-        Vector(box[1].xyz),
-        Vector((box[0].x, box[1].y, box[1].z)),
-        Vector((box[1].x, box[1].y, box[1].z)),
-        Vector((box[1].x, box[0].y, box[1].z))
-    ]
-
-    def check_overlaps(projected_box_min_max, projected_triangle_min_max):
-
-        if not proj_overlap(projected_box_min_max[0].x,
-                            projected_box_min_max[1].x,
-                            projected_triangle_min_max[0].x,
-                            projected_triangle_min_max[1].x) \
-        or not proj_overlap(projected_box_min_max[0].y,
-                            projected_box_min_max[1].y,
-                            projected_triangle_min_max[0].y,
-                            projected_triangle_min_max[1].y) \
-        or not proj_overlap(projected_box_min_max[0].z,
-                            projected_box_min_max[1].z,
-                            projected_triangle_min_max[0].z,
-                            projected_triangle_min_max[1].z):
-            return True
-
-        return False
-
-    # project on edge 1 axis
-    E0 = triangle[1] - triangle[0]
-    pt_box_projected = []
-    pt_triangle_projected = []
-
-    for pt in pt_box:
-        pt_box_projected.append(project_point(pt, E0))
-    for pt in triangle:
-        pt_triangle_projected.append(project_point(pt, E0))
-
-    if check_overlaps(get_min_max(pt_box_projected), get_min_max(pt_triangle_projected)):
-        return False
+# corners of a box in the order the triangle-box test always used, (0, 0, 1) corner is not tested
+BOX_CORNERS = ((0, 0, 0), (0, 1, 0), (1, 1, 0), (1, 0, 0), (1, 1, 1), (0, 1, 1), (1, 1, 1), (1, 0, 1))
 
-    # project on edge 2 axis
-    E1 = triangle[2] - triangle[1]
-    pt_box_projected = []
-    pt_triangle_projected = []
 
-    for pt in pt_box:
-        pt_box_projected.append(project_point(pt, E1))
-    for pt in triangle:
-        pt_triangle_projected.append(project_point(pt, E1))
+def project_coords(x, y, z, v):
+    """ Return projection of point coordinates with given direction vector """
+    l = 0 if v[1] == 0 else - y / v[1]
+    proj_z = x + l * v[0]
 
-    if check_overlaps(get_min_max(pt_box_projected), get_min_max(pt_triangle_projected)):
-        return False
-
-   # project on edge 3 axis
-    E2 = triangle[0] - triangle[2]
-    pt_box_projected = []
-    pt_triangle_projected = []
-    for pt in pt_box:
-        pt_box_projected.append(project_point(pt, E2))
-    for pt in triangle:
-        pt_triangle_projected.append(project_point(pt, E2))
-
-    if check_overlaps(get_min_max(pt_box_projected), get_min_max(pt_triangle_projected)) \
-    or not plane_box_overlap(E0.cross(E1), triangle[0], box):
-        return False
-
-    return True
+    l = 0 if v[2] == 0 else - z / v[2]
+    return y + l * v[1], x + l * v[0], proj_z
 
 
 def calculate_bounding_box(vertices):
@@ -158,4 +40,182 @@ def calculate_bounding_box(vertices):
             corner1[2] = v[2]
         elif v[2] > corner2[2]:
             corner2[2] = v[2]
-    return corner1, corner2
\ No newline at end of file
+    return corner1, corner2
+
+
+class TriangleBatch:
+    """ Triangles prepared for classification against many boxes. Box independent parts of the
+    triangle-box test are computed once, classification runs on NumPy arrays when NumPy is available """
+
+    def __init__(self, triangles):
+        """ Takes a sequence of triangles, each given as 9 coordinates """
+        self.count = len(triangles)
+
+        if numpy is not None:
+            self.init_numpy(triangles)
+        else:
+            self.init_python(triangles)
+
+    def init_numpy(self, triangles):
+        tris = numpy.asarray(triangles, dtype=numpy.float64).reshape(-1, 3, 3)
+
+        self.points = tris
+        self.min = tris.min(axis=1)
+        self.max = tris.max(axis=1)
+        self.edges = (tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 1], tris[:, 0] - tris[:, 2])
+
+        self.projected_min = []
+        self.projected_max = []
+
+        for edge in self.edges:
+            projected = numpy.stack([self.project(tris[:, i, 0], tris[:, i, 1], tris[:, i, 2], edge)
+                                     for i in range(3)], axis=1)
+            self.projected_min.append(projected.min(axis=1))
+            self.projected_max.append(projected.max(axis=1))
+
+        e0, e1 = self.edges[0], self.edges[1]
+        self.normals = numpy.stack((e0[:, 1] * e1[:, 2] - e0[:, 2] * e1[:, 1],
+                                    e0[:, 2] * e1[:, 0] - e0[:, 0] * e1[:, 2],
+                                    e0[:, 0] * e1[:, 1] - e0[:, 1] * e1[:, 0]), axis=1)
+
+    def init_python(self, triangles):
+        self.points = []
+        self.min = []
+        self.max = []
+        self.edges = []
+        self.projected_min = []
+        self.projected_max = []
+        self.normals = []
+
+        for tri in triangles:
+            points = (tuple(tri[0:3]), tuple(tri[3:6]), tuple(tri[6:9]))
+            edges = tuple(tuple(points[(i + 1) % 3][j] - points[i][j] for j in range(3)) for i in range(3))
+
+            projected_min = []
+            projected_max = []
+            for edge in edges:
+                projected = [project_coords(pt[0], pt[1], pt[2], edge) for pt in points]
+                projected_min.append(tuple(min(p[i] for p in projected) for i in range(3)))
+                projected_max.append(tuple(max(p[i] for p in projected) for i in range(3)))
+
+            e0, e1 = edges[0], edges[1]
+
+            self.points.append(points)
+            self.min.append(tuple(min(pt[i] for pt in points) for i in range(3)))
+            self.max.append(tuple(max(pt[i] for pt in points) for i in range(3)))
+            self.edges.append(edges)
+            self.projected_min.append(projected_min)
+            self.projected_max.append(projected_max)
+            self.normals.append((e0[1] * e1[2] - e0[2] * e1[1],
+                                 e0[2] * e1[0] - e0[0] * e1[2],
+                                 e0[0] * e1[1] - e0[1] * e1[0]))
+
+    @staticmethod
+    def project(x, y, z, v):
+        """ Vectorized project_coords of points on per triangle direction vectors """
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            l = numpy.where(v[..., 1] == 0, 0.0, - y / v[..., 1])
+            proj_z = x + l * v[..., 0]
+
+            l = numpy.where(v[..., 2] == 0, 0.0, - z / v[..., 2])
+            return numpy.stack((y + l * v[..., 1], x + l * v[..., 0], proj_z), axis=-1)
+
+    def get_bounds(self, faces, axis):
+        """ Get lists of bounding box minimums and maximums of the given triangles on an axis """
+        if numpy is not None:
+            faces = numpy.asarray(faces, dtype=numpy.intp)
+            return self.min[faces, axis].tolist(), self.max[faces, axis].tolist()
+
+        return [self.min[face][axis] for face in faces], [self.max[face][axis] for face in faces]
+
+    def get_centroids(self, faces, axis):
+        """ Get a list of centroid coordinates of the given triangles on an axis """
+        if numpy is not None:
+            points = self.points[numpy.asarray(faces, dtype=numpy.intp), :, axis]
+            return ((points[:, 0] + points[:, 1] + points[:, 2]) / 3).tolist()
+
+        return [(self.points[face][0][axis] + self.points[face][1][axis] + self.points[face][2][axis]) / 3
+                for face in faces]
+
+    def collide_box(self, box, faces=None):
+        """ Get a mask of triangles overlapping the box. Only triangles straddling the box boundary
+        run the exact test, faces optionally selects a subset of triangles """
+        if faces is None:
+            faces = range(self.count)
+
+        if numpy is not None:
+            return self.collide_box_numpy(box, numpy.asarray(faces, dtype=numpy.intp))
+
+        return [self.collide_box_python(box, face) for face in faces]
+
+    def collide_split(self, box1, box2, faces=None):
+        """ Get masks of triangles overlapping each of two boxes resulting from a split """
+        return self.collide_box(box1, faces), self.collide_box(box2, faces)
+
+    def collide_box_numpy(self, box, faces):
+        box_min = numpy.asarray(box[0], dtype=numpy.float64)
+        box_max = numpy.asarray(box[1], dtype=numpy.float64)
+
+        tri_min = self.min[faces]
+        tri_max = self.max[faces]
+
+        overlap = numpy.all((box_max >= tri_min) & (tri_max >= box_min), axis=1)
+        inside = numpy.all((box_min <= tri_min) & (tri_max <= box_max), axis=1)
+
+        mask = overlap & inside
+        straddling = numpy.nonzero(overlap & ~inside)[0]
+
+        if not len(straddling):
+            return mask
+
+        selected = faces[straddling]
+        separated = numpy.zeros(len(selected), dtype=bool)
+
+        corners = numpy.array([[box[corner[i]][i] for i in range(3)] for corner in BOX_CORNERS], dtype=numpy.float64)
+
+        for i_edge, edges in enumerate(self.edges):
+            edge = edges[selected][:, None, :]
+            projected = self.project(corners[None, :, 0], corners[None, :, 1], corners[None, :, 2], edge)
+
+            separated |= numpy.any((projected.max(axis=1) < self.projected_min[i_edge][selected])
+                                   | (self.projected_max[i_edge][selected] < projected.min(axis=1)), axis=1)
+
+        normals = self.normals[selected]
+        first_points = self.points[selected, 0]
+        v_max = numpy.where(normals > 0.0, box_max - first_points, box_min - first_points)
+
+        separated |= normals[:, 0] * v_max[:, 0] + normals[:, 1] * v_max[:, 1] + normals[:, 2] * v_max[:, 2] < 0.0
+
+        mask[straddling] = ~separated
+        return mask
+
+    def collide_box_python(self, box, face):
+        tri_min = self.min[face]
+        tri_max = self.max[face]
+
+        # check if overlap on box axis
+        for i in range(3):
+            if not proj_overlap(box[0][i], box[1][i], tri_min[i], tri_max[i]):
+                return False
+
+        if box[0][0] <= tri_min[0] and tri_max[0] <= box[1][0] \
+        and box[0][1] <= tri_min[1] and tri_max[1] <= box[1][1] \
+        and box[0][2] <= tri_min[2] and tri_max[2] <= box[1][2]:
+            return True
+
+        corners = [[box[corner[i]][i] for i in range(3)] for corner in BOX_CORNERS]
+
+        # project on edge axes
+        for i_edge, edge in enumerate(self.edges[face]):
+            projected = [project_coords(pt[0], pt[1], pt[2], edge) for pt in corners]
+
+            for i in range(3):
+                if not proj_overlap(min(p[i] for p in projected), max(p[i] for p in projected),
+                                    self.projected_min[face][i_edge][i], self.projected_max[face][i_edge][i]):
+                    return False
+
+        normal = self.normals[face]
+        point = self.points[face][0]
+        v_max = [(box[1][q] if normal[q] > 0.0 else box[0][q]) - point[q] for q in range(3)]
+
+        return normal[0] * v_max[0] + normal[1] * v_max[1] + normal[2] * v_max[2] >= 0.0
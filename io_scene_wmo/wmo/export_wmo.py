@@ -1,12 +1,20 @@
 from .wmo_file import WMOFile
 from .wmo_group import WMOGroupFile
+from .bsp_tree import BSPTree, BSPCache
+from .group_cache import GroupCache
+from concurrent.futures import ThreadPoolExecutor
 
 import bpy
+import os
 import time
 
 
-def export_wmo_from_blender_scene(filepath, autofill_textures, export_selected):
-    """ Export WoW WMO object from Blender scene to files """
+def export_wmo_from_blender_scene(filepath, autofill_textures, export_selected,
+                                  bsp_split_strategy='MIDPOINT', compare_bsp_strategies=False, incremental=False,
+                                  parallel_writing=False):
+    """ Export WoW WMO object from Blender scene to files. Returns BSP tree statistics summed over groups.
+    Incremental export reuses geometry of groups unchanged since the previous export from a sidecar cache.
+    Parallel writing serializes saved groups in a pool of threads while next groups are being saved """
 
     start_time = time.time()
 
@@ -14,6 +22,11 @@ def export_wmo_from_blender_scene(filepath, autofill_textures, export_selected):
     # print("\nScene successfully validated")
 
     wmo = WMOFile(filepath)
+    group_cache = GroupCache.for_wmo(filepath) if incremental else None
+    bsp_cache = BSPCache.for_user()
+
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1) if parallel_writing else None
+    group_data = []
 
     wmo.bl_scene_objects.build_references(export_selected)
 
@@ -44,17 +57,12 @@ def export_wmo_from_blender_scene(filepath, autofill_textures, export_selected):
         g_start_time = time.time()
 
         for index, group in enumerate(wmo.groups):
-            obj = wmo.bl_scene_objects.groups[index]
-            proxy_obj = obj.copy()
-            proxy_obj.data = obj.data.copy()
-            bpy.context.scene.objects.link(proxy_obj)
-            try:
-                group.save(obj, proxy_obj, autofill_textures)
-            except Exception as exception:
-                bpy.data.objects.remove(proxy_obj, do_unlink=True)
-                raise exception
-            else:
-                bpy.data.objects.remove(proxy_obj, do_unlink=True)
+            group.save(wmo.bl_scene_objects.groups[index], autofill_textures, bsp_split_strategy, compare_bsp_strategies,
+                       group_cache, bsp_cache)
+
+            # saved group no longer depends on the scene, it is serialized while next groups are built
+            if executor is not None:
+                group_data.append(executor.submit(group.serialize))
 
         print("\nDone saving groups. "
               "\nTotal saving time: ", time.strftime("%M minutes %S seconds", time.gmtime(time.time() - g_start_time)))
@@ -64,12 +72,52 @@ def export_wmo_from_blender_scene(filepath, autofill_textures, export_selected):
     except Exception as exception:
         restore_doodads()
         wmo.bl_scene_objects.clear_references()
+
+        if executor is not None:
+            executor.shutdown(wait=False)
+
         raise exception
     else:
         restore_doodads()
         wmo.bl_scene_objects.clear_references()
 
-    wmo.write()
+    if executor is not None:
+        with executor:
+            group_data = [future.result() for future in group_data]
+
+    wmo.write(group_data)
+
+    if group_cache is not None:
+        for index, group in enumerate(wmo.groups):
+            if group.cache_entry is not None:
+                group_cache.put(group.cache_entry[0], wmo.get_group_path(index), group.cache_entry[1])
+
+        group_cache.trim()
 
     print("\nExport finished successfully. "
           "\nTotal export time: ", time.strftime("%M minutes %S seconds\a", time.gmtime(time.time() - start_time)))
+
+    return get_bsp_stats(wmo.groups)
+
+
+def get_bsp_stats(groups):
+    """ Sum up BSP tree statistics of all groups for each split strategy """
+    bsp_stats = {}
+
+    for strategy in BSPTree.split_strategies:
+        group_stats = [group.bsp_stats[strategy] for group in groups if strategy in group.bsp_stats]
+
+        if not group_stats:
+            continue
+
+        n_faces = sum(stats['faces'] for stats in group_stats)
+        n_face_refs = sum(stats['face_refs'] for stats in group_stats)
+
+        bsp_stats[strategy] = {'depth': max(stats['depth'] for stats in group_stats),
+                               'nodes': sum(stats['nodes'] for stats in group_stats),
+                               'leaves': sum(stats['leaves'] for stats in group_stats),
+                               'faces': n_faces,
+                               'face_refs': n_face_refs,
+                               'duplication': n_face_refs / n_faces if n_faces else 0.0}
+
+    return bsp_stats
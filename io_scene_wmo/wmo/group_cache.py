@@ -0,0 +1,95 @@
+import os
+import json
+import threading
+
+
+class RawChunk:
+    """ Already serialized chunk, including its header, written back as is """
+
+    def __init__(self, data):
+        self.data = data
+
+    def size(self):
+        return len(self.data) - 8
+
+    def pack_into(self, buffer, offset):
+        buffer[offset:offset + len(self.data)] = self.data
+        return offset + len(self.data)
+
+    def write(self, f):
+        f.write(self.data)
+
+
+class GroupCache:
+    """ Sidecar cache of exported WMO group files, keyed by fingerprints of their source data.
+    Entries not used by the last export are removed, so the cache only holds the current state of a WMO. """
+
+    # bump when exported group data changes for the same input
+    version = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.used = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_wmo(cls, filepath):
+        return cls(os.path.splitext(filepath)[0] + "_export_cache")
+
+    def get_path(self, fingerprint, ext):
+        return os.path.join(self.cache_dir, fingerprint + ext)
+
+    def get(self, fingerprint):
+        """ Get (metadata, group file bytes) of a cached group, None if it is not cached """
+        try:
+            with open(self.get_path(fingerprint, ".json"), 'r') as f:
+                metadata = json.load(f)
+
+            with open(self.get_path(fingerprint, ".wmo"), 'rb') as f:
+                data = f.read()
+
+        except (OSError, ValueError):
+            return None
+
+        with self.lock:
+            self.used.add(fingerprint)
+
+        return metadata, data
+
+    def put(self, fingerprint, filepath, metadata):
+        """ Store a written group file with metadata needed to reuse it """
+        tmp_suffix = ".{}.tmp".format(threading.get_ident())
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            with open(filepath, 'rb') as f:
+                data = f.read()
+
+            # metadata is written last, entries without it are never read
+            for ext, content, mode in ((".wmo", data, 'wb'), (".json", json.dumps(metadata), 'w')):
+                path = self.get_path(fingerprint, ext)
+
+                with open(path + tmp_suffix, mode) as f:
+                    f.write(content)
+
+                os.replace(path + tmp_suffix, path)
+
+        except OSError as e:
+            print("\nWARNING: failed to cache group file <<{}>>: {}".format(filepath, e))
+            return
+
+        with self.lock:
+            self.used.add(fingerprint)
+
+    def trim(self):
+        """ Remove entries which were not used since the cache was opened """
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.split('.')[0] not in self.used:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
@@ -5,17 +5,18 @@ import time
 from .wmo_file import WMOFile
 
 
-def import_wmo_to_blender_scene(filepath, load_textures, import_doodads, group_objects):
+def import_wmo_to_blender_scene(filepath, load_textures, import_doodads, group_objects, parallel_reading=False):
     """ Read and import WoW WMO object to Blender scene"""
 
     start_time = time.time()
 
     wmo = WMOFile(filepath)
-    wmo.read()
+    wmo.read(workers=(os.cpu_count() or 1) if parallel_reading else 0)
 
     print("\n\n### Importing WMO components ###")
 
     game_data = None
+    textures_future = None
 
     if load_textures or import_doodads:
         game_data = getattr(bpy, "wow_game_data", None)
@@ -28,7 +29,10 @@ def import_wmo_to_blender_scene(filepath, load_textures, import_doodads, group_o
         if game_data.files:
             if load_textures:
                 print("\n\n### Extracting textures ###")
-                game_data.extract_textures_as_png(os.path.dirname(filepath), wmo.motx.get_all_strings())
+
+                # textures are extracted in background while root file components are imported
+                textures_future = game_data.extract_textures_as_png_async(os.path.dirname(filepath),
+                                                                          wmo.motx.get_all_strings())
         else:
             print("\nFailed to load textures because game data was not loaded.")
 
@@ -41,13 +45,18 @@ def import_wmo_to_blender_scene(filepath, load_textures, import_doodads, group_o
         wmo.parent = parent
 
     # load all materials in root file
-    wmo.load_materials()
+    wmo.load_materials(load_textures=textures_future is None)
 
     # load all WMO components
     wmo.load_lights()
     wmo.load_properties()
     wmo.load_fogs()
 
+    # groups assign material images to faces, so textures must be loaded before them
+    if textures_future:
+        textures_future.result()
+        wmo.load_textures()
+
     print("\n\n### Importing WMO groups ###")
 
     for group in wmo.groups:
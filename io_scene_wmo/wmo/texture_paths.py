@@ -0,0 +1,40 @@
+import bpy
+import os
+import sys
+
+
+def fill_textures(objects):
+    """ Fill Texture 1 field of WoW materials of objects with game paths of applied images """
+
+    if not hasattr(bpy, "wow_game_data"):
+        print("\n\n### Loading game data ###")
+        bpy.ops.scene.load_wow_filesystem()
+
+    game_data = bpy.wow_game_data
+
+    for ob in objects:
+        mesh = ob.data
+        for i in range(len(mesh.materials)):
+            if mesh.materials[i].active_texture is not None \
+                    and not mesh.materials[i].WowMaterial.Texture1 \
+                    and mesh.materials[i].active_texture.type == 'IMAGE' \
+                    and mesh.materials[i].active_texture.image is not None:
+                path = (os.path.splitext(bpy.path.abspath(mesh.materials[i].active_texture.image.filepath))[0] + ".blp", "")
+                rest_path = ""
+
+                while True:
+                    path = os.path.split(path[0])
+                    if not path[1]:
+                        print("\nTexture <<{}>> not found.".format(mesh.materials[i].active_texture.image.filepath))
+                        break
+
+                    rest_path = os.path.join(path[1], rest_path)
+                    rest_path = rest_path[:-1] if rest_path.endswith("\\") else rest_path
+
+                    sys.stdout = open(os.devnull, 'w')
+
+                    if game_data.read_file(rest_path):
+                        mesh.materials[i].WowMaterial.Texture1 = rest_path
+                        break
+
+                    sys.stdout = sys.__stdout__
@@ -69,3 +69,9 @@ light_type_enum = [
     ('0', "Omni", ""), ('1', "Spot", ""),
     ('2', "Direct", ""), ('3', "Ambient", "")
 ]
+
+bsp_split_strategy_enum = [
+    ('MIDPOINT', "Midpoint", "Split nodes at the middle of their bigger side"),
+    ('MEDIAN', "Median", "Split nodes at the median of face centroids on their bigger side"),
+    ('SAH', "Surface area heuristic", "Split nodes at the cheapest plane found by surface area heuristic")
+]
@@ -1,7 +1,9 @@
 from .wmo_group import *
 from .wmo_format import *
+from .chunk_directory import ChunkDirectory, LazyChunkFile
 from ..m2 import import_m2 as m2
 from mathutils.kdtree import KDTree
+from concurrent.futures import ThreadPoolExecutor
 
 import bpy
 import operator
@@ -9,9 +11,69 @@ import os
 import time
 
 
-class WMOFile:
+def remove_temporary_files(tmp_paths):
+    for tmp_path in tmp_paths:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def write_files_atomic(files):
+    """ Write (path, data) pairs to temporary files, then rename them over the target files one by one.
+    Nothing is replaced if writing any of them fails. Each file is replaced atomically, but a failed rename
+    leaves the files renamed before it replaced: the error lists them and remaining temporary files are removed """
+    tmp_paths = []
+
+    try:
+        for path, data in files:
+            tmp_path = path + ".tmp"
+            tmp_paths.append(tmp_path)
+
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+
+    except BaseException:
+        remove_temporary_files(tmp_paths)
+        raise
+
+    replaced = []
+
+    for tmp_path, (path, data) in zip(tmp_paths, files):
+        try:
+            os.replace(tmp_path, path)
+        except OSError as e:
+            remove_temporary_files(tmp_paths[len(replaced):])
+            raise Exception("\nFailed to replace file <<{}>>: {}\nFiles already replaced: {}\a".format(
+                path, e, ", ".join(os.path.basename(p) for p in replaced) or "none"))
+
+        replaced.append(path)
+
+
+class WMOFile(LazyChunkFile):
     """ World of Warcraft WMO """
 
+    chunk_attributes = (
+        ('mver', 'REVM', 0),
+        ('mohd', 'DHOM', 0),
+        ('motx', 'XTOM', 0),
+        ('momt', 'TMOM', 0),
+        ('mogn', 'NGOM', 0),
+        ('mogi', 'IGOM', 0),
+        ('mosb', 'BSOM', 0),
+        ('mopv', 'VPOM', 0),
+        ('mopt', 'TPOM', 0),
+        ('mopr', 'RPOM', 0),
+        ('movv', 'VVOM', 0),
+        ('movb', 'BVOM', 0),
+        ('molt', 'TLOM', 0),
+        ('mods', 'SDOM', 0),
+        ('modn', 'NDOM', 0),
+        ('modd', 'DDOM', 0),
+        ('mfog', 'GOFM', 0),
+        ('mcvp', 'PVCM', 0)
+    )
+
     def __init__(self, filepath):
         self.filepath = filepath
         self.groups = []
@@ -40,101 +102,99 @@ class WMOFile:
         self.mfog = MFOG_chunk()
         self.mcvp = MCVP_chunk()
 
-    def read(self):
-        """ Read WMO data from files into memory """
+    def read(self, lazy=False, workers=0):
+        """ Read WMO data from files into memory. Lazy mode maps the files and decodes chunks on first access,
+        with workers > 1 group files are parsed by a pool of threads """
 
         start_time = time.time()
 
-        with open(self.filepath, "rb") as f:
-
-            # check if file is a WMO root or a WMO group, or unknown
-            f.seek(12)
-            hdr = ChunkHeader()
-            hdr.read(f)
-            f.seek(0)
-
-            if hdr.Magic == "DHOM":
-                self.mver.read(f)
-                self.mohd.read(f)
-                self.motx.read(f)
-                self.momt.read(f)
-                self.mogn.read(f)
-                self.mogi.read(f)
-                self.mosb.read(f)
-                self.mopv.read(f)
-                self.mopt.read(f)
-                self.mopr.read(f)
-                self.movv.read(f)
-                self.movb.read(f)
-                self.molt.read(f)
-                self.mods.read(f)
-                self.modn.read(f)
-                self.modd.read(f)
-                self.mfog.read(f)
-
-                if f.tell() != os.fstat(f.fileno()).st_size:
-                    self.mcvp.read(f)
-
-                print("\nDone reading root file: <<" + os.path.basename(f.name) + ">>")
-                root_name = os.path.splitext(self.filepath)[0]
-
-
-                for i in range(self.mohd.nGroups):
-                    group_name = root_name + "_" + str(i).zfill(3) + ".wmo"
-
-                    if not os.path.isfile(group_name):
-                        raise FileNotFoundError("\nNot all referenced WMO groups are present in the directory.\a")
-
-                    group = WMOGroupFile(self)
-                    group.read(open(group_name, 'rb'))
-                    self.groups.append(group)
-
-            elif hdr.Magic == "PGOM":
+        # check if file is a WMO root or a WMO group, or unknown
+        directory = ChunkDirectory.open(self.filepath)
+
+        if 'DHOM' not in directory:
+            is_group = 'PGOM' in directory
+            directory.close()
+
+            if is_group:
                 raise NotImplementedError("\nImport of separate WMO group files is not supported. "
                                           "Please import the root file.\a")
 
-            else:
-                raise Exception("\nFile is not a WMO file or corrupted.\a")
+            raise Exception("\nFile is not a WMO file or corrupted.\a")
+
+        self.read_chunks(directory, lazy)
+        print("\nDone reading root file: <<" + os.path.basename(self.filepath) + ">>")
+
+        root_name = os.path.splitext(self.filepath)[0]
+        group_names = []
+
+        for i in range(self.mohd.nGroups):
+            group_name = root_name + "_" + str(i).zfill(3) + ".wmo"
+
+            if not os.path.isfile(group_name):
+                raise FileNotFoundError("\nNot all referenced WMO groups are present in the directory.\a")
+
+            group_names.append(group_name)
+
+        def read_group(group_name):
+            group = WMOGroupFile(self)
+            group.read_chunks(ChunkDirectory.open(group_name), lazy)
+            return group
+
+        if workers > 1 and len(group_names) > 1:
+            # group files are independent from each other, map() keeps them in group order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                self.groups.extend(executor.map(read_group, group_names))
+        else:
+            self.groups.extend(map(read_group, group_names))
+
+        print("\nDone reading WMO. \nTotal reading time: ",
+              time.strftime("%M minutes %S seconds.", time.gmtime(time.time() - start_time)))
+
+    def close(self):
+        """ Release memory-mapped root and group files of a lazily read WMO """
+        for group in self.groups:
+            group.close()
+
+        LazyChunkFile.close(self)
+
+    def serialize_root(self):
+        """ Pack root file chunks into a single buffer sized up front and return its bytes """
+        chunks = (self.mver, self.mohd, self.motx, self.momt, self.mogn, self.mogi, self.mosb, self.mopv,
+                  self.mopt, self.mopr, self.movv, self.movb, self.molt, self.mods, self.modn, self.modd, self.mfog)
 
-            print("\nDone reading WMO. \nTotal reading time: ",
-                  time.strftime("%M minutes %S seconds.", time.gmtime(time.time() - start_time)))
+        buffer = bytearray(sum(8 + chunk.size() for chunk in chunks))
 
-    def write(self):
-        """ Write WMO data from memory into files """
+        offset = 0
+        for chunk in chunks:
+            offset = chunk.pack_into(buffer, offset)
+
+        return bytes(buffer)
+
+    def write(self, group_data=None):
+        """ Write WMO data from memory into files. Group files may be passed already serialized, in group order.
+        Files are replaced only after all of them were written, so a failed write keeps previous files intact """
 
         start_time = time.time()
 
-        with open(self.filepath, 'wb') as f:
-            print("\n\n=== Writing root file ===")
-
-            self.mver.write(f)
-            self.mohd.write(f)
-            self.motx.write(f)
-            self.momt.write(f)
-            self.mogn.write(f)
-            self.mogi.write(f)
-            self.mosb.write(f)
-            self.mopv.write(f)
-            self.mopt.write(f)
-            self.mopr.write(f)
-            self.movv.write(f)
-            self.movb.write(f)
-            self.molt.write(f)
-            self.mods.write(f)
-            self.modn.write(f)
-            self.modd.write(f)
-            self.mfog.write(f)
-
-            print("\nDone writing root file: <<" + os.path.basename(f.name) + ">>")
+        print("\n\n=== Writing root file ===")
+        files = [(self.filepath, self.serialize_root())]
+        print("\nDone writing root file: <<" + os.path.basename(self.filepath) + ">>")
 
         print("\n\n=== Writing group files ===")
         for index, group in enumerate(self.groups):
-            with open(os.path.splitext(self.filepath)[0] + "_" + str(index).zfill(3) + ".wmo", 'wb') as f:
-                group.write(f)
+            group_path = self.get_group_path(index)
+            print("\nWriting file: <<" +  os.path.basename(group_path) + ">>")
+            files.append((group_path, group_data[index] if group_data else group.serialize()))
+
+        write_files_atomic(files)
 
         print("\nDone writing WMO. \nTotal writing time: ",
               time.strftime("%M minutes %S seconds.\a", time.gmtime(time.time() - start_time)))
 
+    def get_group_path(self, index):
+        """ Get path of a group file of this WMO """
+        return os.path.splitext(self.filepath)[0] + "_" + str(index).zfill(3) + ".wmo"
+
     def compare_materials(self, material):
         """ Compare two WoW material properties """
 
@@ -220,13 +280,9 @@ class WMOFile:
 
         return group_info.NameOfs, desc_ofs
 
-    def load_materials(self):
+    def load_materials(self, load_textures=True):
         """ Load materials from WoW WMO root file """
         self.material_lookup = {}
-        texture_path = os.path.dirname(self.filepath) + "\\"
-
-        images = []
-        image_names = []
 
         # Add ghost material
         mat = bpy.data.materials.get("WowMaterial_ghost")
@@ -264,8 +320,7 @@ class WMOFile:
                 bit <<= 1
             mat.WowMaterial.Flags = mat_flags
 
-            # set texture slot and load texture
-
+            # set texture slot
             if mat.WowMaterial.Texture1:
                 tex1_slot = mat.texture_slots.create(2)
                 tex1_slot.uv_layer = "UVMap"
@@ -275,29 +330,7 @@ class WMOFile:
                 tex1 = bpy.data.textures.new(tex1_name, 'IMAGE')
                 tex1_slot.texture = tex1
 
-                try:
-                    tex1_img_filename = os.path.splitext(mat.WowMaterial.Texture1)[0] + '.png'
-
-                    img1_loaded = False
-
-                    # check if image already loaded
-                    for iImg in range(len(images)):
-                        if image_names[iImg] == tex1_img_filename:
-                            tex1.image = images[iImg]
-                            img1_loaded = True
-                            break
-
-                    # if image is not loaded, do it
-                    if not img1_loaded:
-                        tex1_img = bpy.data.images.load(texture_path + tex1_img_filename)
-                        tex1.image = tex1_img
-                        images.append(tex1_img)
-                        image_names.append(tex1_img_filename)
-
-                except:
-                    pass
-
-            # set texture slot and load texture
+            # set texture slot
             if mat.WowMaterial.Texture2:
                 tex2_slot = mat.texture_slots.create(1)
                 tex2_slot.uv_layer = "UVMap"
@@ -307,24 +340,34 @@ class WMOFile:
                 tex2 = bpy.data.textures.new(tex2_name, 'IMAGE')
                 tex2_slot.texture = tex2
 
-                try:
-                    tex2_img_filename = os.path.splitext(mat.WowMaterial.Texture2)[0] + '.png'
+        if load_textures:
+            self.load_textures()
 
-                    img2_loaded = False
+    def load_textures(self):
+        """ Load texture images of materials, can be done after the textures were extracted in background """
+        texture_path = os.path.dirname(self.filepath) + "\\"
+
+        images = {}
 
-                    # check if image already loaded
-                    for iImg in range(len(images)):
-                        if image_names[iImg] == tex2_img_filename:
-                            tex2.image = images[iImg]
-                            img2_loaded = True
-                            break
+        for index, mat in self.material_lookup.items():
+            if index == 0xFF:
+                continue
+
+            for slot_index, texture in ((2, mat.WowMaterial.Texture1), (1, mat.WowMaterial.Texture2)):
+                if not texture:
+                    continue
+
+                try:
+                    img_filename = os.path.splitext(texture)[0] + '.png'
 
                     # if image is not loaded, do it
-                    if not img2_loaded:
-                        tex2_img = bpy.data.images.load(texture_path + tex2_img_filename)
-                        tex2.image = tex2_img
-                        images.append(tex2_img)
-                        image_names.append(tex2_img_filename)
+                    image = images.get(img_filename)
+                    if not image:
+                        image = bpy.data.images.load(texture_path + img_filename)
+                        images[img_filename] = image
+
+                    mat.texture_slots[slot_index].texture.image = image
+
                 except:
                     pass
 
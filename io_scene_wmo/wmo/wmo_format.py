@@ -1,43 +1,199 @@
-import bpy
+import array
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PackedArray:
+    """ Typed flat buffer of fixed-size records, indexable like a list of tuples """
+
+    def __init__(self, typecode, width, records=()):
+        self.typecode = typecode
+        self.width = width
+        self.buffer = array.array(typecode)
+        self.extend(records)
+
+    @classmethod
+    def from_bytes(cls, typecode, width, data):
+        """ Create an array from raw native-endian record data """
+        packed = cls(typecode, width)
+        packed.buffer.frombytes(data)
+        return packed
+
+    @classmethod
+    def from_flat(cls, typecode, width, values):
+        """ Create an array from a flat sequence of record components """
+        packed = cls(typecode, width)
+
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            packed.buffer.frombytes(values.astype(typecode, copy=False).tobytes())
+        else:
+            packed.buffer.extend(values)
+
+        return packed
+
+    def __len__(self):
+        return len(self.buffer) // self.width
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PackedArray index out of range")
+
+        start = index * self.width
+        return tuple(self.buffer[start:start + self.width])
+
+    def __setitem__(self, index, record):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PackedArray assignment index out of range")
+
+        start = index * self.width
+        self.buffer[start:start + self.width] = array.array(self.typecode, record)
+
+    def __iter__(self):
+        buffer = self.buffer
+        width = self.width
+        for start in range(0, len(buffer) - width + 1, width):
+            yield tuple(buffer[start:start + width])
+
+    def append(self, record):
+        self.buffer.extend(record)
+
+    def extend(self, records):
+        for record in records:
+            self.buffer.extend(record)
+
+    def tobytes(self):
+        return self.buffer.tobytes()
+
+    def as_numpy(self):
+        """ Get a (count, width) NumPy view sharing memory with the array, or None if NumPy is unavailable """
+        if numpy is None:
+            return None
+        return numpy.frombuffer(self.buffer, dtype=self.typecode).reshape(-1, self.width)
+
+
+def pack_records(typecode, width, records):
+    """ Get raw bytes of records stored either in a PackedArray or in a list of tuples """
+    if isinstance(records, PackedArray):
+        return records.tobytes()
+    return PackedArray(typecode, width, records).tobytes()
+
+
+def records_buffer(typecode, width, records):
+    """ Get a typed buffer of records stored either in a PackedArray or in a list of tuples, copying only lists """
+    if isinstance(records, PackedArray):
+        return records.buffer
+    return PackedArray(typecode, width, records).buffer
+
+
+def pack_buffer(buffer, offset, data):
+    """ Copy raw contents of a bytes-like object into a buffer, return offset after them """
+    size = memoryview(data).nbytes
+    buffer[offset:offset + size] = data
+    return offset + size
+
+
+def read_record_list(f, record_type, count):
+    """ Read fixed-size records with one read and a precompiled layout """
+    layout = record_type.layout
+
+    records = []
+    for values in layout.iter_unpack(f.read(count * layout.size)):
+        record = record_type()
+        record.unpack(values)
+        records.append(record)
+
+    return records
+
+
+def pack_record_list(buffer, offset, records):
+    """ Pack fixed-size records one after another, return offset after the last one """
+    for record in records:
+        record.pack_into(buffer, offset)
+        offset += record.layout.size
+
+    return offset
 
-###########################
-# WMO ROOT
-###########################
 
 class ChunkHeader:
+    layout = struct.Struct('4sI')
+
     def __init__(self, magic='', size=0):
         self.Magic = magic
         self.Size = size
 
     def read(self, f):
-        self.Magic = f.read(4)[0:4].decode('ascii')
-        self.Size = struct.unpack("I", f.read(4))[0]
+        magic, self.Size = self.layout.unpack(f.read(8))
+        self.Magic = magic.decode('ascii')
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.Magic[:4].encode('ascii'), self.Size)
+
+    def write(self, f):
+        buffer = bytearray(8)
+        self.pack_into(buffer, 0)
+        f.write(buffer)
+
+
+class Chunk:
+    """ Base of chunks. Chunk reports size of its data up front and packs itself into a preallocated buffer """
+
+    def size(self):
+        """ Get size of chunk data, without the header """
+        raise NotImplementedError
+
+    def pack_into(self, buffer, offset):
+        """ Pack chunk with its header into a buffer at the given offset, return offset after the chunk """
+        raise NotImplementedError
+
+    def pack_header(self, buffer, offset, magic, size):
+        """ Update and pack chunk header, return offset of chunk data """
+        self.Header.Magic = magic
+        self.Header.Size = size
+        self.Header.pack_into(buffer, offset)
+        return offset + 8
 
     def write(self, f):
-        f.write(self.Magic[:4].encode('ascii'))
-        f.write(struct.pack('I', self.Size))
+        buffer = bytearray(8 + self.size())
+        self.pack_into(buffer, 0)
+        f.write(buffer)
+
 
 # contain version of file
-class MVER_chunk:
-    def __init__(self, header=ChunkHeader(), version=0):
-        self.Header = header
+class MVER_chunk(Chunk):
+    layout = struct.Struct('I')
+
+    def __init__(self, header=None, version=0):
+        self.Header = header if header is not None else ChunkHeader()
         self.Version = version
 
     def read(self, f):
         # read header
         self.Header.read(f)
-        self.Version = struct.unpack("I", f.read(4))[0]
+        self.Version = self.layout.unpack(f.read(4))[0]
 
-    def write(self, f):
-        self.Header.Magic = 'REVM'
-        self.Header.Size = 4
-        self.Header.write(f)
-        f.write(struct.pack('I', self.Version))
+    def size(self):
+        return 4
+
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'REVM', 4)
+        self.layout.pack_into(buffer, offset, self.Version)
+        return offset + 4
 
 # WMO Root header
-class MOHD_chunk:
+class MOHD_chunk(Chunk):
+    layout = struct.Struct('7I4BI3f3fI')
+
     def __init__(self):
         self.Header = ChunkHeader()
         self.nMaterials = 0
@@ -57,40 +213,33 @@ class MOHD_chunk:
         # read header
         self.Header.read(f)
 
-        self.nMaterials = struct.unpack("I", f.read(4))[0]
-        self.nGroups = struct.unpack("I", f.read(4))[0]
-        self.nPortals = struct.unpack("I", f.read(4))[0]
-        self.nLights = struct.unpack("I", f.read(4))[0]
-        self.nModels = struct.unpack("I", f.read(4))[0]
-        self.nDoodads = struct.unpack("I", f.read(4))[0]
-        self.nSets = struct.unpack("I", f.read(4))[0]
-        self.AmbientColor = struct.unpack("BBBB", f.read(4))
-        self.ID = struct.unpack("I", f.read(4))[0]
-        self.BoundingBoxCorner1 = struct.unpack("fff", f.read(12))
-        self.BoundingBoxCorner2 = struct.unpack("fff", f.read(12))
-        self.Flags = struct.unpack("I", f.read(4))[0]
+        values = self.layout.unpack(f.read(self.layout.size))
 
-    def write(self, f):
-        self.Header.Magic = 'DHOM'
-        self.Header.Size = 64
-
-        self.Header.write(f)
-        f.write(struct.pack('I', self.nMaterials))
-        f.write(struct.pack('I', self.nGroups))
-        f.write(struct.pack('I', self.nPortals))
-        f.write(struct.pack('I', self.nLights))
-        f.write(struct.pack('I', self.nModels))
-        f.write(struct.pack('I', self.nDoodads))
-        f.write(struct.pack('I', self.nSets))
-        f.write(struct.pack('BBBB', *self.AmbientColor))
-        f.write(struct.pack('I', self.ID))
-        f.write(struct.pack('fff', *self.BoundingBoxCorner1))
-        f.write(struct.pack('fff', *self.BoundingBoxCorner2))
-        f.write(struct.pack('I', self.Flags))
+        self.nMaterials, self.nGroups, self.nPortals, self.nLights, self.nModels, self.nDoodads, self.nSets = values[:7]
+        self.AmbientColor = values[7:11]
+        self.ID = values[11]
+        self.BoundingBoxCorner1 = values[12:15]
+        self.BoundingBoxCorner2 = values[15:18]
+        self.Flags = values[18]
+
+    def size(self):
+        return 64
+
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'DHOM', 64)
+
+        self.layout.pack_into(buffer, offset,
+                              self.nMaterials, self.nGroups, self.nPortals, self.nLights,
+                              self.nModels, self.nDoodads, self.nSets,
+                              *self.AmbientColor, self.ID,
+                              *self.BoundingBoxCorner1, *self.BoundingBoxCorner2,
+                              self.Flags)
+
+        return offset + 64
 
 
 # Texture names
-class MOTX_chunk:
+class MOTX_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.StringTable = bytearray()
@@ -100,12 +249,12 @@ class MOTX_chunk:
         self.Header.read(f)
         self.StringTable = f.read(self.Header.Size)
 
-    def write(self, f):
-        self.Header.Magic = 'XTOM'
-        self.Header.Size = len(self.StringTable)
+    def size(self):
+        return len(self.StringTable)
 
-        self.Header.write(f)
-        f.write(self.StringTable)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'XTOM', self.size())
+        return pack_buffer(buffer, offset, self.StringTable)
 
     def add_string(self, s):
         padding = len(self.StringTable) % 4
@@ -142,6 +291,8 @@ class MOTX_chunk:
 
 
 class WMO_Material:
+    layout = struct.Struct('4I4B4BI4BII4BI4I')
+
     def __init__(self):
         self.Flags = 0
         self.Shader = 0
@@ -158,37 +309,30 @@ class WMO_Material:
         self.RunTimeData = (0, 0, 0, 0)
 
     def read(self, f):
-        self.Flags = struct.unpack("I", f.read(4))[0]
-        self.Shader = struct.unpack("I", f.read(4))[0]
-        self.BlendMode = struct.unpack("I", f.read(4))[0]
-        self.Texture1Ofs = struct.unpack("I", f.read(4))[0]
-        self.EmissiveColor = struct.unpack("BBBB", f.read(4))
-        self.SidnEmissiveColor = struct.unpack("BBBB", f.read(4))
-        self.Texture2Ofs = struct.unpack("I", f.read(4))[0]
-        self.DiffColor = struct.unpack("BBBB", f.read(4))
-        self.TerrainType = struct.unpack("I", f.read(4))[0]
-        self.Texture3Ofs = struct.unpack("I", f.read(4))[0]
-        self.Color3 = struct.unpack("BBBB", f.read(4))
-        self.Tex3Flags = struct.unpack("I", f.read(4))[0]
-        self.RunTimeData = struct.unpack("IIII", f.read(16))[0]
-
-    def write(self, f):
-        f.write(struct.pack('I', self.Flags))
-        f.write(struct.pack('I', self.Shader))
-        f.write(struct.pack('I', self.BlendMode))
-        f.write(struct.pack('I', self.Texture1Ofs))
-        f.write(struct.pack('BBBB', *self.EmissiveColor))
-        f.write(struct.pack('BBBB', *self.SidnEmissiveColor))
-        f.write(struct.pack('I', self.Texture2Ofs))
-        f.write(struct.pack('BBBB', *self.DiffColor))
-        f.write(struct.pack('I', self.TerrainType))
-        f.write(struct.pack('I', self.Texture3Ofs))
-        f.write(struct.pack('BBBB', *self.Color3))
-        f.write(struct.pack('I', self.Tex3Flags))
-        f.write(struct.pack('IIII', *self.RunTimeData))
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
+
+    def unpack(self, values):
+        self.Flags, self.Shader, self.BlendMode, self.Texture1Ofs = values[:4]
+        self.EmissiveColor = values[4:8]
+        self.SidnEmissiveColor = values[8:12]
+        self.Texture2Ofs = values[12]
+        self.DiffColor = values[13:17]
+        self.TerrainType = values[17]
+        self.Texture3Ofs = values[18]
+        self.Color3 = values[19:23]
+        self.Tex3Flags = values[23]
+        self.RunTimeData = values[24:28]
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset,
+                              self.Flags, self.Shader, self.BlendMode, self.Texture1Ofs,
+                              *self.EmissiveColor, *self.SidnEmissiveColor,
+                              self.Texture2Ofs, *self.DiffColor,
+                              self.TerrainType, self.Texture3Ofs,
+                              *self.Color3, self.Tex3Flags, *self.RunTimeData)
 
 # Materials
-class MOMT_chunk:
+class MOMT_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Materials = []
@@ -197,22 +341,17 @@ class MOMT_chunk:
         # read header
         self.Header.read(f)
 
-        self.Materials = []
-        for i in range(self.Header.Size // 64):
-            mat = WMO_Material()
-            mat.read(f)
-            self.Materials.append(mat)
+        self.Materials = read_record_list(f, WMO_Material, self.Header.Size // 64)
 
-    def write(self, f):
-        self.Header.Magic = 'TMOM'
-        self.Header.Size = len(self.Materials) * 64
+    def size(self):
+        return len(self.Materials) * 64
 
-        self.Header.write(f)
-        for mat in self.Materials:
-            mat.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'TMOM', self.size())
+        return pack_record_list(buffer, offset, self.Materials)
 
 # group names
-class MOGN_chunk:
+class MOGN_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.StringTable = bytearray(b'\x00\x00')
@@ -222,19 +361,15 @@ class MOGN_chunk:
         self.Header.read(f)
         self.StringTable = f.read(self.Header.Size)
 
-    def write(self, f):
-        self.Header.Magic = 'NGOM'
-
+    def size(self):
         # padd 4 bytes after
-        padding = len(self.StringTable) % 4
-        if(padding > 0):
-            for iPad in range(4 - padding):
-                self.StringTable.append(0)
-
-        self.Header.Size = len(self.StringTable)
+        return len(self.StringTable) + (-len(self.StringTable) % 4)
 
-        self.Header.write(f)
-        f.write(self.StringTable)
+    def pack_into(self, buffer, offset):
+        size = self.size()
+        offset = self.pack_header(buffer, offset, 'NGOM', size)
+        pack_buffer(buffer, offset, self.StringTable)
+        return offset + size
 
     def add_string(self, s):
         ofs = len(self.StringTable)
@@ -252,6 +387,8 @@ class MOGN_chunk:
         return self.StringTable[start:i].decode('ascii')
 
 class GroupInfo:
+    layout = struct.Struct('I3f3fI')
+
     def __init__(self):
         self.Flags = 0
         self.BoundingBoxCorner1 = (0, 0, 0)
@@ -259,20 +396,21 @@ class GroupInfo:
         self.NameOfs = 0
 
     def read(self, f):
-        self.Flags = struct.unpack("I", f.read(4))[0]
-        self.BoundingBoxCorner1 = struct.unpack("fff", f.read(12))
-        self.BoundingBoxCorner2 = struct.unpack("fff", f.read(12))
-        self.NameOfs = struct.unpack("I", f.read(4))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(struct.pack('I', self.Flags))
-        f.write(struct.pack('fff', *self.BoundingBoxCorner1))
-        f.write(struct.pack('fff', *self.BoundingBoxCorner2))
-        f.write(struct.pack('I', self.NameOfs))
+    def unpack(self, values):
+        self.Flags = values[0]
+        self.BoundingBoxCorner1 = values[1:4]
+        self.BoundingBoxCorner2 = values[4:7]
+        self.NameOfs = values[7]
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.Flags,
+                              *self.BoundingBoxCorner1, *self.BoundingBoxCorner2, self.NameOfs)
 
 
 # group informations
-class MOGI_chunk:
+class MOGI_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Infos = []
@@ -281,24 +419,17 @@ class MOGI_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 32
+        self.Infos = read_record_list(f, GroupInfo, self.Header.Size // 32)
 
-        self.Infos = []
-        for i in range(count):
-            info = GroupInfo()
-            info.read(f)
-            self.Infos.append(info)
-
-    def write(self, f):
-        self.Header.Magic = 'IGOM'
-        self.Header.Size = len(self.Infos) * 32
+    def size(self):
+        return len(self.Infos) * 32
 
-        self.Header.write(f)
-        for info in self.Infos:
-            info.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'IGOM', self.size())
+        return pack_record_list(buffer, offset, self.Infos)
 
 # skybox
-class MOSB_chunk:
+class MOSB_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Skybox = ''
@@ -306,52 +437,45 @@ class MOSB_chunk:
     def read(self, f):
         # read header
         self.Header.read(f)
-        self.Skybox = f.read(self.Header.Size).decode('ascii')
+        self.Skybox = f.read(self.Header.Size).decode('ascii').rstrip('\x00')
 
-    def write(self, f):
-        self.Header.Magic = 'BSOM'
-
-        if not self.Skybox:
-            self.Skybox = '\x00\x00\x00'
+    def get_skybox_data(self):
+        return (self.Skybox or '\x00\x00\x00').encode('ascii') + b'\x00'
 
-        self.Header.Size = len(self.Skybox) + 1
+    def size(self):
+        return len(self.get_skybox_data())
 
-        self.Header.write(f)
-        f.write(self.Skybox.encode('ascii') + b'\x00')
+    def pack_into(self, buffer, offset):
+        data = self.get_skybox_data()
+        offset = self.pack_header(buffer, offset, 'BSOM', len(data))
+        return pack_buffer(buffer, offset, data)
 
 # portal vertices
-class MOPV_chunk:
+class MOPV_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
 
         self.PortalVertices = []
-        #self.Portals = []
 
     def read(self, f):
         # read header
         self.Header.read(f)
 
+        # 12 = sizeof(float) * 3
         count = self.Header.Size // 12
-        self.PortalVertices = []
-        #self.Portals = []
 
-        # 12 = sizeof(float) * 3
-        for i in range(count):
-            #self.PortalVertices = []
-            #for j in range(4):
-            self.PortalVertices.append(struct.unpack("fff", f.read(12)))
-                #print(self.mopt.Infos[i].nVertices)
-            #self.Portals.append(self.PortalVertices)
+        self.PortalVertices = list(PackedArray.from_bytes('f', 3, f.read(count * 12)))
 
-    def write(self, f):
-        self.Header.Magic = 'VPOM'
-        self.Header.Size = len(self.PortalVertices) * 12
+    def size(self):
+        return len(self.PortalVertices) * 12
 
-        self.Header.write(f)
-        for v in self.PortalVertices:
-            f.write(struct.pack('fff', *v))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'VPOM', self.size())
+        return pack_buffer(buffer, offset, records_buffer('f', 3, self.PortalVertices))
 
 class PortalInfo:
+    layout = struct.Struct('HH3ff')
+
     def __init__(self):
         self.StartVertex = 0
         self.nVertices = 0
@@ -359,20 +483,19 @@ class PortalInfo:
         self.Unknown = 0
 
     def read(self, f):
-        self.StartVertex = struct.unpack("H", f.read(2))[0]
-        self.nVertices = struct.unpack("H", f.read(2))[0]
-        self.Normal = struct.unpack("fff", f.read(12))
-        self.Unknown = struct.unpack("f", f.read(4))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(struct.pack('H', self.StartVertex))
-        f.write(struct.pack('H', self.nVertices))
-        f.write(struct.pack('fff', *self.Normal))
-        f.write(struct.pack('f', self.Unknown))
+    def unpack(self, values):
+        self.StartVertex, self.nVertices = values[:2]
+        self.Normal = values[2:5]
+        self.Unknown = values[5]
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.StartVertex, self.nVertices, *self.Normal, self.Unknown)
 
 
 # portal infos
-class MOPT_chunk:
+class MOPT_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Infos = []
@@ -381,23 +504,19 @@ class MOPT_chunk:
         # read header
         self.Header.read(f)
 
-        self.Infos = []
-
         # 20 = sizeof(PortalInfo)
-        for i in range(self.Header.Size // 20):
-            info = PortalInfo()
-            info.read(f)
-            self.Infos.append(info)
+        self.Infos = read_record_list(f, PortalInfo, self.Header.Size // 20)
 
-    def write(self, f):
-        self.Header.Magic = 'TPOM'
-        self.Header.Size = len(self.Infos) * 20
+    def size(self):
+        return len(self.Infos) * 20
 
-        self.Header.write(f)
-        for info in self.Infos:
-            info.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'TPOM', self.size())
+        return pack_record_list(buffer, offset, self.Infos)
 
 class PortalRelationship:
+    layout = struct.Struct('HHhH')
+
     def __init__(self):
         self.PortalIndex = 0
         self.GroupIndex = 0
@@ -405,19 +524,16 @@ class PortalRelationship:
         self.Padding = 0
 
     def read(self, f):
-        self.PortalIndex = struct.unpack("H", f.read(2))[0]
-        self.GroupIndex = struct.unpack("H", f.read(2))[0]
-        self.Side = struct.unpack("h", f.read(2))[0]
-        self.Padding = struct.unpack("H", f.read(2))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(struct.pack('H', self.PortalIndex))
-        f.write(struct.pack('H', self.GroupIndex))
-        f.write(struct.pack('h', self.Side))
-        f.write(struct.pack('H', self.Padding))
+    def unpack(self, values):
+        self.PortalIndex, self.GroupIndex, self.Side, self.Padding = values
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.PortalIndex, self.GroupIndex, self.Side, self.Padding)
 
 # portal link 2 groups
-class MOPR_chunk:
+class MOPR_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Relationships = []
@@ -426,25 +542,18 @@ class MOPR_chunk:
         # read header
         self.Header.read(f)
 
-        self.Relationships = []
-
-        for i in range(self.Header.Size // 8):
-            relationship = PortalRelationship()
-            relationship.read(f)
-            self.Relationships.append(relationship)
-
-    def write(self, f):
-        self.Header.Magic = 'RPOM'
-        self.Header.Size = len(self.Relationships) * 8
+        self.Relationships = read_record_list(f, PortalRelationship, self.Header.Size // 8)
 
-        self.Header.write(f)
+    def size(self):
+        return len(self.Relationships) * 8
 
-        for rel in self.Relationships:
-            rel.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'RPOM', self.size())
+        return pack_record_list(buffer, offset, self.Relationships)
 
 
 # visible vertices
-class MOVV_chunk:
+class MOVV_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.VisibleVertices = []
@@ -453,35 +562,35 @@ class MOVV_chunk:
         # read header
         self.Header.read(f)
 
-        self.VisibleVertices = []
-
-        for i in range(self.Header.Size // 12):
-            self.VisibleVertices.append(struct.unpack("fff", f.read(12)))
+        count = self.Header.Size // 12
 
-    def write(self, f):
-        self.Header.Magic = 'VVOM'
-        self.Header.Size = len(self.VisibleVertices) * 12
+        self.VisibleVertices = list(PackedArray.from_bytes('f', 3, f.read(count * 12)))
 
-        self.Header.write(f)
+    def size(self):
+        return len(self.VisibleVertices) * 12
 
-        for v in self.VisibleVertices:
-            f.write(struct.pack('fff', *v))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'VVOM', self.size())
+        return pack_buffer(buffer, offset, records_buffer('f', 3, self.VisibleVertices))
 
 class VisibleBatch:
+    layout = struct.Struct('HH')
+
     def __init__(self):
         self.StartVertex = 0
         self.nVertices = 0
 
     def read(self, f):
-        self.StartVertex = struct.unpack("H", f.read(2))[0]
-        self.nVertices = struct.unpack("H", f.read(2))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(struct.pack('H', self.StartVertex))
-        f.write(struct.pack('H', self.nVertices))
+    def unpack(self, values):
+        self.StartVertex, self.nVertices = values
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.StartVertex, self.nVertices)
 
 # visible batches
-class MOVB_chunk:
+class MOVB_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Batches = []
@@ -490,24 +599,18 @@ class MOVB_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 4
+        self.Batches = read_record_list(f, VisibleBatch, self.Header.Size // 4)
 
-        self.Batches = []
-
-        for i in range(count):
-            batch = VisibleBatch()
-            batch.read(f)
-            self.Batches.append(batch)
-
-    def write(self, f):
-        self.Header.Magic = 'BVOM'
-        self.Header.Size = len(self.Batches) * 4
+    def size(self):
+        return len(self.Batches) * 4
 
-        self.Header.write(f)
-        for batch in self.Batches:
-            batch.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'BVOM', self.size())
+        return pack_record_list(buffer, offset, self.Batches)
 
 class Light:
+    layout = struct.Struct('4B4B3f7f')
+
     def __init__(self):
         self.LightType = 0
         self.Type = 1
@@ -524,38 +627,25 @@ class Light:
         self.Unknown4 = 0
 
     def read(self, f):
-        self.LightType = struct.unpack("B", f.read(1))[0]
-        self.Type = struct.unpack("B", f.read(1))[0]
-        self.UseAttenuation = struct.unpack("B", f.read(1))[0]
-        self.Padding = struct.unpack("B", f.read(1))[0]
-        self.Color = struct.unpack("BBBB", f.read(4))
-        self.Position = struct.unpack("fff", f.read(12))
-        self.Intensity = struct.unpack("f", f.read(4))[0]
-        self.AttenuationStart = struct.unpack("f", f.read(4))[0]
-        self.AttenuationEnd = struct.unpack("f", f.read(4))[0]
-        self.Unknown1 = struct.unpack("f", f.read(4))[0]
-        self.Unknown2 = struct.unpack("f", f.read(4))[0]
-        self.Unknown3 = struct.unpack("f", f.read(4))[0]
-        self.Unknown4 = struct.unpack("f", f.read(4))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(struct.pack('B', self.LightType))
-        f.write(struct.pack('B', self.Type))
-        f.write(struct.pack('B', self.UseAttenuation))
-        f.write(struct.pack('B', self.Padding))
-        f.write(struct.pack('BBBB', *self.Color))
-        f.write(struct.pack('fff', *self.Position))
-        f.write(struct.pack('f', self.Intensity))
-        f.write(struct.pack('f', self.AttenuationStart))
-        f.write(struct.pack('f', self.AttenuationEnd))
-        f.write(struct.pack('f', self.Unknown1))
-        f.write(struct.pack('f', self.Unknown2))
-        f.write(struct.pack('f', self.Unknown3))
-        f.write(struct.pack('f', self.Unknown4))
+    def unpack(self, values):
+        self.LightType, self.Type, self.UseAttenuation, self.Padding = values[:4]
+        self.Color = values[4:8]
+        self.Position = values[8:11]
+        self.Intensity, self.AttenuationStart, self.AttenuationEnd = values[11:14]
+        self.Unknown1, self.Unknown2, self.Unknown3, self.Unknown4 = values[14:18]
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset,
+                              self.LightType, self.Type, self.UseAttenuation, self.Padding,
+                              *self.Color, *self.Position,
+                              self.Intensity, self.AttenuationStart, self.AttenuationEnd,
+                              self.Unknown1, self.Unknown2, self.Unknown3, self.Unknown4)
 
 
 # lights
-class MOLT_chunk:
+class MOLT_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Lights = []
@@ -565,23 +655,18 @@ class MOLT_chunk:
         self.Header.read(f)
 
         # 48 = sizeof(Light)
-        count = self.Header.Size // 48
-
-        self.Lights = []
-        for i in range(count):
-            light = Light()
-            light.read(f)
-            self.Lights.append(light)
+        self.Lights = read_record_list(f, Light, self.Header.Size // 48)
 
-    def write(self, f):
-        self.Header.Magic = 'TLOM'
-        self.Header.Size = len(self.Lights) * 48
+    def size(self):
+        return len(self.Lights) * 48
 
-        self.Header.write(f)
-        for light in self.Lights:
-            light.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'TLOM', self.size())
+        return pack_record_list(buffer, offset, self.Lights)
 
 class DoodadSet:
+    layout = struct.Struct('20sIII')
+
     def __init__(self):
         self.Name = ''
         self.StartDoodad = 0
@@ -589,19 +674,17 @@ class DoodadSet:
         self.Padding = 0
 
     def read(self, f):
-        self.Name = f.read(20).decode("ascii")
-        self.StartDoodad = struct.unpack("I", f.read(4))[0]
-        self.nDoodads = struct.unpack("I", f.read(4))[0]
-        self.Padding = struct.unpack("I", f.read(4))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(self.Name.ljust(20, '\0').encode('ascii'))
-        f.write(struct.pack('I', self.StartDoodad))
-        f.write(struct.pack('I', self.nDoodads))
-        f.write(struct.pack('I', self.Padding))
+    def unpack(self, values):
+        self.Name = values[0].decode("ascii")
+        self.StartDoodad, self.nDoodads, self.Padding = values[1:]
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.Name.encode('ascii'), self.StartDoodad, self.nDoodads, self.Padding)
 
 # doodad sets
-class MODS_chunk:
+class MODS_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Sets = []
@@ -610,26 +693,18 @@ class MODS_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 32
-
-        self.Sets = []
-
-        for i in range(count):
-            set = DoodadSet()
-            set.read(f)
-            self.Sets.append(set)
+        self.Sets = read_record_list(f, DoodadSet, self.Header.Size // 32)
 
-    def write(self, f):
-        self.Header.Magic = 'SDOM'
-        self.Header.Size = len(self.Sets) * 32
+    def size(self):
+        return len(self.Sets) * 32
 
-        self.Header.write(f)
-        for set in self.Sets:
-            set.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'SDOM', self.size())
+        return pack_record_list(buffer, offset, self.Sets)
 
 
 # doodad names
-class MODN_chunk:
+class MODN_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.StringTable = bytearray()
@@ -639,12 +714,12 @@ class MODN_chunk:
         self.Header.read(f)
         self.StringTable = f.read(self.Header.Size)
 
-    def write(self, f):
-        self.Header.Magic = 'NDOM'
-        self.Header.Size = len(self.StringTable)
+    def size(self):
+        return len(self.StringTable)
 
-        self.Header.write(f)
-        f.write(self.StringTable)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'NDOM', self.size())
+        return pack_buffer(buffer, offset, self.StringTable)
 
     def AddString(self, s):
         padding = len(self.StringTable) % 4
@@ -667,6 +742,8 @@ class MODN_chunk:
         return self.StringTable[start:i].decode('ascii')
 
 class DoodadDefinition:
+    layout = struct.Struct('I3f4ff4B')
+
     def __init__(self):
         self.NameOfs = 0
         self.Flags = 0
@@ -676,24 +753,23 @@ class DoodadDefinition:
         self.Color = [0, 0, 0, 0]
 
     def read(self, f):
-        weirdThing = struct.unpack("I", f.read(4))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
+
+    def unpack(self, values):
+        weirdThing = values[0]
         self.NameOfs = weirdThing & 0xFFFFFF
         self.Flags = (weirdThing >> 24) & 0xFF
-        self.Position = struct.unpack("fff", f.read(12))
-        self.Rotation = struct.unpack("ffff", f.read(16))
-        self.Scale = struct.unpack("f", f.read(4))[0]
-        self.Color = struct.unpack("BBBB", f.read(4))
+        self.Position = values[1:4]
+        self.Rotation = values[4:8]
+        self.Scale = values[8]
+        self.Color = values[9:13]
 
-    def write(self, f):
+    def pack_into(self, buffer, offset):
         weirdThing = ((self.Flags & 0xFF) << 24) | (self.NameOfs & 0xFFFFFF)
-        f.write(struct.pack('I', weirdThing))
-        f.write(struct.pack('fff', *self.Position))
-        f.write(struct.pack('ffff', *self.Rotation))
-        f.write(struct.pack('f', self.Scale))
-        f.write(struct.pack('BBBB', *self.Color))
+        self.layout.pack_into(buffer, offset, weirdThing, *self.Position, *self.Rotation, self.Scale, *self.Color)
 
 # doodad definition
-class MODD_chunk:
+class MODD_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Definitions = []
@@ -702,24 +778,19 @@ class MODD_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 40
+        self.Definitions = read_record_list(f, DoodadDefinition, self.Header.Size // 40)
 
-        self.Definitions = []
-        for i in range(count):
-            defi = DoodadDefinition()
-            defi.read(f)
-            self.Definitions.append(defi)
-
-    def write(self, f):
-        self.Header.Magic = 'DDOM'
-        self.Header.Size = len(self.Definitions) * 40
+    def size(self):
+        return len(self.Definitions) * 40
 
-        self.Header.write(f)
-        for defi in self.Definitions:
-            defi.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'DDOM', self.size())
+        return pack_record_list(buffer, offset, self.Definitions)
 
 # fog
 class Fog:
+    layout = struct.Struct('I3fffff4Bff4B')
+
     def __init__(self):
         self.Flags = 0
         self.Position = (0, 0, 0)
@@ -733,30 +804,22 @@ class Fog:
         self.Color2 = (0, 0, 0, 0)
 
     def read(self, f):
-        self.Flags = struct.unpack("I", f.read(4))[0]
-        self.Position = struct.unpack("fff", f.read(12))
-        self.SmallRadius = struct.unpack("f", f.read(4))[0]
-        self.BigRadius = struct.unpack("f", f.read(4))[0]
-        self.EndDist = struct.unpack("f", f.read(4))[0]
-        self.StartFactor = struct.unpack("f", f.read(4))[0]
-        self.Color1 = struct.unpack("BBBB", f.read(4))
-        self.EndDist2 = struct.unpack("f", f.read(4))[0]
-        self.StartFactor2 = struct.unpack("f", f.read(4))[0]
-        self.Color2 = struct.unpack("BBBB", f.read(4))
-
-    def write(self, f):
-        f.write(struct.pack('I', self.Flags))
-        f.write(struct.pack('fff', *self.Position))
-        f.write(struct.pack('f', self.SmallRadius))
-        f.write(struct.pack('f', self.BigRadius))
-        f.write(struct.pack('f', self.EndDist))
-        f.write(struct.pack('f', self.StartFactor))
-        f.write(struct.pack('BBBB', *self.Color1))
-        f.write(struct.pack('f', self.EndDist2))
-        f.write(struct.pack('f', self.StartFactor2))
-        f.write(struct.pack('BBBB', *self.Color2))
-
-class MFOG_chunk:
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
+
+    def unpack(self, values):
+        self.Flags = values[0]
+        self.Position = values[1:4]
+        self.SmallRadius, self.BigRadius, self.EndDist, self.StartFactor = values[4:8]
+        self.Color1 = values[8:12]
+        self.EndDist2, self.StartFactor2 = values[12:14]
+        self.Color2 = values[14:18]
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.Flags, *self.Position,
+                              self.SmallRadius, self.BigRadius, self.EndDist, self.StartFactor,
+                              *self.Color1, self.EndDist2, self.StartFactor2, *self.Color2)
+
+class MFOG_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Fogs = []
@@ -765,24 +828,17 @@ class MFOG_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 48
+        self.Fogs = read_record_list(f, Fog, self.Header.Size // 48)
 
-        self.Fogs = []
-        for i in range(count):
-            fog = Fog()
-            fog.read(f)
-            self.Fogs.append(fog)
-
-    def write(self, f):
-        self.Header.Magic = 'GOFM'
-        self.Header.Size = len(self.Fogs) * 48
+    def size(self):
+        return len(self.Fogs) * 48
 
-        self.Header.write(f)
-        for fog in self.Fogs:
-            fog.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'GOFM', self.size())
+        return pack_record_list(buffer, offset, self.Fogs)
 
 # Convex volume plane, used only for transport objects
-class MCVP_chunk:
+class MCVP_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.convex_volume_planes = []
@@ -792,16 +848,14 @@ class MCVP_chunk:
 
         count = self.Header.Size // 16
 
-        for i in range(0, count):
-            self.convex_volume_planes.append(struct.unpack('ffff', f.read(16)))
+        self.convex_volume_planes = list(PackedArray.from_bytes('f', 4, f.read(count * 16)))
 
-    def write(self, f):
-        self.Header.Magic = 'PVCM'
-        self.Header.Size = len(self.convex_volume_planes) * 16
+    def size(self):
+        return len(self.convex_volume_planes) * 16
 
-        self.Header.write(f)
-        for i in self.convex_volume_planes:
-            f.write(struct.pack('ffff', self.convex_volume_planes[i]))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'PVCM', self.size())
+        return pack_buffer(buffer, offset, records_buffer('f', 4, self.convex_volume_planes))
 
 ###########################
 # WMO GROUP
@@ -825,7 +879,9 @@ class MOGP_FLAG:
 
 
 # contain WMO group header
-class MOGP_chunk:
+class MOGP_chunk(Chunk):
+    layout = struct.Struct('III3f3f6H4BIIII')
+
     def __init__(self):
         self.Header = ChunkHeader()
         self.GroupNameOfs = 0
@@ -849,60 +905,52 @@ class MOGP_chunk:
         # read header
         self.Header.read(f)
 
-        self.GroupNameOfs = struct.unpack("I", f.read(4))[0]
-        self.DescGroupNameOfs = struct.unpack("I", f.read(4))[0]
-        self.Flags = struct.unpack("I", f.read(4))[0]
-        self.BoundingBoxCorner1 = struct.unpack("fff", f.read(12))
-        self.BoundingBoxCorner2 = struct.unpack("fff", f.read(12))
-        self.PortalStart = struct.unpack("H", f.read(2))[0]
-        self.PortalCount = struct.unpack("H", f.read(2))[0]
-        self.nBatchesA = struct.unpack("H", f.read(2))[0]
-        self.nBatchesB = struct.unpack("H", f.read(2))[0]
-        self.nBatchesC = struct.unpack("H", f.read(2))[0]
-        self.nBatchesD = struct.unpack("H", f.read(2))[0]
-        self.FogIndices = struct.unpack("BBBB", f.read(4))
-        self.LiquidType = struct.unpack("I", f.read(4))[0]
-        self.GroupID = struct.unpack("I", f.read(4))[0]
-        self.Unknown1 = struct.unpack("I", f.read(4))[0]
-        self.Unknown2 = struct.unpack("I", f.read(4))[0]
+        values = self.layout.unpack(f.read(self.layout.size))
 
-    def write(self, f):
-        self.Header.Magic = 'PGOM'
-
-        self.Header.write(f)
-        f.write(struct.pack('I', self.GroupNameOfs))
-        f.write(struct.pack('I', self.DescGroupNameOfs))
-        f.write(struct.pack('I', self.Flags))
-        f.write(struct.pack('fff', *self.BoundingBoxCorner1))
-        f.write(struct.pack('fff', *self.BoundingBoxCorner2))
-        f.write(struct.pack('H', self.PortalStart))
-        f.write(struct.pack('H', self.PortalCount))
-        f.write(struct.pack('H', self.nBatchesA))
-        f.write(struct.pack('H', self.nBatchesB))
-        f.write(struct.pack('H', self.nBatchesC))
-        f.write(struct.pack('H', self.nBatchesD))
-        f.write(struct.pack('BBBB', *self.FogIndices))
-        f.write(struct.pack('I', self.LiquidType))
-        f.write(struct.pack('I', self.GroupID))
-        f.write(struct.pack('I', self.Unknown1))
-        f.write(struct.pack('I', self.Unknown2))
+        self.GroupNameOfs, self.DescGroupNameOfs, self.Flags = values[:3]
+        self.BoundingBoxCorner1 = values[3:6]
+        self.BoundingBoxCorner2 = values[6:9]
+        self.PortalStart, self.PortalCount = values[9:11]
+        self.nBatchesA, self.nBatchesB, self.nBatchesC, self.nBatchesD = values[11:15]
+        self.FogIndices = values[15:19]
+        self.LiquidType, self.GroupID, self.Unknown1, self.Unknown2 = values[19:23]
+
+    def size(self):
+        """ Size of the group header only. Header.Size also covers nested chunks and is set by the group file """
+        return 68
+
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'PGOM', self.Header.Size)
+
+        self.layout.pack_into(buffer, offset,
+                              self.GroupNameOfs, self.DescGroupNameOfs, self.Flags,
+                              *self.BoundingBoxCorner1, *self.BoundingBoxCorner2,
+                              self.PortalStart, self.PortalCount,
+                              self.nBatchesA, self.nBatchesB, self.nBatchesC, self.nBatchesD,
+                              *self.FogIndices,
+                              self.LiquidType, self.GroupID, self.Unknown1, self.Unknown2)
+
+        return offset + 68
 
 # Material information
 class TriangleMaterial:
+    layout = struct.Struct('BB')
+
     def __init__(self):
         self.Flags = 0
         self.MaterialID = 0
 
     def read(self, f):
-        self.Flags = struct.unpack("B", f.read(1))[0]
-        self.MaterialID = struct.unpack("B", f.read(1))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(struct.pack('B', self.Flags))
-        f.write(struct.pack('B', self.MaterialID))
+    def unpack(self, values):
+        self.Flags, self.MaterialID = values
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.Flags, self.MaterialID)
 
 # contain list of triangle materials. One for each triangle
-class MOPY_chunk:
+class MOPY_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.TriangleMaterials = []
@@ -911,28 +959,20 @@ class MOPY_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 2
-
-        self.TriangleMaterials = []
-
-        for i in range(count):
-            tri = TriangleMaterial()
-            tri.read(f)
-            self.TriangleMaterials.append(tri)
+        self.TriangleMaterials = read_record_list(f, TriangleMaterial, self.Header.Size // 2)
 
-    def write(self, f):
-        self.Header.Magic = 'YPOM'
-        self.Header.Size = len(self.TriangleMaterials) * 2
+    def size(self):
+        return len(self.TriangleMaterials) * 2
 
-        self.Header.write(f)
-        for tri in self.TriangleMaterials:
-            tri.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'YPOM', self.size())
+        return pack_record_list(buffer, offset, self.TriangleMaterials)
 
 # Indices
-class MOVI_chunk:
+class MOVI_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
-        self.Indices = []
+        self.Indices = array.array('H')
 
     def read(self, f):
         # read header
@@ -941,24 +981,26 @@ class MOVI_chunk:
         # 2 = sizeof(unsigned short)
         count = self.Header.Size // 2
 
-        self.Indices = []
+        self.Indices = array.array('H')
+        self.Indices.frombytes(f.read(count * 2))
 
-        for i in range(count):
-            self.Indices.append(struct.unpack("H", f.read(2))[0])
+    def size(self):
+        return len(self.Indices) * 2
 
-    def write(self, f):
-        self.Header.Magic = 'IVOM'
-        self.Header.Size = len(self.Indices) * 2
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'IVOM', self.size())
+
+        indices = self.Indices
+        if not isinstance(indices, array.array) or indices.typecode != 'H':
+            indices = array.array('H', indices)
 
-        self.Header.write(f)
-        for i in self.Indices:
-            f.write(struct.pack('H', i))
+        return pack_buffer(buffer, offset, indices)
 
 # Vertices
-class MOVT_chunk:
+class MOVT_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
-        self.Vertices = []
+        self.Vertices = PackedArray('f', 3)
 
     def read(self, f):
         # read header
@@ -967,24 +1009,20 @@ class MOVT_chunk:
         # 4 * 3 = sizeof(float) * 3
         count = self.Header.Size // (4 * 3)
 
-        self.Vertices = []
-
-        for i in range(count):
-            self.Vertices.append(struct.unpack("fff", f.read(12)))
+        self.Vertices = PackedArray.from_bytes('f', 3, f.read(count * 12))
 
-    def write(self, f):
-        self.Header.Magic = 'TVOM'
-        self.Header.Size = len(self.Vertices) * 12
+    def size(self):
+        return len(self.Vertices) * 12
 
-        self.Header.write(f)
-        for v in self.Vertices:
-            f.write(struct.pack('fff', *v))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'TVOM', self.size())
+        return pack_buffer(buffer, offset, records_buffer('f', 3, self.Vertices))
 
 # Normals
-class MONR_chunk:
+class MONR_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
-        self.Normals = []
+        self.Normals = PackedArray('f', 3)
 
     def read(self, f):
         # read header
@@ -993,24 +1031,20 @@ class MONR_chunk:
         # 4 * 3 = sizeof(float) * 3
         count = self.Header.Size // (4 * 3)
 
-        self.Normals = []
-
-        for i in range(count):
-            self.Normals.append(struct.unpack("fff", f.read(12)))
+        self.Normals = PackedArray.from_bytes('f', 3, f.read(count * 12))
 
-    def write(self, f):
-        self.Header.Magic = 'RNOM'
-        self.Header.Size = len(self.Normals) * 12
+    def size(self):
+        return len(self.Normals) * 12
 
-        self.Header.write(f)
-        for n in self.Normals:
-            f.write(struct.pack('fff', *n))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'RNOM', self.size())
+        return pack_buffer(buffer, offset, records_buffer('f', 3, self.Normals))
 
 # Texture coordinates
-class MOTV_chunk:
+class MOTV_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
-        self.TexCoords = []
+        self.TexCoords = PackedArray('f', 2)
 
     def read(self, f):
         # read header
@@ -1019,21 +1053,19 @@ class MOTV_chunk:
         # 4 * 2 = sizeof(float) * 2
         count = self.Header.Size // (4 * 2)
 
-        self.TexCoords = []
+        self.TexCoords = PackedArray.from_bytes('f', 2, f.read(count * 8))
 
-        for i in range(count):
-            self.TexCoords.append(struct.unpack("ff", f.read(8)))
+    def size(self):
+        return len(self.TexCoords) * 8
 
-    def write(self, f):
-        self.Header.Magic = 'VTOM'
-        self.Header.Size = len(self.TexCoords) * 8
-
-        self.Header.write(f)
-        for tc in self.TexCoords:
-            f.write(struct.pack('ff', *tc))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'VTOM', self.size())
+        return pack_buffer(buffer, offset, records_buffer('f', 2, self.TexCoords))
 
 # batch
 class Batch:
+    layout = struct.Struct('6hIHHHBB')
+
     def __init__(self):
         self.BoundingBox = (0, 0, 0, 0, 0, 0)
         self.StartTriangle = 0
@@ -1044,26 +1076,19 @@ class Batch:
         self.MaterialID = 0
 
     def read(self, f):
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
+
+    def unpack(self, values):
         #not sure
-        self.BoundingBox = struct.unpack("hhhhhh", f.read(12))
-        self.StartTriangle = struct.unpack("I", f.read(4))[0]
-        self.nTriangle = struct.unpack("H", f.read(2))[0]
-        self.StartVertex = struct.unpack("H", f.read(2))[0]
-        self.LastVertex = struct.unpack("H", f.read(2))[0]
-        self.Unknown = struct.unpack("B", f.read(1))[0]
-        self.MaterialID = struct.unpack("B", f.read(1))[0]
+        self.BoundingBox = values[:6]
+        self.StartTriangle, self.nTriangle, self.StartVertex, self.LastVertex, self.Unknown, self.MaterialID = values[6:]
 
-    def write(self, f):
-        f.write(struct.pack('hhhhhh', *self.BoundingBox))
-        f.write(struct.pack('I', self.StartTriangle))
-        f.write(struct.pack('H', self.nTriangle))
-        f.write(struct.pack('H', self.StartVertex))
-        f.write(struct.pack('H', self.LastVertex))
-        f.write(struct.pack('B', self.Unknown))
-        f.write(struct.pack('B', self.MaterialID))
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, *self.BoundingBox, self.StartTriangle, self.nTriangle,
+                              self.StartVertex, self.LastVertex, self.Unknown, self.MaterialID)
 
 # batches
-class MOBA_chunk:
+class MOBA_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Batches = []
@@ -1072,25 +1097,17 @@ class MOBA_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 24
-
-        self.Batches = []
-
-        for i in range(count):
-            batch = Batch()
-            batch.read(f)
-            self.Batches.append(batch)
+        self.Batches = read_record_list(f, Batch, self.Header.Size // 24)
 
-    def write(self, f):
-        self.Header.Magic = 'ABOM'
-        self.Header.Size = len(self.Batches) * 24
+    def size(self):
+        return len(self.Batches) * 24
 
-        self.Header.write(f)
-        for b in self.Batches:
-            b.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'ABOM', self.size())
+        return pack_record_list(buffer, offset, self.Batches)
 
 # lights
-class MOLR_chunk:
+class MOLR_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.LightRefs = []
@@ -1102,21 +1119,19 @@ class MOLR_chunk:
         # 2 = sizeof(short)
         count = self.Header.Size // 2
 
-        self.LightRefs = []
-
-        for i in range(count):
-            self.LightRefs.append(struct.unpack("h", f.read(2))[0])
+        light_refs = array.array('h')
+        light_refs.frombytes(f.read(count * 2))
+        self.LightRefs = light_refs.tolist()
 
-    def write(self, f):
-        self.Header.Magic = 'RLOM'
-        self.Header.Size = len(self.LightRefs) * 2
+    def size(self):
+        return len(self.LightRefs) * 2
 
-        self.Header.write(f)
-        for lr in self.LightRefs:
-            f.write(struct.pack('h', lr))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'RLOM', self.size())
+        return pack_buffer(buffer, offset, array.array('h', self.LightRefs))
 
 # doodads
-class MODR_chunk:
+class MODR_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.DoodadRefs = []
@@ -1128,18 +1143,16 @@ class MODR_chunk:
         # 2 = sizeof(short)
         count = self.Header.Size // 2
 
-        self.DoodadRefs = []
-
-        for i in range(count):
-            self.DoodadRefs.append(struct.unpack("h", f.read(2))[0])
+        doodad_refs = array.array('h')
+        doodad_refs.frombytes(f.read(count * 2))
+        self.DoodadRefs = doodad_refs.tolist()
 
-    def write(self, f):
-        self.Header.Magic = 'RDOM'
-        self.Header.Size = len(self.DoodadRefs) * 2
+    def size(self):
+        return len(self.DoodadRefs) * 2
 
-        self.Header.write(f)
-        for dr in self.DoodadRefs:
-            f.write(struct.pack('h', dr))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'RDOM', self.size())
+        return pack_buffer(buffer, offset, array.array('h', self.DoodadRefs))
 
 class BSP_PLANE_TYPE:
     YZ_plane = 0
@@ -1148,6 +1161,8 @@ class BSP_PLANE_TYPE:
     Leaf = 4 # end node, contains polygons
 
 class BSP_Node:
+    layout = struct.Struct('hhhHIf')
+
     def __init__(self):
         self.PlaneType = 0
         self.Children = (0, 0)
@@ -1156,21 +1171,18 @@ class BSP_Node:
         self.Dist = 0
 
     def read(self, f):
-        self.PlaneType = struct.unpack("h", f.read(2))[0]
-        self.Children = struct.unpack("hh", f.read(4))
-        self.NumFaces = struct.unpack("H", f.read(2))[0]
-        self.FirstFace = struct.unpack("I", f.read(4))[0]
-        self.Dist = struct.unpack("f", f.read(4))[0]
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
-    def write(self, f):
-        f.write(struct.pack('h', self.PlaneType))
-        f.write(struct.pack('hh', *self.Children))
-        f.write(struct.pack('H', self.NumFaces))
-        f.write(struct.pack('I', self.FirstFace))
-        f.write(struct.pack('f', self.Dist))
+    def unpack(self, values):
+        self.PlaneType = values[0]
+        self.Children = values[1:3]
+        self.NumFaces, self.FirstFace, self.Dist = values[3:]
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.PlaneType, *self.Children, self.NumFaces, self.FirstFace, self.Dist)
 
 # collision geometry
-class MOBN_chunk:
+class MOBN_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Nodes = []
@@ -1179,24 +1191,16 @@ class MOBN_chunk:
         # read header
         self.Header.read(f)
 
-        count = self.Header.Size // 0x10
-
-        self.Nodes = []
-
-        for i in range(count):
-            node = BSP_Node()
-            node.read(f)
-            self.Nodes.append(node)
+        self.Nodes = read_record_list(f, BSP_Node, self.Header.Size // 0x10)
 
-    def write(self, f):
-        self.Header.Magic = 'NBOM'
-        self.Header.Size = len(self.Nodes) * 0x10
+    def size(self):
+        return len(self.Nodes) * 0x10
 
-        self.Header.write(f)
-        for node in self.Nodes:
-            node.write(f)
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'NBOM', self.size())
+        return pack_record_list(buffer, offset, self.Nodes)
 
-class MOBR_chunk:
+class MOBR_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
         self.Faces = []
@@ -1207,24 +1211,22 @@ class MOBR_chunk:
 
         count = self.Header.Size // 2
 
-        self.Faces = []
-
-        for i in range(count):
-            self.Faces.append(struct.unpack("H", f.read(2))[0])
+        faces = array.array('H')
+        faces.frombytes(f.read(count * 2))
+        self.Faces = faces.tolist()
 
-    def write(self, f):
-        self.Header.Magic = 'RBOM'
-        self.Header.Size = len(self.Faces) * 2
+    def size(self):
+        return len(self.Faces) * 2
 
-        self.Header.write(f)
-        for face in self.Faces:
-            f.write(struct.pack('H', face))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'RBOM', self.size())
+        return pack_buffer(buffer, offset, array.array('H', self.Faces))
 
 # vertex colors
-class MOCV_chunk:
+class MOCV_chunk(Chunk):
     def __init__(self):
         self.Header = ChunkHeader()
-        self.vertColors = []
+        self.vertColors = PackedArray('B', 4)
 
     def read(self, f):
         # read header
@@ -1233,73 +1235,66 @@ class MOCV_chunk:
         # 4 = sizeof(unsigned char) * 4
         count = self.Header.Size // 4
 
-        self.vertColors = []
-
-        for i in range(count):
-            self.vertColors.append(struct.unpack("BBBB", f.read(4)))
+        self.vertColors = PackedArray.from_bytes('B', 4, f.read(count * 4))
 
-    def write(self, f):
-        self.Header.Magic = 'VCOM'
-        self.Header.Size = len(self.vertColors) * 4
+    def size(self):
+        return len(self.vertColors) * 4
 
-        self.Header.write(f)
-        for vc in self.vertColors:
-            f.write(struct.pack('BBBB', *vc))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'VCOM', self.size())
+        return pack_buffer(buffer, offset, records_buffer('B', 4, self.vertColors))
 
 class LiquidVertex:
+    layout = struct.Struct('f')
+
     def __init__(self):
 
         self.height = 0
 
     def read(self, f):
-        self.height = struct.unpack("f", f.read(4))
+        self.unpack(self.layout.unpack(f.read(self.layout.size)))
 
+    def unpack(self, values):
+        self.height = values[-1]
 
-    def write(self, f):
-        f.write(struct.pack('f', self.height))
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.height)
 
 class WaterVertex(LiquidVertex):
+    layout = struct.Struct('BBBBf')
+
     def __init__(self):
         self.flow1 = 0
         self.flow2 = 0
         self.flow1Pct = 0
         self.filler = 0
 
-    def read(self, f):
-
-        self.flow1 = struct.unpack("B", f.read(1))[0]
-        self.flow2 = struct.unpack("B", f.read(1))[0]
-        self.flow1Pct = struct.unpack("B", f.read(1))[0]
-        self.filler = struct.unpack("B", f.read(1))[0]
-        LiquidVertex.read(self, f) # Python, wtf?
-
+    def unpack(self, values):
+        self.flow1, self.flow2, self.flow1Pct, self.filler = values[:4]
+        LiquidVertex.unpack(self, values) # Python, wtf?
 
-    def write(self, f):
-
-        f.write(struct.pack('B', self.flow1))
-        f.write(struct.pack('B', self.flow2))
-        f.write(struct.pack('B', self.flow1Pct))
-        f.write(struct.pack('B', self.filler))
-        LiquidVertex.write(self, f) # Python, wtf?
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.flow1, self.flow2, self.flow1Pct, self.filler, self.height)
 
 
 class MagmaVertex(LiquidVertex):
+    layout = struct.Struct('hhf')
+
     def __init__(self):
         self.u = 0
         self.v = 0
 
-    def read(self, f):
-        self.u = struct.unpack("h", f.read(2))[0]
-        self.v = struct.unpack("h", f.read(2))[0]
-        LiquidVertex.read(self, f)
+    def unpack(self, values):
+        self.u, self.v = values[:2]
+        LiquidVertex.unpack(self, values)
+
+    def pack_into(self, buffer, offset):
+        self.layout.pack_into(buffer, offset, self.u, self.v, self.height)
 
-    def write(self, f):
-        f.write(struct.pack('h', self.u))
-        f.write(struct.pack('h', self.v))
-        LiquidVertex.write(self, f)
 
+class MLIQ_chunk(Chunk):
+    layout = struct.Struct('IIII3fH')
 
-class MLIQ_chunk:
     def __init__(self, mat = True):
         self.Header = ChunkHeader()
         self.xVerts = 0
@@ -1316,45 +1311,29 @@ class MLIQ_chunk:
         # read header
         self.Header.read(f)
 
-        self.xVerts = struct.unpack("I", f.read(4))[0]
-        self.yVerts = struct.unpack("I", f.read(4))[0]
-        self.xTiles = struct.unpack("I", f.read(4))[0]
-        self.yTiles = struct.unpack("I", f.read(4))[0]
-        self.Position = struct.unpack("fff", f.read(12))
-        self.materialID = struct.unpack("H", f.read(2))[0]
+        values = self.layout.unpack(f.read(self.layout.size))
 
-        self.VertexMap = []
-
-        for i in range(self.xVerts * self.yVerts):
-            vtx = WaterVertex() if self.LiquidMaterial else MagmaVertex()
-            vtx.read(f)
-            self.VertexMap.append(vtx)
+        self.xVerts, self.yVerts, self.xTiles, self.yTiles = values[:4]
+        self.Position = values[4:7]
+        self.materialID = values[7]
 
-        self.TileFlags = []
+        self.VertexMap = read_record_list(f, WaterVertex if self.LiquidMaterial else MagmaVertex,
+                                          self.xVerts * self.yVerts)
 
         # 0x40 = visible
         # 0x0C = invisible
         # well some other strange things (e.g 0x7F = visible, etc...)
 
-        for i in range(self.xTiles * self.yTiles):
-            self.TileFlags.append(struct.unpack("B", f.read(1))[0])
-
-
-    def write(self, f):
-        self.Header.Magic = 'QILM'
-        self.Header.Size = 30 + self.xVerts * self.yVerts * 8 + self.xTiles * self.yTiles
+        self.TileFlags = list(f.read(self.xTiles * self.yTiles))
 
-        self.Header.write(f)
+    def size(self):
+        return 30 + len(self.VertexMap) * 8 + len(self.TileFlags)
 
-        f.write(struct.pack('I', self.xVerts))
-        f.write(struct.pack('I', self.yVerts))
-        f.write(struct.pack('I', self.xTiles))
-        f.write(struct.pack('I', self.yTiles))
-        f.write(struct.pack('fff', *self.Position))
-        f.write(struct.pack('H', self.materialID))
+    def pack_into(self, buffer, offset):
+        offset = self.pack_header(buffer, offset, 'QILM', self.size())
 
-        for vtx in self.VertexMap:
-            vtx.write(f)
-        for tile_flag in self.TileFlags:
-            f.write(struct.pack('B', tile_flag))
+        self.layout.pack_into(buffer, offset, self.xVerts, self.yVerts, self.xTiles, self.yTiles,
+                              *self.Position, self.materialID)
 
+        offset = pack_record_list(buffer, offset + 30, self.VertexMap)
+        return pack_buffer(buffer, offset, bytes(self.TileFlags))
@@ -1,18 +1,232 @@
 from .wmo_format import *
 from .bsp_tree import *
 from .collision import *
+from .chunk_directory import ChunkDirectory, LazyChunkFile
+from .group_cache import GroupCache, RawChunk
+from .texture_paths import fill_textures
 
 import math
 from math import *
 
 import os
 import sys
+import array
+import hashlib
+import bpy
+import bmesh
 import mathutils
 
 
-class WMOGroupFile:
-    def __init__(self, root):
+def is_uv_seam(edge, uv_layer, limit=0.0001):
+    """ Check if faces sharing an edge are not connected in UV space """
+    face_uvs = [{loop.vert: loop[uv_layer].uv for loop in face.loops} for face in edge.link_faces]
+
+    for uvs in face_uvs[1:]:
+        for vert in edge.verts:
+            uv1 = face_uvs[0][vert]
+            uv2 = uvs[vert]
+            if abs(uv1[0] - uv2[0]) > limit or abs(uv1[1] - uv2[1]) > limit:
+                return True
+
+    return False
+
+
+def hash_collection(sha, collection, attr, typecode, width):
+    """ Feed a property of all items of a Blender collection to a hash. Boolean properties use no typecode """
+    if typecode is None:
+        values = [False] * (len(collection) * width)
+        collection.foreach_get(attr, values)
+        sha.update(bytes(values))
+    else:
+        values = array.array(typecode, bytes(array.array(typecode).itemsize * len(collection) * width))
+        collection.foreach_get(attr, values)
+        sha.update(values)
+
+
+def loop_tex_coords(tex_coords, indices):
+    """ Expand per-vertex texture coordinates to flat per-loop UVs with V flipped """
+    if numpy is not None:
+        uvs = tex_coords.as_numpy()[numpy.asarray(indices)]
+        uvs[:, 1] = 1.0 - uvs[:, 1]
+        return uvs.ravel()
+
+    buffer = tex_coords.buffer
+    uvs = array.array('f', bytes(8 * len(indices)))
+    for i, index in enumerate(indices):
+        uvs[i * 2] = buffer[index * 2]
+        uvs[i * 2 + 1] = 1.0 - buffer[index * 2 + 1]
+
+    return uvs
+
+
+def loop_vertex_colors(vert_colors, indices):
+    """ Expand per-vertex BGRA colors to flat per-loop RGB floats """
+    if numpy is not None:
+        return (vert_colors.as_numpy()[numpy.asarray(indices)][:, 2::-1] / 255).astype(numpy.float32).ravel()
+
+    buffer = vert_colors.buffer
+    colors = array.array('f', bytes(12 * len(indices)))
+    for i, index in enumerate(indices):
+        colors[i * 3] = buffer[index * 4 + 2] / 255
+        colors[i * 3 + 1] = buffer[index * 4 + 1] / 255
+        colors[i * 3 + 2] = buffer[index * 4] / 255
+
+    return colors
+
+
+def vertices_by_alpha(vert_colors, vertices):
+    """ Group vertex indices by the alpha value of their color, so weights can be assigned per value """
+    buffer = vert_colors.buffer
+    groups = {}
+    for index in vertices:
+        groups.setdefault(buffer[index * 4 + 3], []).append(index)
+
+    return groups
+
+
+def pack_bgra_colors(colors, alphas):
+    """ Convert flat RGB floats and alpha bytes to flat BGRA bytes """
+    if numpy is not None:
+        rgb = numpy.round(numpy.asarray(colors, dtype=numpy.float64).reshape(-1, 3)[:, ::-1] * 255)
+        return numpy.column_stack((rgb, numpy.asarray(alphas))).astype('B').ravel()
+
+    bgra = []
+    for i, alpha in enumerate(alphas):
+        bgra.extend((round(colors[i * 3 + 2] * 255), round(colors[i * 3 + 1] * 255), round(colors[i * 3] * 255), alpha))
+
+    return bgra
+
+
+def first_use_remap(vertex_indices, n_vertices):
+    """ Number vertices in order of their first use, unused vertices are mapped to -1 """
+    if numpy is not None:
+        vertex_indices = numpy.asarray(vertex_indices, dtype=numpy.intp)
+        unique, first_use = numpy.unique(vertex_indices, return_index=True)
+
+        remap = numpy.full(n_vertices, -1, dtype=numpy.intp)
+        remap[unique[numpy.argsort(first_use)]] = numpy.arange(len(unique))
+        return remap
+
+    remap = [-1] * n_vertices
+    n_used = 0
+    for index in vertex_indices:
+        if remap[index] < 0:
+            remap[index] = n_used
+            n_used += 1
+
+    return remap
+
+
+def gather_records(values, width, indices):
+    """ Pick records of a flat buffer in the given index order """
+    if numpy is not None:
+        return numpy.asarray(values).reshape(-1, width)[numpy.asarray(indices, dtype=numpy.intp)].ravel()
+
+    gathered = []
+    for index in indices:
+        gathered.extend(values[index * width:(index + 1) * width])
+
+    return gathered
+
+
+def scatter_records(values, width, targets, size, default):
+    """ Write flat records to target slots of a new buffer. Later records overwrite earlier ones """
+    if numpy is not None:
+        values = numpy.asarray(values).reshape(-1, width)
+        targets = numpy.asarray(targets, dtype=numpy.intp)
 
+        scattered = numpy.tile(numpy.asarray(default, dtype=values.dtype), (size, 1))
+        unique, last_use = numpy.unique(targets[::-1], return_index=True)
+        scattered[unique] = values[::-1][last_use]
+        return scattered.ravel()
+
+    scattered = list(default) * size
+    for i, target in enumerate(targets):
+        scattered[target * width:(target + 1) * width] = values[i * width:(i + 1) * width]
+
+    return scattered
+
+
+def average_records(values, width, targets, size):
+    """ Average flat records sharing a target slot, slots without records are zero """
+    if numpy is not None:
+        targets = numpy.asarray(targets, dtype=numpy.intp)
+
+        sums = numpy.zeros((size, width))
+        numpy.add.at(sums, targets, numpy.asarray(values, dtype=numpy.float64).reshape(-1, width))
+
+        counts = numpy.bincount(targets, minlength=size)
+        used = counts > 0
+        sums[used] /= counts[used, None]
+        return sums.ravel()
+
+    sums = [0.0] * (size * width)
+    counts = [0] * size
+    for i, target in enumerate(targets):
+        counts[target] += 1
+        for j in range(width):
+            sums[target * width + j] += values[i * width + j]
+
+    for target, count in enumerate(counts):
+        for j in range(width):
+            if count:
+                sums[target * width + j] /= count
+
+    return sums
+
+
+def integer_bounding_box(coords, indices=None):
+    """ Get [min x, min y, min z, max x, max y, max z] of points rounded outwards to integers """
+    bounding_box = [32767, 32767, 32767, -32768, -32768, -32768]
+
+    if numpy is not None:
+        points = numpy.asarray(coords).reshape(-1, 3)
+        if indices is not None:
+            points = points[numpy.asarray(indices, dtype=numpy.intp)]
+
+        if len(points):
+            for i in range(3):
+                bounding_box[i] = min(bounding_box[i], int(floor(points[:, i].min())))
+                bounding_box[i + 3] = max(bounding_box[i + 3], int(ceil(points[:, i].max())))
+
+        return bounding_box
+
+    if indices is None:
+        indices = range(len(coords) // 3)
+
+    for index in indices:
+        for i in range(3):
+            bounding_box[i] = min(bounding_box[i], floor(coords[index * 3 + i]))
+            bounding_box[i + 3] = max(bounding_box[i + 3], ceil(coords[index * 3 + i]))
+
+    return bounding_box
+
+
+class WMOGroupFile(LazyChunkFile):
+
+    chunk_attributes = (
+        ('mver', 'REVM', 0),
+        ('mogp', 'PGOM', 0),
+        ('mopy', 'YPOM', 0),
+        ('movi', 'IVOM', 0),
+        ('movt', 'TVOM', 0),
+        ('monr', 'RNOM', 0),
+        ('motv', 'VTOM', 0),
+        ('moba', 'ABOM', 0),
+        ('molr', 'RLOM', 0),
+        ('modr', 'RDOM', 0),
+        ('mobn', 'NBOM', 0),
+        ('mobr', 'RBOM', 0),
+        ('mocv', 'VCOM', 0),
+        ('mliq', 'QILM', 0),
+        ('motv2', 'VTOM', 1),
+        ('mocv2', 'VCOM', 1)
+    )
+
+    # chunks built from group geometry only, they are reused from cache on incremental export
+    geometry_chunks = ('mopy', 'movi', 'movt', 'monr', 'motv', 'moba', 'mobn', 'mobr', 'mocv', 'motv2', 'mocv2')
+
+    def __init__(self, root):
         self.root = root
 
         self.mver = MVER_chunk()
@@ -32,125 +246,144 @@ class WMOGroupFile:
         self.motv2 = MOTV_chunk()
         self.mocv2 = MOCV_chunk()
 
+        # quality of BSP trees built on export, by split strategy
+        self.bsp_stats = {}
+
+        # (fingerprint, metadata) of freshly saved geometry to be cached after writing
+        self.cache_entry = None
+
     def read(self, f):
-        """ Read WoW WMO group file """
+        """ Read WoW WMO group file. Accepts an open binary file or raw file bytes.
+        All chunks are decoded before returning, the file is left open for the caller to close """
+        if isinstance(f, (bytes, bytearray)):
+            directory = ChunkDirectory(f)
+        else:
+            directory = ChunkDirectory.from_file(f)
 
-        self.mver.read(f)
-        self.mogp.read(f)
-        self.mopy.read(f)
-        self.movi.read(f)
-        self.movt.read(f)
-        self.monr.read(f)
-        self.motv.read(f)
-        self.moba.read(f)
+        self.read_chunks(directory)
 
-        if self.mogp.Flags & MOGP_FLAG.HasLight:
-            self.molr.read(f)
+    def decode_chunk(self, name, chunk, magic, index):
+        """ Decode a chunk of a lazily read group file """
+        if name == 'mliq' and self.mogp.LiquidType in {3, 4, 7, 8, 11, 12}:
+            chunk.LiquidMaterial = False
 
-        if self.mogp.Flags & MOGP_FLAG.HasDoodads:
-            self.modr.read(f)
+        LazyChunkFile.decode_chunk(self, name, chunk, magic, index)
 
-        if self.mogp.Flags & MOGP_FLAG.HasCollision:
-            self.mobn.read(f)
-            self.mobr.read(f)
+    def serialize(self):
+        """ Pack a saved WoW WMO group into a single buffer sized up front and return its bytes """
+        chunks = [chunk for chunk in (self.mopy, self.movi, self.movt, self.monr, self.motv, self.moba,
+                                      self.molr, self.modr, self.mobn, self.mobr, self.mocv, self.mliq,
+                                      self.motv2, self.mocv2) if chunk]
 
-        if self.mogp.Flags & MOGP_FLAG.HasVertexColor:
-            self.mocv.read(f)
+        # group header chunk contains all other chunks of the file
+        self.mogp.Header.Size = self.mogp.size() + sum(8 + chunk.size() for chunk in chunks)
 
-        if self.mogp.Flags & MOGP_FLAG.HasWater:
-            if self.mogp.LiquidType in {3, 4, 7, 8, 11, 12}:
-                self.mliq.LiquidMaterial = False
-            self.mliq.read(f)
+        buffer = bytearray(8 + self.mver.size() + 8 + self.mogp.Header.Size)
 
-        if self.mogp.Flags & MOGP_FLAG.HasTwoMOTV:
-            self.motv2.read(f)
+        offset = self.mver.pack_into(buffer, 0)
+        offset = self.mogp.pack_into(buffer, offset)
 
-        if self.mogp.Flags & MOGP_FLAG.HasTwoMOCV:
-            self.mocv2.read(f)
+        for chunk in chunks:
+            offset = chunk.pack_into(buffer, offset)
+
+        return bytes(buffer)
 
     def write(self, f):
         """ Write a saved WoW WMO group to a file """
-        print("\nWriting file: <<" +  os.path.basename(f.name) + ">>")
+        f.write(self.serialize())
+
+    @staticmethod
+    def comp_colors(color1, color2):
+        """ Compare two colors """
 
-        self.mver.write(f)
+        for i in range(0, 3):
+            if color1[i] != color2[i]:
+                return False
+        return True
 
-        f.seek(0x58)
-        self.mopy.write(f)
-        self.movi.write(f)
-        self.movt.write(f)
-        self.monr.write(f)
-        self.motv.write(f)
-        self.moba.write(f)
+    @staticmethod
+    def prepare_mesh(obj):
+        """ Get a temporary triangulated mesh of an object with modifiers and transformation applied,
+        split at UV island borders, sharp edges and borders of batch vertex groups """
+        mesh = obj.to_mesh(bpy.context.scene, True, 'PREVIEW')
 
-        if self.molr:
-            self.molr.write(f)
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
 
-        if self.modr:
-            self.modr.write(f)
+        bmesh.ops.triangulate(bm, faces=bm.faces[:], quad_method=0, ngon_method=0)
 
-        self.mobn.write(f)
-        self.mobr.write(f)
+        # delete loose geometry
+        for edge in [edge for edge in bm.edges if not edge.link_faces]:
+            bm.edges.remove(edge)
 
-        if self.mocv:
-            self.mocv.write(f)
+        for vert in [vert for vert in bm.verts if not vert.link_faces]:
+            bm.verts.remove(vert)
 
-        if self.mliq:
-            self.mliq.write(f)
+        bm.transform(obj.matrix_basis)
 
-        if self.motv2:
-            self.motv2.write(f)
+        # take normals before splitting so that split edges keep smooth shading
+        bm.to_mesh(mesh)
+        mesh.calc_normals_split()
 
-        if self.mocv2:
-            self.mocv2.write(f)
+        loop_normals = array.array('f', bytes(12 * len(mesh.loops)))
+        mesh.loops.foreach_get("normal", loop_normals)
 
-        # get file size
-        f.seek(0, 2)
-        self.mogp.Header.Size = f.tell() - 20
+        split_edges = set(edge for edge in bm.edges if not edge.smooth)
 
-        # write header
-        f.seek(0xC)
-        self.mogp.write(f)
+        uv_layer = bm.loops.layers.uv.active
+        if uv_layer is not None:
+            split_edges.update(edge for edge in bm.edges if len(edge.link_faces) > 1 and is_uv_seam(edge, uv_layer))
 
-    @staticmethod
-    def get_avg(list):
-        """ Get single average normal vector from a split normal """
-        normal = [0.0, 0.0, 0.0]
+        # split batch vertex groups from the rest of geometry to keep batches accurate
+        deform_layer = bm.verts.layers.deform.active
 
-        for n in list:
-            for i in range(0, 3):
-                normal[i] += n[i]
+        for group_name in (obj.WowVertexInfo.BatchTypeA, obj.WowVertexInfo.BatchTypeB):
+            vertex_group = obj.vertex_groups.get(group_name) if group_name else None
+            if vertex_group is None or deform_layer is None:
+                continue
 
-        for i in range(0, 3):
-            normal[i] /= len(list)
+            in_group = {face: all(vertex_group.index in vert[deform_layer] for vert in face.verts) for face in bm.faces}
+
+            split_edges.update(edge for edge in bm.edges
+                               if len(set(in_group[face] for face in edge.link_faces)) > 1)
+
+        # faces and their loops keep their order, so loop normals still match after splitting
+        bmesh.ops.split_edges(bm, edges=list(split_edges))
+        bm.to_mesh(mesh)
+        bm.free()
 
-        return normal
+        mesh.use_auto_smooth = True
+        mesh.normals_split_custom_set(list(zip(loop_normals[0::3], loop_normals[1::3], loop_normals[2::3])))
+        mesh.calc_normals_split()
+
+        return mesh
 
     @staticmethod
-    def comp_colors(color1, color2):
-        """ Compare two colors """
+    def get_vertex_group_weights(mesh, vertex_groups):
+        """ Get weights of all vertices in the given vertex groups in one pass, -1.0 marks vertices outside a group """
+        weights = {vertex_group.index: array.array('f', [-1.0]) * len(mesh.vertices) for vertex_group in vertex_groups}
 
-        for i in range(0, 3):
-            if color1[i] != color2[i]:
-                return False
-        return True
+        for vertex in mesh.vertices:
+            for group_info in vertex.groups:
+                group_weights = weights.get(group_info.group)
+                if group_weights is not None:
+                    group_weights[vertex.index] = group_info.weight
+
+        return weights
 
     @staticmethod
-    def get_batch_type(polygon, mesh, vg_index_a, vg_index_b):
-        """ Find which MOBA batch type a passed polygon belongs two """
-        counter_a = 0
-        counter_b = 0
-
-        for i in polygon.vertices:
-            for group_info in mesh.vertices[i].groups:
-                if group_info.group == vg_index_a:
-                    counter_a += 1
-                elif group_info.group == vg_index_b:
-                    counter_b += 1
-
-        if counter_a == len(polygon.vertices):
-            return 0
+    def get_loop_tex_coords(uv_layer, loops):
+        """ Get flat UVs of the given loops with V flipped to WoW convention """
+        uvs = array.array('f', bytes(8 * len(uv_layer.data)))
+        uv_layer.data.foreach_get("uv", uvs)
+        uvs = gather_records(uvs, 2, loops)
+
+        if numpy is not None:
+            uvs[1::2] = 1.0 - uvs[1::2]
         else:
-            return 1 if counter_b == len(polygon.vertices) else 2
+            uvs[1::2] = [1.0 - v for v in uvs[1::2]]
+
+        return uvs
 
     def get_material_viewport_image(self, material):
         """ Get viewport image assigned to a material """
@@ -192,7 +425,7 @@ class WMOGroupFile:
             y_pos = self.mliq.Position[1] + y * 4.1666625
             for x in range(0 , self.mliq.xVerts):
                 x_pos = self.mliq.Position[0] + x * 4.1666625
-                vertices.append((x_pos, y_pos, self.mliq.VertexMap[y * self.mliq.xVerts + x].height[0]))
+                vertices.append((x_pos, y_pos, self.mliq.VertexMap[y * self.mliq.xVerts + x].height))
 
         # calculate faces
         indices = []
@@ -309,19 +542,26 @@ class WMOGroupFile:
     # Create mesh from file data
     def load_object(self, obj_name, editable_doodads):
         """ Load WoW WMO group as an object to the Blender scene """
-        custom_normals = []
-        faces = []
-
         vertices = self.movt.Vertices
         normals = self.monr.Normals
-        tex_coords = self.motv.TexCoords
+        n_polygons = len(self.movi.Indices) // 3
+        n_loops = n_polygons * 3
+        indices = self.movi.Indices[:n_loops]
 
-        for i in range(0, len(self.movi.Indices), 3):
-            faces.append(self.movi.Indices[i:i+3])
-
-        # create mesh
+        # create mesh from flat buffers, loops are in the same order as MOVI indices
         mesh = bpy.data.meshes.new(obj_name)
-        mesh.from_pydata(vertices, [], faces)
+        mesh.vertices.add(len(vertices))
+        mesh.vertices.foreach_set("co", vertices.buffer)
+
+        mesh.loops.add(n_loops)
+        mesh.loops.foreach_set("vertex_index", indices)
+
+        mesh.polygons.add(n_polygons)
+        mesh.polygons.foreach_set("loop_start", range(0, n_loops, 3))
+        mesh.polygons.foreach_set("loop_total", [3] * n_polygons)
+        mesh.polygons.foreach_set("use_smooth", [True] * n_polygons)
+
+        mesh.update(calc_edges=True)
 
         # create object
         scn = bpy.context.scene
@@ -332,19 +572,12 @@ class WMOGroupFile:
         nobj = bpy.data.objects.new(obj_name, mesh)
         scn.objects.link(nobj)
 
-        for poly in mesh.polygons:
-            poly.use_smooth = True
-
         # set normals
-        for i in range(len(normals)):
-            mesh.vertices[i].normal = normals[i]
-
+        mesh.vertices.foreach_set("normal", normals.buffer)
         mesh.use_auto_smooth = True
-        for loop in mesh.loops:
-            mesh.vertices[loop.vertex_index].normal = normals[loop.vertex_index]
-            custom_normals.append(normals[loop.vertex_index])
+        mesh.normals_split_custom_set_from_vertices(list(normals))
 
-        mesh.normals_split_custom_set(custom_normals)
+        used_vertices = sorted(set(indices))
 
         # set vertex color
         if self.mogp.Flags & MOGP_FLAG.HasVertexColor:
@@ -352,44 +585,31 @@ class WMOGroupFile:
             flag_set.add('0')
             nobj.WowWMOGroup.Flags = flag_set
             vert_color_layer1 = mesh.vertex_colors.new("Col")
+            vert_color_layer1.data.foreach_set("color", loop_vertex_colors(self.mocv.vertColors, indices))
 
             lightmap = nobj.vertex_groups.new("Lightmap")
             nobj.WowVertexInfo.Lightmap = lightmap.name
-            lightmap.add(self.movi.Indices, 1.0, 'ADD')
-
-            # loops and vertex_color are in the same order, so we use it to find vertex index
-            for i in range(len(mesh.loops)):
 
-                vert_color_layer1.data[i].color = (self.mocv.vertColors[mesh.loops[i].vertex_index][2] / 255,
-                                                  self.mocv.vertColors[mesh.loops[i].vertex_index][1] / 255,
-                                                  self.mocv.vertColors[mesh.loops[i].vertex_index][0] / 255)
-
-                mesh.vertices[mesh.loops[i].vertex_index].groups[lightmap.index].weight \
-                = self.mocv.vertColors[mesh.loops[i].vertex_index][3] / 255
+            for alpha, group_vertices in vertices_by_alpha(self.mocv.vertColors, used_vertices).items():
+                lightmap.add(group_vertices, alpha / 255, 'REPLACE')
 
         if self.mogp.Flags & MOGP_FLAG.HasTwoMOCV:
             blendmap = nobj.vertex_groups.new("Blendmap")
             nobj.WowVertexInfo.Blendmap = blendmap.name
-            blendmap.add(self.movi.Indices, 1.0, 'ADD')
 
-            for vertex in mesh.vertices:
-                vertex.groups[blendmap.index].weight = self.mocv2.vertColors[vertex.index][3] / 255
+            for alpha, group_vertices in vertices_by_alpha(self.mocv2.vertColors, used_vertices).items():
+                blendmap.add(group_vertices, alpha / 255, 'REPLACE')
 
         # set uv
         uv1 = mesh.uv_textures.new("UVMap")
         uv_layer1 = mesh.uv_layers[0]
-        for i in range(len(uv_layer1.data)):
-            uv = tex_coords[mesh.loops[i].vertex_index]
-            uv_layer1.data[i].uv = (uv[0], 1 - uv[1])
+        uv_layer1.data.foreach_set("uv", loop_tex_coords(self.motv.TexCoords, indices))
 
         if self.mogp.Flags & MOGP_FLAG.HasTwoMOTV:
             uv2 = mesh.uv_textures.new("UVMap_2")
             nobj.WowVertexInfo.SecondUV = uv2.name
             uv_layer2 = mesh.uv_layers[1]
-
-            for j in range(len(uv_layer2.data)):
-                uv = self.motv2.TexCoords[mesh.loops[j].vertex_index]
-                uv_layer2.data[j].uv = (uv[0], 1 - uv[1])
+            uv_layer2.data.foreach_set("uv", loop_tex_coords(self.motv2.TexCoords, indices))
 
         # map root material ID to index in mesh materials
         material_indices = {}
@@ -452,13 +672,13 @@ class WMOGroupFile:
                 break
 
         # set faces material
-        for i in range(len(mesh.polygons)):
-            mat_id = self.mopy.TriangleMaterials[i].MaterialID
-
-            mesh.polygons[i].material_index = material_indices[mat_id]
+        polygon_materials = [material_indices[triangle.MaterialID]
+                             for triangle in self.mopy.TriangleMaterials[:n_polygons]]
+        mesh.polygons.foreach_set("material_index", polygon_materials)
 
-            # set texture displayed in viewport
-            img = material_viewport_textures[material_indices[mat_id]]
+        # set texture displayed in viewport
+        for i, mat_id in enumerate(polygon_materials):
+            img = material_viewport_textures[mat_id]
             if img is not None:
                 uv1.data[i].image = img
 
@@ -748,79 +968,166 @@ class WMOGroupFile:
 
                 self.mliq.TileFlags.append(tile_flag)
 
-    def save(self, original_obj, obj, autofill_textures):
-        """ Save WoW WMO group data for future export """
-        print("\nSaving group: <<{}>>".format(obj.name[:-4]))
+    def save(self, obj, autofill_textures, bsp_split_strategy='MIDPOINT', compare_bsp_strategies=False, cache=None,
+             bsp_cache=None):
+        """ Save WoW WMO group data for future export. Geometry of groups found in cache is reused """
+        print("\nSaving group: <<{}>>".format(obj.name))
 
-        bpy.context.scene.objects.active = obj
-        mesh = obj.data
+        self.mver.Version = 17
 
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.reveal()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.object.mode_set(mode='OBJECT')
+        if autofill_textures:
+            fill_textures([obj])
 
-        if len(obj.modifiers):
-            for modifier in obj.modifiers:
-                bpy.ops.object.modifier_apply(modifier=modifier.name)
+        material_indices = {i: self.root.add_material(slot.material) for i, slot in enumerate(obj.material_slots)}
 
-        bpy.ops.object.modifier_add(type='TRIANGULATE')
-        bpy.context.object.modifiers["Triangulate"].quad_method = 'BEAUTY'
-        bpy.ops.object.modifier_remove(modifier="Triangulate")
+        fingerprint = None
+        if cache is not None:
+            fingerprint = self.get_fingerprint(obj, material_indices, bsp_split_strategy, compare_bsp_strategies)
 
-        # triangulate mesh
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.quads_convert_to_tris()
-        bpy.ops.mesh.delete_loose()
-        bpy.ops.mesh.select_all(action='DESELECT')
+        if fingerprint is not None and self.load_cached(cache.get(fingerprint), material_indices):
+            print("\nReused cached geometry of group: <<{}>>".format(obj.name))
+        else:
+            flags = self.mogp.Flags
+            mesh = self.prepare_mesh(obj)
 
-        # perform edge split.
-        bpy.ops.uv.select_all(action='SELECT')
-        bpy.ops.uv.seams_from_islands(mark_seams=False, mark_sharp=True)
-        bpy.ops.object.mode_set(mode='OBJECT')
+            try:
+                self.save_mesh(obj, mesh, material_indices, bsp_split_strategy, compare_bsp_strategies, bsp_cache)
+            finally:
+                bpy.data.meshes.remove(mesh, do_unlink=True)
 
-        bpy.ops.object.modifier_add(type='EDGE_SPLIT')
-        bpy.context.object.modifiers["EdgeSplit"].use_edge_angle = False
-        bpy.ops.object.modifier_apply(apply_as='DATA', modifier="EdgeSplit")
+            if fingerprint is not None:
+                self.cache_entry = (fingerprint, {'materials': [material_indices[i] for i in range(len(material_indices))],
+                                                  'flags': self.mogp.Flags & ~flags,
+                                                  'chunks': [attr for attr in self.geometry_chunks
+                                                             if getattr(self, attr) is not None],
+                                                  'bsp_stats': self.bsp_stats})
 
-        # apply object transformation to geometry. Needs to be optional.
-        obj.select = True
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-        obj.select = False
+        self.save_relations(obj)
 
-        # perform vertex group split to keep batches accurate.
-        bpy.ops.object.mode_set(mode='EDIT')
-        if obj.WowVertexInfo.BatchTypeA != "":
-            bpy.ops.object.vertex_group_set_active(group=obj.WowVertexInfo.BatchTypeA)
-            bpy.ops.object.vertex_group_select()
-            bpy.ops.mesh.split()
-            bpy.ops.mesh.select_all(action='DESELECT')
+        print("\nDone saving group: <<{}>>".format(obj.name))
 
-        if obj.WowVertexInfo.BatchTypeB != "":
-            bpy.ops.object.vertex_group_set_active(group=obj.WowVertexInfo.BatchTypeB)
-            bpy.ops.object.vertex_group_select()
-            bpy.ops.mesh.split()
-            bpy.ops.mesh.select_all(action='DESELECT')
+    def get_fingerprint(self, obj, material_indices, bsp_split_strategy, compare_bsp_strategies):
+        """ Hash all data group geometry is built from. References to root file entries are not included,
+        as they are written for every export anyway, only the way material slots share root materials is """
+        sha = hashlib.sha1()
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        layout = {}
+        material_layout = [index if index == 0xFF else layout.setdefault(index, slot)
+                           for slot, index in sorted(material_indices.items())]
 
-        mesh.use_auto_smooth = True
+        vertex_info = obj.WowVertexInfo
+        group_props = obj.WowWMOGroup
 
-        if mesh.has_custom_normals:
-            mesh.calc_normals_split()
-        else:
-            bpy.ops.mesh.customdata_custom_splitnormals_add()
-            original_obj.data.calc_normals_split()
-
-            obj.select = True
-            bpy.context.scene.objects.active = original_obj
-            bpy.ops.object.data_transfer(data_type='CUSTOM_NORMAL')
-            obj.select = False
-            bpy.context.scene.objects.active = obj
+        sha.update(repr((GroupCache.version, material_layout, bsp_split_strategy, compare_bsp_strategies,
+                         [tuple(row) for row in obj.matrix_basis],
+                         vertex_info.BatchTypeA, vertex_info.BatchTypeB, vertex_info.VertexGroup,
+                         vertex_info.Lightmap, vertex_info.Blendmap, vertex_info.SecondUV, vertex_info.NodeSize,
+                         sorted(group_props.Flags), group_props.PlaceType)).encode('utf-8'))
+
+        mesh = obj.to_mesh(bpy.context.scene, True, 'PREVIEW')
+
+        try:
             mesh.calc_normals_split()
 
+            for collection, attr, typecode, width in ((mesh.vertices, "co", 'f', 3),
+                                                      (mesh.edges, "vertices", 'i', 2),
+                                                      (mesh.edges, "use_edge_sharp", None, 1),
+                                                      (mesh.polygons, "loop_start", 'i', 1),
+                                                      (mesh.polygons, "loop_total", 'i', 1),
+                                                      (mesh.polygons, "material_index", 'i', 1),
+                                                      (mesh.polygons, "use_smooth", None, 1),
+                                                      (mesh.loops, "vertex_index", 'i', 1),
+                                                      (mesh.loops, "normal", 'f', 3)):
+                hash_collection(sha, collection, attr, typecode, width)
+
+            uv_layers = [mesh.uv_layers.active] if mesh.uv_layers.active else []
+            if vertex_info.SecondUV in mesh.uv_layers:
+                uv_layers.append(mesh.uv_layers[vertex_info.SecondUV])
+
+            for uv_layer in uv_layers:
+                hash_collection(sha, uv_layer.data, "uv", 'f', 2)
+
+            if len(mesh.vertex_colors):
+                hash_collection(sha, mesh.vertex_colors.active.data, "color", 'f', 3)
+
+            vertex_groups = [obj.vertex_groups.get(name) for name in (vertex_info.BatchTypeA, vertex_info.BatchTypeB,
+                                                                      vertex_info.VertexGroup, vertex_info.Lightmap,
+                                                                      vertex_info.Blendmap) if name]
+            vertex_groups = [vertex_group for vertex_group in vertex_groups if vertex_group is not None]
+
+            weights = self.get_vertex_group_weights(mesh, vertex_groups)
+            for vertex_group in vertex_groups:
+                sha.update(weights[vertex_group.index])
+
+        finally:
+            bpy.data.meshes.remove(mesh, do_unlink=True)
+
+        return sha.hexdigest()
+
+    def load_cached(self, entry, material_indices):
+        """ Take geometry chunks from a cached group file, remapping its material indices to the current ones.
+        Returns False if the entry can not be used """
+        if entry is None:
+            return False
+
+        metadata, data = entry
+        directory = ChunkDirectory(data)
+
+        mogp = MOGP_chunk()
+        if not directory.read_chunk(mogp, 'PGOM') or len(metadata['materials']) != len(material_indices):
+            return False
+
+        # cached and current slots share materials the same way, so an index map is consistent
+        index_map = list(range(256))
+        for slot, index in enumerate(metadata['materials']):
+            index_map[index] = material_indices[slot]
+        index_map = bytes(index_map)
+
+        chunks = {}
+        occurrences = {}
+
+        for attr, magic, index in self.chunk_attributes:
+            if attr not in self.geometry_chunks:
+                continue
+
+            if attr not in metadata['chunks']:
+                chunks[attr] = None
+                continue
+
+            entry = directory.find(magic, occurrences.get(magic, 0))
+            occurrences[magic] = occurrences.get(magic, 0) + 1
+
+            if entry is None:
+                return False
+
+            chunk = bytearray(data[entry.offset:entry.offset + 8 + entry.size])
+
+            # material ID is the last byte of triangle materials and batches
+            if attr == 'mopy':
+                chunk[9::2] = chunk[9::2].translate(index_map)
+            elif attr == 'moba':
+                chunk[31::24] = chunk[31::24].translate(index_map)
+
+            chunks[attr] = RawChunk(bytes(chunk))
+
+        for attr, chunk in chunks.items():
+            setattr(self, attr, chunk)
+
+        self.mogp.Flags |= metadata['flags']
+        self.mogp.BoundingBoxCorner1 = mogp.BoundingBoxCorner1
+        self.mogp.BoundingBoxCorner2 = mogp.BoundingBoxCorner2
+        self.mogp.nBatchesA = mogp.nBatchesA
+        self.mogp.nBatchesB = mogp.nBatchesB
+        self.mogp.nBatchesC = mogp.nBatchesC
+        self.mogp.nBatchesD = mogp.nBatchesD
+
+        self.bsp_stats = metadata['bsp_stats']
+
+        return True
+
+    def save_mesh(self, obj, mesh, material_indices, bsp_split_strategy, compare_bsp_strategies, bsp_cache=None):
+        """ Save geometry of a prepared group mesh """
+
         # doing safety checks
         if len(mesh.vertices) > 65535:
             print("\nObject <<{}>> contains more vertices ({}) than it is supported. "
@@ -830,18 +1137,6 @@ class WMOGroupFile:
             print("\nScene has exceeded the maximum allowed number of WoW materials (255). Your scene now has {} materials. "
                   "So, {} extra ones.".format(len(self.root.momt.Materials), (len(self.root.momt.Materials) - 256)))
 
-        self.mver.Version = 17
-
-        material_indices = {}
-
-        if autofill_textures:
-            obj.select = True
-            bpy.ops.scene.wow_fill_textures()
-            obj.select = False
-
-        for i in range(len(mesh.materials)):
-            material_indices[i] = self.root.add_material(mesh.materials[i])
-
         poly_batch_map = {}
 
         vg_batch_a = None
@@ -853,13 +1148,9 @@ class WMOGroupFile:
 
         if obj.WowVertexInfo.BatchTypeA != "":
             vg_batch_a = obj.vertex_groups.get(obj.WowVertexInfo.BatchTypeA)
-        else:
-            vg_batch_a = obj.vertex_groups.new("BatchMapA")
 
         if obj.WowVertexInfo.BatchTypeB != "":
             vg_batch_b = obj.vertex_groups.get(obj.WowVertexInfo.BatchTypeB)
-        else:
-            vg_batch_b = obj.vertex_groups.new("BatchMapB")
 
         if obj.WowVertexInfo.VertexGroup != "":
             vg_collision = obj.vertex_groups.get(obj.WowVertexInfo.VertexGroup)
@@ -870,18 +1161,53 @@ class WMOGroupFile:
         if obj.WowVertexInfo.Blendmap != "":
             vg_blendmap = obj.vertex_groups.get(obj.WowVertexInfo.Blendmap)
             self.mogp.Flags |= MOGP_FLAG.HasTwoMOCV
-            self.root.mohd.Flags |= 0x1
 
         if obj.WowVertexInfo.SecondUV != "":
-            uv_second_uv = obj.data.uv_textures.get(obj.WowVertexInfo.SecondUV)
+            uv_second_uv = mesh.uv_textures.get(obj.WowVertexInfo.SecondUV)
             self.mogp.Flags |= MOGP_FLAG.HasTwoMOTV
 
-        for poly in mesh.polygons:
-            poly_batch_map.setdefault((material_indices.get(poly.material_index),
-                                       self.get_batch_type(poly, mesh, vg_batch_a.index, vg_batch_b.index)), []).append(poly.index)
-
+        n_polygons = len(mesh.polygons)
+        n_loops = len(mesh.loops)
         vertex_size = len(mesh.vertices)
 
+        # pull geometry into flat buffers
+        coords = array.array('f', bytes(12 * vertex_size))
+        mesh.vertices.foreach_get("co", coords)
+
+        loop_vertices = array.array('i', bytes(4 * n_loops))
+        mesh.loops.foreach_get("vertex_index", loop_vertices)
+
+        loop_normals = array.array('f', bytes(12 * n_loops))
+        mesh.loops.foreach_get("normal", loop_normals)
+
+        loop_starts = array.array('i', bytes(4 * n_polygons))
+        mesh.polygons.foreach_get("loop_start", loop_starts)
+
+        loop_totals = array.array('i', bytes(4 * n_polygons))
+        mesh.polygons.foreach_get("loop_total", loop_totals)
+
+        polygon_materials = array.array('i', bytes(4 * n_polygons))
+        mesh.polygons.foreach_get("material_index", polygon_materials)
+
+        weights = self.get_vertex_group_weights(mesh, [vg for vg in (vg_batch_a, vg_batch_b, vg_collision,
+                                                                     vg_lightmap, vg_blendmap) if vg is not None])
+
+        # vertices outside of a batch vertex group or when there is no group
+        no_weights = array.array('f', [-1.0]) * vertex_size
+
+        batch_a_weights = weights[vg_batch_a.index] if vg_batch_a is not None else no_weights
+        batch_b_weights = weights[vg_batch_b.index] if vg_batch_b is not None else no_weights
+
+        for poly in range(n_polygons):
+            poly_vertices = loop_vertices[loop_starts[poly]:loop_starts[poly] + loop_totals[poly]]
+
+            if all(batch_a_weights[i] >= 0 for i in poly_vertices):
+                batch_type = 0
+            else:
+                batch_type = 1 if all(batch_b_weights[i] >= 0 for i in poly_vertices) else 2
+
+            poly_batch_map.setdefault((material_indices.get(polygon_materials[poly]), batch_type), []).append(poly)
+
         # count A and B batches amount
         n_batches_a = 0
         n_batches_b = 0
@@ -896,141 +1222,127 @@ class WMOGroupFile:
                 else:
                     n_batches_c += 1
 
-        # resize chunk containers
+        # order loops by batches, vertices are renumbered in order of first use
+        ordered_loops = []
+        batch_ranges = []
+
+        for batch_key, poly_batch in poly_batch_map.items():
+            first_index = len(ordered_loops)
+
+            for poly in poly_batch:
+                ordered_loops.extend(range(loop_starts[poly], loop_starts[poly] + loop_totals[poly]))
+
+            batch_ranges.append((batch_key, poly_batch, first_index, len(ordered_loops) - first_index))
+
+        ordered_vertices = [loop_vertices[i] for i in ordered_loops]
+        new_indices = gather_records(first_use_remap(ordered_vertices, vertex_size), 1, ordered_vertices)
+
+        # write geometry data
         self.moba.Batches = (n_batches_a + n_batches_b + n_batches_c) * [Batch()]
-        self.movt.Vertices = vertex_size * [(0, 0, 0)]
-        self.monr.Normals = vertex_size * [(0, 0, 0)]
-        self.motv.TexCoords = vertex_size * [(0, 0)]
-        self.motv2.TexCoords = vertex_size * [(0, 0)]
-        self.mocv.vertColors = vertex_size * [(0x7F, 0x7F, 0x7F, 0x00)]
-        self.mocv2.vertColors = vertex_size * [(0x7F, 0x7F, 0x7F, 0x00)]
+        self.movi.Indices = array.array('H', new_indices)
 
-        vertex_map = {}
-        normal_map = {}
+        vertices = scatter_records(gather_records(coords, 3, ordered_vertices), 3, new_indices, vertex_size, (0, 0, 0))
+        self.movt.Vertices = PackedArray.from_flat('f', 3, vertices)
 
-        new_index_last = 0
+        normals = average_records(gather_records(loop_normals, 3, ordered_loops), 3, new_indices, vertex_size)
+        self.monr.Normals = PackedArray.from_flat('f', 3, normals)
 
-        # write geometry data and batches
-        batch_counter_a = 0
-        batch_counter_b = 0
-        batch_counter_c = 0
+        if len(mesh.uv_layers) > 0:
+            tex_coords = self.get_loop_tex_coords(mesh.uv_layers.active, ordered_loops)
+            self.motv.TexCoords = PackedArray.from_flat('f', 2, scatter_records(tex_coords, 2, new_indices,
+                                                                               vertex_size, (0, 0)))
+        else:
+            self.motv.TexCoords = PackedArray('f', 2, vertex_size * [(0, 0)])
 
-        for batch_key, poly_batch in poly_batch_map.items():
+        if uv_second_uv:
+            tex_coords = self.get_loop_tex_coords(mesh.uv_layers[uv_second_uv.name], ordered_loops)
+            self.motv2.TexCoords = PackedArray.from_flat('f', 2, scatter_records(tex_coords, 2, new_indices,
+                                                                                vertex_size, (0, 0)))
+        else:
+            self.motv2.TexCoords = PackedArray('f', 2, vertex_size * [(0, 0)])
 
-            first_index = len(self.movi.Indices)
+        default_color = (0x7F, 0x7F, 0x7F, 0x00)
+        self.mocv.vertColors = PackedArray('B', 4, vertex_size * [default_color])
+        self.mocv2.vertColors = PackedArray('B', 4, vertex_size * [default_color])
 
-            sentry_indices = [0xFFFF, 0x00]
+        vertex_alphas = None
 
-            for poly in poly_batch:
-                collision_counter = 0
+        if '0' in obj.WowWMOGroup.Flags \
+        or (obj.WowWMOGroup.PlaceType == '8192' and '1' not in obj.WowWMOGroup.Flags):
+            if len(mesh.vertex_colors):
+                loop_colors = array.array('f', bytes(12 * n_loops))
+                mesh.vertex_colors.active.data.foreach_get("color", loop_colors)
 
-                for vertex_index in mesh.polygons[poly].vertices:
+                if vg_lightmap:
+                    vertex_alphas = [round(weight * 255) if weight > 0 else 0x00
+                                     for weight in weights[vg_lightmap.index]]
+                    loop_alphas = gather_records(vertex_alphas, 1, ordered_vertices)
+                else:
+                    loop_alphas = [0x00] * len(ordered_loops)
 
-                    new_index_current = vertex_map.get(vertex_index)
+                colors = pack_bgra_colors(gather_records(loop_colors, 3, ordered_loops), loop_alphas)
+                self.mocv.vertColors = PackedArray.from_flat('B', 4, scatter_records(colors, 4, new_indices,
+                                                                                    vertex_size, default_color))
+            else:
+                colors = [0x7F, 0x7F, 0x7F, 0xFF] * len(ordered_loops)
+                self.mocv.vertColors = PackedArray.from_flat('B', 4, scatter_records(colors, 4, new_indices,
+                                                                                    vertex_size, default_color))
 
-                    if new_index_current is None:
-                        vertex_map[vertex_index] = new_index_last
-                        new_index_current = new_index_last
-                        new_index_last += 1
-                        self.movt.Vertices[new_index_current] = tuple(mesh.vertices[vertex_index].co)
+        if vg_blendmap is not None:
+            blendmap_weights = weights[vg_blendmap.index]
+            blended_loops = [i for i, vertex in enumerate(ordered_vertices) if blendmap_weights[vertex] >= 0]
 
-                    sentry_indices[0] = min(sentry_indices[0], new_index_current)
-                    sentry_indices[1] = max(sentry_indices[1], new_index_current)
+            colors = []
+            for i in blended_loops:
+                weight = round(blendmap_weights[ordered_vertices[i]] * 255)
+                colors.extend((0, 0, 0, weight if weight > 0 else 0x00))
 
-                    self.movi.Indices.append(new_index_current)
+            self.mocv2.vertColors = PackedArray.from_flat('B', 4, scatter_records(colors, 4,
+                                                                                 [new_indices[i] for i in blended_loops],
+                                                                                 vertex_size, default_color))
 
-                    if vg_collision is not None:
-                        for group_info in mesh.vertices[vertex_index].groups:
-                            if group_info.group == vg_collision.index:
-                                collision_counter += 1
+        # write triangle materials and batches
+        collision_weights = weights[vg_collision.index] if vg_collision is not None else None
+
+        batch_counter_a = 0
+        batch_counter_b = 0
+        batch_counter_c = 0
+
+        for batch_key, poly_batch, first_index, n_indices in batch_ranges:
+
+            for poly in poly_batch:
+                poly_vertices = loop_vertices[loop_starts[poly]:loop_starts[poly] + loop_totals[poly]]
 
                 tri_mat = TriangleMaterial()
                 tri_mat.MaterialID = batch_key[0]
                 tri_mat.Flags = 0x8 if tri_mat.MaterialID == 0xFF else 0x20
-                tri_mat.Flags |= 0x40 if collision_counter == len(mesh.polygons[poly].vertices) else 0x4 | 0x8
-
-                for loop_index in mesh.polygons[poly].loop_indices:
-
-                    new_index = vertex_map.get(mesh.loops[loop_index].vertex_index)
-                    vertex = mesh.vertices[mesh.loops[loop_index].vertex_index]
-
-                    if len(mesh.uv_layers) > 0:
-                        self.motv.TexCoords[new_index] = (mesh.uv_layers.active.data[loop_index].uv[0],
-                                                            1.0 - mesh.uv_layers.active.data[loop_index].uv[1])
-
-                    if uv_second_uv:
-                        self.motv2.TexCoords[new_index] = (mesh.uv_layers[uv_second_uv.name].data[loop_index].uv[0],
-                                                            1.0 - mesh.uv_layers[uv_second_uv.name].data[loop_index].uv[1])
-
-                    if '0' in obj.WowWMOGroup.Flags \
-                    or (obj.WowWMOGroup.PlaceType == '8192' and '1' not in obj.WowWMOGroup.Flags):
-                        if len(mesh.vertex_colors):
-                            vertex_color = [0x7F, 0x7F, 0x7F, 0x00]
-
-                            for i in range(0, 3):
-                                vertex_color[i] = round(mesh.vertex_colors.active.data[loop_index].color[3 - i - 1] * 255)
-
-                            if vg_lightmap:
-                                for vertex_group_element in vertex.groups:
-                                    if vertex_group_element.group == vg_lightmap.index:
-                                        weight = round(vertex_group_element.weight * 255)
-                                        vertex_color[3] = weight if weight > 0 else 0x00
-                                        if weight > 0:
-                                            tri_mat.Flags |= 0x1
-
-                            self.mocv.vertColors[new_index] = vertex_color
-
-                        else:
-                            if batch_key == 2:
-                                self.mocv.vertColors[new_index] = [0x7F, 0x7F, 0x7F, 0x00]
-                            else:
-                                self.mocv.vertColors[new_index] = [0x7F, 0x7F, 0x7F, 0xFF]
-
-                    if vg_blendmap is not None:
-                        for vertex_group_element in vertex.groups:
-                                    if vertex_group_element.group == vg_blendmap.index:
-                                        try:
-                                            weight = round(vertex.groups[vg_blendmap.index].weight * 255)
-                                        except:
-                                            weight = 1
-                                        self.mocv2.vertColors[new_index] = (0,
-                                                                            0,
-                                                                            0,
-                                                                            weight if weight > 0 else 0x00)
-
-                    normal_map.setdefault(new_index, []).append(tuple(mesh.loops[loop_index].normal))
-
-                self.mopy.TriangleMaterials.append(tri_mat)
 
-            n_indices = len(self.movi.Indices) - first_index
-
-            bounding_box = [32767, 32767, 32767, -32768, -32768, -32768]
+                if collision_weights is not None and all(collision_weights[i] >= 0 for i in poly_vertices):
+                    tri_mat.Flags |= 0x40
+                else:
+                    tri_mat.Flags |= 0x4 | 0x8
 
-            for poly in poly_batch:
-                for vertex_index in mesh.polygons[poly].vertices:
-                    new_index = vertex_map.get(vertex_index)
-                    self.monr.Normals[new_index] = self.get_avg(normal_map.get(new_index))
+                if vertex_alphas is not None and any(vertex_alphas[i] > 0 for i in poly_vertices):
+                    tri_mat.Flags |= 0x1
 
-                    for i in range(0, 2):
-                        for j in range(0, 3):
-                            idx = i * 3 + j
-                            bounding_box[idx] = min(bounding_box[idx], floor(self.movt.Vertices[new_index][j])) \
-                                               if i == 0 else max(bounding_box[idx], ceil(self.movt.Vertices[new_index][j]))
+                self.mopy.TriangleMaterials.append(tri_mat)
 
             # skip batch writing if processed polyBatch is collision
             if batch_key[0] == 0xFF:
                 continue
 
+            batch_indices = new_indices[first_index:first_index + n_indices]
+
             # write current batch
             batch = Batch()
 
-            batch.BoundingBox = bounding_box
+            batch.BoundingBox = integer_bounding_box(vertices, batch_indices)
 
             batch.StartTriangle = first_index
             batch.nTriangle = n_indices
 
-            batch.StartVertex = sentry_indices[0]
-            batch.LastVertex = sentry_indices[1]
+            batch.StartVertex = int(min(0xFFFF, min(batch_indices)))
+            batch.LastVertex = int(max(0x00, max(batch_indices)))
 
             batch.MaterialID = batch_key[0]
 
@@ -1046,13 +1358,9 @@ class WMOGroupFile:
                 batch_counter_c += 1
 
         # write header
-        self.mogp.BoundingBoxCorner1 = [32767, 32767, 32767]
-        self.mogp.BoundingBoxCorner2 = [-32768, -32768, -32768]
-
-        for vtx in self.movt.Vertices:
-            for i in range(0, 3):
-                self.mogp.BoundingBoxCorner1[i] = min(self.mogp.BoundingBoxCorner1[i], floor(vtx[i]))
-                self.mogp.BoundingBoxCorner2[i] = max(self.mogp.BoundingBoxCorner2[i], ceil(vtx[i]))
+        bounding_box = integer_bounding_box(vertices)
+        self.mogp.BoundingBoxCorner1 = bounding_box[:3]
+        self.mogp.BoundingBoxCorner2 = bounding_box[3:]
 
         self.mogp.Flags |= MOGP_FLAG.HasCollision # /!\ MUST HAVE 0x1 FLAG ELSE THE GAME CRASH !
         if '0' in obj.WowWMOGroup.Flags:
@@ -1068,6 +1376,45 @@ class WMOGroupFile:
 
         self.mogp.Flags |= int(obj.WowWMOGroup.PlaceType)
 
+        self.mogp.nBatchesA = n_batches_a
+        self.mogp.nBatchesB = n_batches_b
+        self.mogp.nBatchesC = n_batches_c
+        self.mogp.nBatchesD = 0
+
+        bsp_tree = generate_bsp_tree(self.movt.Vertices, self.movi.Indices, obj.WowVertexInfo.NodeSize,
+                                     bsp_split_strategy, bsp_cache)
+
+        self.mobn.Nodes = bsp_tree.Nodes
+        self.mobr.Faces = bsp_tree.Faces
+
+        self.bsp_stats = {bsp_split_strategy: bsp_tree.get_stats()}
+
+        # build trees with other strategies only to compare their quality
+        if compare_bsp_strategies:
+            for strategy in BSPTree.split_strategies:
+                if strategy != bsp_split_strategy:
+                    test_tree = generate_bsp_tree(self.movt.Vertices, self.movi.Indices, obj.WowVertexInfo.NodeSize,
+                                                  strategy, bsp_cache)
+                    self.bsp_stats[strategy] = test_tree.get_stats()
+
+        for strategy, stats in self.bsp_stats.items():
+            print("\nBSP tree ({}): depth {}, {} nodes, face duplication {:.2f}".format(
+                strategy, stats['depth'], stats['nodes'], stats['duplication']))
+
+        if '0' not in obj.WowWMOGroup.Flags:
+            if obj.WowWMOGroup.PlaceType != '8192' \
+            or '1' in obj.WowWMOGroup.Flags and not len(mesh.vertex_colors):
+                self.mocv = None
+
+        # write second MOTV and MOCV
+        if uv_second_uv is None:
+            self.motv2 = None
+
+        if vg_blendmap is None:
+            self.mocv2 = None
+
+    def save_relations(self, obj):
+        """ Save references of a group to root file entries and other scene objects """
         hasLights = False
 
         fogs = (obj.WowWMOGroup.Fog1,
@@ -1079,6 +1426,9 @@ class WMOGroupFile:
 
         objects = bpy.context.scene.objects
 
+        if self.mogp.Flags & MOGP_FLAG.HasTwoMOCV:
+            self.root.mohd.Flags |= 0x1
+
         # set fog references
         self.mogp.FogIndices = (objects[fogs[0]].WowFog.FogID if fogs[0] else 0,
                                 objects[fogs[1]].WowFog.FogID if fogs[0] else 0,
@@ -1090,17 +1440,13 @@ class WMOGroupFile:
             for lamp in lamps:
                 self.molr.LightRefs.append(lamp.id)
 
-        self.mogp.nBatchesA = n_batches_a
-        self.mogp.nBatchesB = n_batches_b
-        self.mogp.nBatchesC = n_batches_c
-        self.mogp.nBatchesD = 0
         self.mogp.GroupID = int(obj.WowWMOGroup.GroupDBCid)
         self.mogp.Unknown1 = 0
         self.mogp.Unknown2 = 0
 
         group_info = self.root.add_group_info(self.mogp.Flags,
                                              [self.mogp.BoundingBoxCorner1, self.mogp.BoundingBoxCorner2],
-                                             original_obj.name,
+                                             obj.name,
                                              obj.WowWMOGroup.GroupDesc)
 
         self.mogp.GroupNameOfs = group_info[0]
@@ -1117,21 +1463,9 @@ class WMOGroupFile:
         else:
             self.modr = None
 
-        bsp_tree = BSPTree()
-        bsp_tree.GenerateBSP(self.movt.Vertices, self.movi.Indices, obj.WowVertexInfo.NodeSize)
-
-        self.mobn.Nodes = bsp_tree.Nodes
-        self.mobr.Faces = bsp_tree.Faces
-
-        if '0' not in obj.WowWMOGroup.Flags:
-            if obj.WowWMOGroup.PlaceType == '8192':
-                if '1' in obj.WowWMOGroup.Flags \
-                and not len(mesh.vertex_colors):
-                    self.mocv = None
-                else:
-                    self.mogp.Flags |= MOGP_FLAG.HasVertexColor
-            else:
-                self.mocv = None
+        # vertex colors of groups without the vertex color flag are kept for interior groups only
+        if '0' not in obj.WowWMOGroup.Flags and self.mocv is not None:
+            self.mogp.Flags |= MOGP_FLAG.HasVertexColor
 
         if not self.mogp.Flags & MOGP_FLAG.HasWater:
             self.mliq = None
@@ -1144,14 +1478,5 @@ class WMOGroupFile:
         else:
             self.mogp.Flags |= MOGP_FLAG.HasLight
 
-        # write second MOTV and MOCV
-        if uv_second_uv is None:
-            self.motv2 = None
-
-        if vg_blendmap is None:
-            self.mocv2 = None
-
-        print("\nDone saving group: <<{}>>".format(obj.name[:-4]))
-
 
 
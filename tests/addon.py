@@ -0,0 +1,31 @@
+import os
+import sys
+import types
+import importlib
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'io_scene_wmo')
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+def import_addon_module(name):
+    """ Import a module of the addon by its path inside the package, e.g. 'wmo.wmo_format'.
+    Package initializers register the addon in Blender and are not run, so modules
+    which do not use Blender can be tested outside of it """
+    package = 'io_scene_wmo'
+    path = ADDON_DIR
+
+    for part in [''] + name.split('.')[:-1]:
+        if part:
+            package += '.' + part
+            path = os.path.join(path, part)
+
+        if package not in sys.modules:
+            module = types.ModuleType(package)
+            module.__path__ = [path]
+            sys.modules[package] = module
+
+    return importlib.import_module('io_scene_wmo.' + name)
@@ -0,0 +1,184 @@
+import struct
+import zlib
+import unittest
+
+from .addon import import_addon_module
+
+blp = import_addon_module('mpq.blp')
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RED = (255, 0, 0, 255)
+GREEN = (0, 255, 0, 255)
+BLUE = (0, 0, 255, 255)
+
+
+def make_mips(data_pos, mips):
+    """ Make mipmap offset and size tables of mipmaps stored one after another from given position """
+    offsets = [0] * 16
+    sizes = [0] * 16
+
+    for i, mip in enumerate(mips):
+        offsets[i] = data_pos
+        sizes[i] = len(mip)
+        data_pos += len(mip)
+
+    return struct.pack("<16I", *offsets) + struct.pack("<16I", *sizes)
+
+
+def make_blp2(compression, alpha_depth, alpha_type, width, height, mips, palette=b'', content_type=1):
+    header = b'BLP2' + struct.pack("<IBBBBII", content_type, compression, alpha_depth, alpha_type,
+                                   len(mips) > 1, width, height)
+    return header + make_mips(len(header) + 128 + len(palette), mips) + palette + b''.join(mips)
+
+
+def make_blp1(compression, alpha_depth, width, height, mips, palette=b''):
+    header = b'BLP1' + struct.pack("<6I", compression, alpha_depth, width, height, 4, len(mips) > 1)
+    return header + make_mips(len(header) + 128 + len(palette), mips) + palette + b''.join(mips)
+
+
+def make_palette(*colors):
+    """ Make BGRA palette of given RGB colors """
+    palette = b''.join(bytes((b, g, r, 0)) for r, g, b in colors)
+    return palette + bytes(1024 - len(palette))
+
+
+def make_dxt_colors(c0, c1, indices):
+    return struct.pack("<HHI", c0, c1, sum(index << (i * 2) for i, index in enumerate(indices)))
+
+
+def rgba(*pixels):
+    return b''.join(bytes(pixel) for pixel in pixels)
+
+
+class BLPDecodeTest(unittest.TestCase):
+    """ Decoding of hand-built textures with the pure Python decoders """
+
+    numpy = None
+
+    def setUp(self):
+        self.module_numpy = blp.numpy
+        blp.numpy = self.numpy
+
+    def tearDown(self):
+        blp.numpy = self.module_numpy
+
+    def assertPixels(self, data, expected, mip=0):
+        width, height, pixels = blp.decode_blp(data, mip)
+        self.assertEqual((width, height, pixels), expected)
+
+    def test_palette_with_alpha_plane(self):
+        palette = make_palette((30, 20, 10), (3, 2, 1))
+
+        self.assertPixels(make_blp1(1, 8, 2, 2, [bytes((0, 1, 1, 0)) + bytes((0, 85, 170, 255))], palette),
+                          (2, 2, rgba((30, 20, 10, 0), (3, 2, 1, 85), (3, 2, 1, 170), (30, 20, 10, 255))))
+
+        # 1 and 4 bit alpha planes are packed from the lowest bits
+        self.assertPixels(make_blp2(1, 1, 0, 3, 1, [bytes((1, 0, 1)) + bytes((0b101,))], palette),
+                          (3, 1, rgba((3, 2, 1, 255), (30, 20, 10, 0), (3, 2, 1, 255))))
+
+        self.assertPixels(make_blp2(1, 4, 0, 3, 1, [bytes((0, 0, 0)) + bytes((0x21, 0x0F))], palette),
+                          (3, 1, rgba((30, 20, 10, 17), (30, 20, 10, 34), (30, 20, 10, 255))))
+
+        self.assertPixels(make_blp2(1, 0, 0, 1, 1, [bytes((1,))], palette), (1, 1, rgba((3, 2, 1, 255))))
+
+    def test_dxt1_punch_through_alpha(self):
+        # black endpoint first selects the three color mode where the fourth color is transparent
+        block = make_dxt_colors(0x0000, 0xFFFF, [i & 3 for i in range(16)])
+        row = [(0, 0, 0, 255), (255, 255, 255, 255), (127, 127, 127, 255), (0, 0, 0, 0)]
+
+        self.assertPixels(make_blp2(2, 1, 0, 4, 4, [block]), (4, 4, rgba(*row * 4)))
+
+        row[3] = (0, 0, 0, 255)
+        self.assertPixels(make_blp2(2, 0, 0, 4, 4, [block]), (4, 4, rgba(*row * 4)))
+
+    def test_dxt3_explicit_alpha(self):
+        alpha = sum(i << (i * 4) for i in range(16)).to_bytes(8, 'little')
+
+        # DXT3 always uses four colors, even if the first endpoint is smaller
+        block = alpha + make_dxt_colors(0x001F, 0xF800, [3] * 16)
+
+        self.assertPixels(make_blp2(2, 8, 1, 4, 4, [block]),
+                          (4, 4, rgba(*[(170, 0, 85, i * 17) for i in range(16)])))
+
+    def test_dxt5_interpolated_alpha(self):
+        indices = sum((i & 7) << (i * 3) for i in range(16)).to_bytes(6, 'little')
+        white = make_dxt_colors(0xFFFF, 0xFFFF, [0] * 16)
+
+        six_levels = [0, 255, 51, 102, 153, 204, 0, 255]
+        eight_levels = [255, 0, 218, 182, 145, 109, 72, 36]
+
+        blocks = bytes((0, 255)) + indices + white + bytes((255, 0)) + indices + white
+        expected = []
+
+        for y in range(4):
+            for levels in (six_levels, eight_levels):
+                expected += [(255, 255, 255, levels[(y * 4 + x) & 7]) for x in range(4)]
+
+        self.assertPixels(make_blp2(2, 8, 7, 8, 4, [blocks]), (8, 4, rgba(*expected)))
+
+    def test_argb(self):
+        self.assertPixels(make_blp2(3, 8, 8, 2, 1, [bytes((1, 2, 3, 4, 5, 6, 7, 8))]),
+                          (2, 1, rgba((3, 2, 1, 4), (7, 6, 5, 8))))
+
+    def test_odd_size_mips(self):
+        red = make_dxt_colors(0xF800, 0x07E0, [0] * 16)
+        green = make_dxt_colors(0xF800, 0x07E0, [1] * 16)
+        blue = make_dxt_colors(0x001F, 0x0000, [0] * 16)
+
+        data = make_blp2(2, 0, 0, 5, 3, [red + green, blue, blue])
+
+        self.assertPixels(data, (5, 3, rgba(*([RED] * 4 + [GREEN]) * 3)))
+        self.assertPixels(data, (2, 1, rgba(BLUE, BLUE)), mip=1)
+        self.assertPixels(data, (1, 1, rgba(BLUE)), mip=2)
+
+        argb = make_blp2(3, 8, 8, 1, 3, [bytes(range(12)), bytes(range(4))])
+        self.assertPixels(argb, (1, 1, rgba((2, 1, 0, 3))), mip=1)
+
+    def test_jpeg_is_unsupported(self):
+        with self.assertRaises(blp.UnsupportedBLPError):
+            blp.decode_blp(make_blp2(0, 0, 0, 1, 1, [bytes(4)], content_type=0))
+
+        with self.assertRaises(blp.UnsupportedBLPError):
+            blp.decode_blp(make_blp1(0, 0, 1, 1, [bytes(4)]))
+
+        with self.assertRaises(ValueError):
+            blp.decode_blp(b'BLP0' + bytes(200))
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class NumpyBLPDecodeTest(BLPDecodeTest):
+    """ Decoding of hand-built textures with the numpy decoders """
+
+    numpy = numpy
+
+
+class EncodePNGTest(unittest.TestCase):
+    def test_chunks_and_rows(self):
+        pixels = rgba((1, 2, 3, 4), (5, 6, 7, 8), (9, 10, 11, 12), (13, 14, 15, 16), (17, 18, 19, 20),
+                      (21, 22, 23, 24))
+        png = blp.encode_png(3, 2, pixels)
+
+        self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n')
+
+        chunks = []
+        pos = 8
+
+        while pos < len(png):
+            size, tag = struct.unpack_from(">I4s", png, pos)
+            content = png[pos + 8:pos + 8 + size]
+            crc, = struct.unpack_from(">I", png, pos + 8 + size)
+            self.assertEqual(crc, zlib.crc32(tag + content))
+
+            chunks.append((tag, content))
+            pos += 12 + size
+
+        self.assertEqual([tag for tag, content in chunks], [b'IHDR', b'IDAT', b'IEND'])
+
+        # 8 bit RGBA, no interlacing, every row uses no filter
+        self.assertEqual(struct.unpack(">IIBBBBB", chunks[0][1]), (3, 2, 8, 6, 0, 0, 0))
+        self.assertEqual(zlib.decompress(chunks[1][1]), b'\x00' + pixels[:12] + b'\x00' + pixels[12:])
+        self.assertEqual(chunks[2][1], b'')
@@ -0,0 +1,151 @@
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+
+from .addon import import_addon_module, bpy
+
+chunk_directory = import_addon_module('wmo.chunk_directory')
+ChunkDirectory = chunk_directory.ChunkDirectory
+LazyChunkFile = chunk_directory.LazyChunkFile
+
+
+def make_chunk(magic, payload):
+    return magic + struct.pack('I', len(payload)) + payload
+
+
+class Blob:
+    """ Chunk keeping its raw payload """
+
+    def __init__(self):
+        self.data = None
+
+    def read(self, f):
+        size = struct.unpack('4sI', f.read(8))[1]
+        self.data = f.read(size)
+
+
+class Group(LazyChunkFile):
+    chunk_attributes = (('geometry', 'TVOM', 0),)
+
+    def __init__(self):
+        self.geometry = Blob()
+
+
+class Root(LazyChunkFile):
+    chunk_attributes = (('header', 'DHOM', 0), ('info', 'IGOM', 0))
+
+    def __init__(self):
+        self.header = Blob()
+        self.info = Blob()
+        self.groups = []
+
+    def close(self):
+        for group in self.groups:
+            group.close()
+
+        LazyChunkFile.close(self)
+
+
+class ChunkDirectoryTest(unittest.TestCase):
+    def test_scan_skips_nested_group_chunks(self):
+        data = make_chunk(b'REVM', struct.pack('I', 17)) \
+               + b'PGOM' + struct.pack('I', 68 + 12) + bytes(68) + make_chunk(b'TVOM', bytes(4)) \
+               + make_chunk(b'XXXX', b'')
+
+        directory = ChunkDirectory(data)
+
+        self.assertEqual([entry.offset for entry in directory.chunks['TVOM']], [12 + 8 + 68])
+        self.assertIn('XXXX', directory)
+        self.assertIsNone(directory.find('TVOM', 1))
+        self.assertEqual(bytes(directory.view('REVM')), struct.pack('I', 17))
+
+    def test_truncated_chunk_is_not_indexed(self):
+        directory = ChunkDirectory(make_chunk(b'REVM', bytes(4)) + b'TVOM' + struct.pack('I', 100) + bytes(10))
+
+        self.assertIn('REVM', directory)
+        self.assertNotIn('TVOM', directory)
+
+
+class LazyChunkFileTest(unittest.TestCase):
+    def test_root_chunks_do_not_decode_groups(self):
+        root = Root()
+        root.read_chunks(ChunkDirectory(make_chunk(b'DHOM', b'head') + make_chunk(b'IGOM', b'info')), lazy=True)
+
+        group = Group()
+        group.read_chunks(ChunkDirectory(make_chunk(b'TVOM', b'vertices')), lazy=True)
+        root.groups.append(group)
+
+        self.assertEqual(root.header.data, b'head')
+        self.assertEqual(root.info.data, b'info')
+
+        # root released its own file only, group geometry is still pending
+        self.assertNotIn('chunk_directory', root.__dict__)
+        self.assertIn('geometry', group.pending_chunks)
+        self.assertIn('chunk_directory', group.__dict__)
+
+        root.close()
+
+        self.assertEqual(group.geometry.data, b'vertices')
+        self.assertNotIn('chunk_directory', group.__dict__)
+
+    def test_replaced_chunk_is_not_decoded(self):
+        group = Group()
+        group.read_chunks(ChunkDirectory(make_chunk(b'TVOM', b'vertices')), lazy=True)
+
+        replacement = Blob()
+        group.geometry = replacement
+        group.close()
+
+        self.assertIs(group.geometry, replacement)
+        self.assertIsNone(replacement.data)
+
+
+@unittest.skipIf(bpy is None, "reading WMO files requires Blender")
+class LazyWMOFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_header_chunks_are_read_without_group_geometry(self):
+        wmo_format = import_addon_module('wmo.wmo_format')
+        wmo_file = import_addon_module('wmo.wmo_file')
+
+        mohd = wmo_format.MOHD_chunk()
+        mohd.nGroups = 1
+
+        mogi = wmo_format.MOGI_chunk()
+        mogi.Infos.append(wmo_format.GroupInfo())
+        mogi.Infos[0].Flags = 0x8
+
+        root_path = os.path.join(self.dir, "test.wmo")
+        with open(root_path, 'wb') as f:
+            for chunk in (wmo_format.MVER_chunk(version=17), mohd, mogi):
+                chunk.write(f)
+
+        movt = wmo_format.MOVT_chunk()
+        movt.Vertices.append((1.0, 2.0, 3.0))
+
+        with open(os.path.join(self.dir, "test_000.wmo"), 'wb') as f:
+            mogp = wmo_format.MOGP_chunk()
+            mogp.Header.Size = mogp.size() + 8 + movt.size()
+
+            wmo_format.MVER_chunk(version=17).write(f)
+            buffer = bytearray(8 + mogp.Header.Size)
+            movt.pack_into(buffer, mogp.pack_into(buffer, 0))
+            f.write(buffer)
+
+        wmo = wmo_file.WMOFile(root_path)
+        wmo.read(lazy=True)
+
+        self.assertEqual(wmo.mver.Version, 17)
+        self.assertEqual(wmo.mohd.nGroups, 1)
+        self.assertEqual(wmo.mogi.Infos[0].Flags, 0x8)
+        self.assertIn('movt', wmo.groups[0].pending_chunks)
+
+        wmo.close()
+
+        self.assertEqual(list(wmo.groups[0].movt.Vertices), [(1.0, 2.0, 3.0)])
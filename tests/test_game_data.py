@@ -0,0 +1,124 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from collections import namedtuple
+
+from .addon import import_addon_module, bpy
+
+HashEntry = namedtuple('HashEntry', 'block_table_index')
+
+
+class FakeArchive:
+    """ Archive providing files with given block table entries, files are given as {key: (offset, flags)} """
+
+    def __init__(self, path, files, block_entry_type):
+        with open(path, 'wb') as f:
+            f.write(os.path.basename(path).encode('ascii'))
+
+        self.file = open(path, 'rb')
+        self.keys = list(files)
+        self.block_table = [block_entry_type(offset, 1, 1, flags) for offset, flags in files.values()]
+
+    def build_hash_index(self):
+        return {key: HashEntry(i) for i, key in enumerate(self.keys)}
+
+    def close(self):
+        self.file.close()
+
+
+@unittest.skipIf(bpy is None, "game data module requires Blender")
+class FileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.wow = import_addon_module('mpq.wow')
+        self.mpyq = import_addon_module('mpq.mpyq')
+        self.dir = tempfile.mkdtemp()
+        self.archives = []
+
+    def tearDown(self):
+        for archive in self.archives:
+            archive.close()
+
+        shutil.rmtree(self.dir)
+
+    def make_archive(self, name, files):
+        files = {self.wow.WoWFileData.get_file_key(filename): entry for filename, entry in files.items()}
+        archive = FakeArchive(os.path.join(self.dir, name), files, self.mpyq.MPQBlockTableEntry)
+        self.archives.append(archive)
+        return archive
+
+    def make_folder(self, name, files):
+        path = os.path.join(self.dir, name)
+
+        for filename in files:
+            os.makedirs(os.path.dirname(os.path.join(path, filename)), exist_ok=True)
+            with open(os.path.join(path, filename), 'wb') as f:
+                f.write(b'folder')
+
+        return path
+
+    def make_game_data(self):
+        game_data = object.__new__(self.wow.WoWFileData)
+        game_data.executor = game_data.background_executor = None
+        game_data.get_index_cache_path = lambda: os.path.join(self.dir, "index.bin")
+        return game_data
+
+    def build_file_index(self, resources):
+        return self.make_game_data().build_file_index(resources)
+
+    def test_patches_override_base_archives(self):
+        exists = self.mpyq.MPQ_FILE_EXISTS
+        base = self.make_archive("common.MPQ", {"World\\a.blp": (10, exists), "World\\b.blp": (20, exists)})
+        patch = self.make_archive("patch-2.MPQ", {"world\\A.blp": (30, exists), "World\\b.blp": (40, 0)})
+        folder = self.make_folder("patch-3.MPQ", ["World/b.blp"])
+
+        file_index = self.build_file_index([(base, True), (patch, True), (folder, False)])
+
+        location = file_index[self.wow.WoWFileData.get_file_key("World\\a.blp")]
+        self.assertIs(location[0], patch)
+        self.assertEqual(location[1].offset, 30)
+
+        # deleted entry of the patch archive does not hide the file, the folder patch overrides both
+        self.assertEqual(file_index[self.wow.WoWFileData.get_file_key("World\\b.blp")],
+                         os.path.join(folder, "World", "b.blp"))
+
+        # archive entries come from the index cache on the next run
+        self.assertEqual(self.build_file_index([(base, True), (patch, True), (folder, False)]), file_index)
+
+    def test_game_data_paths_are_ordered_by_priority(self):
+        for name in ("patch-3.MPQ", "expansion.MPQ", "patch.MPQ", "common-2.MPQ", "patch-2.MPQ",
+                     "lichking.MPQ", "common.MPQ", "readme.txt"):
+            with open(os.path.join(self.dir, name), 'wb') as f:
+                f.write(b'')
+
+        os.makedirs(os.path.join(self.dir, "patch-5.MPQ"))
+
+        paths = self.wow.WoWFileData.list_game_data_paths(self.dir)
+
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         ["common.MPQ", "common-2.MPQ", "expansion.MPQ", "lichking.MPQ",
+                          "patch.MPQ", "patch-2.MPQ", "patch-3.MPQ", "patch-5.MPQ"])
+
+    def test_textures_are_converted_once_per_file(self):
+        # 1x1 uncompressed texture
+        texture = b'BLP2' + struct.pack("<IBBBBII", 1, 3, 8, 8, 0, 1, 1) \
+                  + struct.pack("<16I", 148, *[0] * 15) + struct.pack("<16I", 4, *[0] * 15) + bytes((1, 2, 3, 4))
+        requested = []
+
+        def read_file(filename, force_decompress=False, parallel=True):
+            requested.append(filename)
+            return texture
+
+        game_data = self.make_game_data()
+        game_data.read_file = read_file
+        game_data.texture_cache = game_data.converter = None
+
+        try:
+            game_data.extract_textures_as_png(self.dir, ["World\\A.blp", "world/a.BLP", "World\\b.blp"])
+        finally:
+            game_data.executor.shutdown()
+
+        self.assertEqual(sorted(requested), ["World\\A.blp", "World\\b.blp"])
+        self.assertTrue(os.path.isfile(os.path.join(self.dir, "World\\A.png")))
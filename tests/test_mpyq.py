@@ -0,0 +1,118 @@
+import struct
+import threading
+import unittest
+
+from .addon import import_addon_module
+
+mpyq = import_addon_module('mpq.mpyq')
+MPQArchive = mpyq.MPQArchive
+MPQHashTableEntry = mpyq.MPQHashTableEntry
+
+HASH_TABLE_KEY = 0xC3AF3770
+
+EMPTY_ENTRY = MPQHashTableEntry(0xFFFFFFFF, 0xFFFFFFFF, 0xFFFF, 0xFFFF, mpyq.MPQ_HASH_ENTRY_EMPTY)
+
+# hash table of a (listfile) entry and an empty entry, encrypted with the hash table key
+ENCRYPTED_HASH_TABLE = bytes.fromhex("dcb6597b4f07a92b1cc0405947266825dc13789e29eba03368b6921db1be0fa6")
+
+
+def make_archive(hash_table):
+    """ Make an archive with given hash table entries and no file behind it """
+    archive = object.__new__(MPQArchive)
+    archive.lock = threading.RLock()
+    archive.hash_table = hash_table
+    archive.block_table = []
+    archive.hash_index = None
+    return archive
+
+
+def make_entry(filename, block_table_index):
+    return MPQHashTableEntry(mpyq.hash_string(filename, 'HASH_A'), mpyq.hash_string(filename, 'HASH_B'),
+                             0, 0, block_table_index)
+
+
+def get_start(filename, table_size):
+    return mpyq.hash_string(filename, 'TABLE_OFFSET') & (table_size - 1)
+
+
+class MPQCryptographyTest(unittest.TestCase):
+    def test_encryption_table(self):
+        table = MPQArchive.encryption_table
+
+        self.assertEqual(len(table), 0x500)
+        self.assertEqual(table[0], 0x55C636E2)
+        self.assertEqual(table[0x123], 0xE3C28B08)
+        self.assertEqual(table[0x4FF], 0x7303286C)
+
+    def test_hash_string(self):
+        self.assertEqual(mpyq.hash_string('(hash table)', 'TABLE'), HASH_TABLE_KEY)
+        self.assertEqual(mpyq.hash_string('(block table)', 'TABLE'), 0xEC83B3A3)
+
+        self.assertEqual(mpyq.hash_string('(listfile)', 'TABLE_OFFSET'), 0x5F3DE859)
+        self.assertEqual(mpyq.hash_string('(listfile)', 'HASH_A'), 0xFD657910)
+        self.assertEqual(mpyq.hash_string('(listfile)', 'HASH_B'), 0x4E9B98A7)
+
+        # paths are hashed case insensitively, from both strings and bytes
+        self.assertEqual(mpyq.hash_string('world\\wmo\\test.wmo', 'HASH_A'), 0x7E06DD59)
+        self.assertEqual(mpyq.hash_string('WORLD\\WMO\\TEST.WMO', 'HASH_B'), 0x34B5D33A)
+        self.assertEqual(mpyq.hash_string(b'World\\wmo\\Test.wmo', 'TABLE_OFFSET'), 0x4D15C61C)
+
+    def test_decrypt(self):
+        archive = make_archive([])
+        data = archive._decrypt(ENCRYPTED_HASH_TABLE, HASH_TABLE_KEY)
+
+        self.assertEqual(data, struct.pack('<2I2HI', 0xFD657910, 0x4E9B98A7, 0, 0, 0) + b'\xff' * 16)
+
+        # trailing bytes which do not form a whole word are dropped
+        self.assertEqual(archive._decrypt(ENCRYPTED_HASH_TABLE + b'\x01\x02', HASH_TABLE_KEY), data)
+        self.assertEqual(archive._decrypt(b'', HASH_TABLE_KEY), b'')
+
+
+class HashTableLookupTest(unittest.TestCase):
+    table_size = 8
+
+    def make_table(self, start, entries):
+        """ Make a hash table with entries placed one after another from the start slot, others are empty """
+        table = [EMPTY_ENTRY] * self.table_size
+
+        for i, entry in enumerate(entries):
+            table[(start + i) % self.table_size] = entry
+
+        return table
+
+    def find_filename(self, start):
+        """ Find a filename placed at the given slot of the table """
+        return next(filename for filename in ("file{}.blp".format(i) for i in range(1000))
+                    if get_start(filename, self.table_size) == start)
+
+    def test_collisions_and_deleted_entries_are_skipped(self):
+        filename = self.find_filename(self.table_size - 1)
+        deleted = make_entry(filename, mpyq.MPQ_HASH_ENTRY_DELETED)
+        other = make_entry("other.blp", 1)
+        live = make_entry(filename, 2)
+
+        # probing wraps around the end of the table
+        archive = make_archive(self.make_table(self.table_size - 1, [deleted, other, live]))
+
+        self.assertIs(archive.get_hash_table_entry(filename), live)
+        self.assertIs(archive.get_hash_table_entry(filename.upper()), live)
+        self.assertIsNone(archive.get_hash_table_entry("missing.blp"))
+
+        # hash index gives the same entries as probing
+        archive.hash_index = archive.build_hash_index()
+
+        self.assertIs(archive.get_hash_table_entry(filename), live)
+        self.assertIs(archive.get_hash_table_entry("other.blp"), other)
+        self.assertIsNone(archive.get_hash_table_entry("missing.blp"))
+
+    def test_probing_stops_at_empty_entry(self):
+        filename = self.find_filename(2)
+        archive = make_archive(self.make_table(2, [EMPTY_ENTRY, make_entry(filename, 0)]))
+
+        self.assertIsNone(archive.get_hash_table_entry(filename))
+
+    def test_full_table_without_entry(self):
+        archive = make_archive([make_entry("other{}.blp".format(i), i) for i in range(self.table_size)])
+
+        self.assertIsNone(archive.get_hash_table_entry("missing.blp"))
+        self.assertIsNone(make_archive([]).get_hash_table_entry("missing.blp"))
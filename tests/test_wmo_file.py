@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .addon import import_addon_module, bpy
+
+
+@unittest.skipIf(bpy is None, "writing WMO files requires Blender")
+class WriteFilesAtomicTest(unittest.TestCase):
+    def setUp(self):
+        self.wmo_file = import_addon_module('wmo.wmo_file')
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_failed_write_keeps_previous_files(self):
+        root = self.make_file("test.wmo", b'old')
+
+        class Failure(Exception):
+            pass
+
+        def files():
+            yield root, b'new'
+            raise Failure()
+
+        with self.assertRaises(Failure):
+            self.wmo_file.write_files_atomic(files())
+
+        self.assertEqual(self.read_file(root), b'old')
+        self.assertEqual(os.listdir(self.dir), ["test.wmo"])
+
+    def test_failed_rename_reports_replaced_files(self):
+        root = self.make_file("test.wmo", b'old')
+        group = os.path.join(self.dir, "test_000.wmo")
+        last_group = self.make_file("test_001.wmo", b'old')
+
+        # a non-empty directory cannot be replaced by a file
+        os.makedirs(os.path.join(group, "dir"))
+
+        with self.assertRaises(Exception) as context:
+            self.wmo_file.write_files_atomic([(root, b'new'), (group, b'new'), (last_group, b'new')])
+
+        self.assertIn("Files already replaced: test.wmo", str(context.exception))
+        self.assertEqual(self.read_file(root), b'new')
+        self.assertEqual(self.read_file(last_group), b'old')
+        self.assertEqual(sorted(os.listdir(self.dir)), ["test.wmo", "test_000.wmo", "test_001.wmo"])
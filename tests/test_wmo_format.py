@@ -0,0 +1,239 @@
+import io
+import unittest
+
+from .addon import import_addon_module
+
+wmo_format = import_addon_module('wmo.wmo_format')
+
+
+def fill(record, start):
+    """ Set every numeric field of a record to distinct values counting from start, floats get a fraction """
+    value = start
+
+    for name, default in sorted(vars(record).items()):
+        if name == 'Header' or isinstance(default, (bool, str)):
+            continue
+
+        if isinstance(default, (tuple, list)):
+            values = []
+            for item in default:
+                values.append(value + 0.5 if isinstance(item, float) else value)
+                value += 1
+            setattr(record, name, tuple(values))
+        else:
+            setattr(record, name, value + 0.5 if isinstance(default, float) else value)
+            value += 1
+
+    return record
+
+
+def fill_list(record_type, count):
+    return [fill(record_type(), i * 32 + 1) for i in range(count)]
+
+
+def build_chunks(F):
+    """ Build every chunk of root and group files with all fields set """
+    chunks = [F.MVER_chunk(F.ChunkHeader(), 17), fill(F.MOHD_chunk(), 1)]
+
+    motx = F.MOTX_chunk()
+    motx.add_string("a\\b.blp")
+    motx.add_string("cc.blp")
+    chunks.append(motx)
+
+    for chunk_type, attribute, record_type in ((F.MOMT_chunk, 'Materials', F.WMO_Material),
+                                               (F.MOGI_chunk, 'Infos', F.GroupInfo),
+                                               (F.MOPT_chunk, 'Infos', F.PortalInfo),
+                                               (F.MOPR_chunk, 'Relationships', F.PortalRelationship),
+                                               (F.MOVB_chunk, 'Batches', F.VisibleBatch),
+                                               (F.MOLT_chunk, 'Lights', F.Light),
+                                               (F.MODD_chunk, 'Definitions', F.DoodadDefinition),
+                                               (F.MFOG_chunk, 'Fogs', F.Fog),
+                                               (F.MOPY_chunk, 'TriangleMaterials', F.TriangleMaterial),
+                                               (F.MOBA_chunk, 'Batches', F.Batch),
+                                               (F.MOBN_chunk, 'Nodes', F.BSP_Node)):
+        chunk = chunk_type()
+        setattr(chunk, attribute, fill_list(record_type, 2))
+        chunks.append(chunk)
+
+    mogn = F.MOGN_chunk()
+    mogn.add_string("group")
+    chunks.append(mogn)
+
+    skybox = F.MOSB_chunk()
+    skybox.Skybox = "sky.m2"
+    chunks += [F.MOSB_chunk(), skybox]
+
+    mods = F.MODS_chunk()
+    mods.Sets = fill_list(F.DoodadSet, 2)
+    mods.Sets[0].Name = "Set_$DefaultGlobal"
+    mods.Sets[1].Name = "Set"
+    chunks.append(mods)
+
+    modn = F.MODN_chunk()
+    modn.AddString("a.m2")
+    modn.AddString("bbbbb.m2")
+    chunks.append(modn)
+
+    for chunk_type, attribute, records in ((F.MOPV_chunk, 'PortalVertices', [(1.5, 2.5, 3.5), (-4.0, 5.0, 6.25)]),
+                                           (F.MOVV_chunk, 'VisibleVertices', [(7.5, 8.0, -9.0)]),
+                                           (F.MCVP_chunk, 'convex_volume_planes', [(0.0, 1.0, 0.0, -2.5)]),
+                                           (F.MOVI_chunk, 'Indices', [0, 1, 2, 2, 1, 65535]),
+                                           (F.MOVT_chunk, 'Vertices', [(1.0, -2.0, 3.5), (4.25, 5.0, -6.0)]),
+                                           (F.MONR_chunk, 'Normals', [(0.0, 0.0, 1.0), (0.5, -0.5, 0.0)]),
+                                           (F.MOTV_chunk, 'TexCoords', [(0.25, 0.75), (1.0, -1.5)]),
+                                           (F.MOLR_chunk, 'LightRefs', [0, 3, -1]),
+                                           (F.MODR_chunk, 'DoodadRefs', [5, 2]),
+                                           (F.MOBR_chunk, 'Faces', [0, 1, 40000]),
+                                           (F.MOCV_chunk, 'vertColors', [(1, 2, 3, 4), (255, 128, 0, 7)])):
+        chunk = chunk_type()
+        setattr(chunk, attribute, records)
+        chunks.append(chunk)
+
+    # group header size also covers nested chunks and is set by its owner
+    mogp = fill(F.MOGP_chunk(), 1)
+    mogp.Header.Size = 68
+    chunks.append(mogp)
+
+    for liquid_material, vertex_type in ((True, F.WaterVertex), (False, F.MagmaVertex)):
+        mliq = F.MLIQ_chunk(liquid_material)
+        mliq.xVerts, mliq.yVerts, mliq.xTiles, mliq.yTiles = 3, 2, 2, 1
+        mliq.Position = (1.5, -2.5, 3.0)
+        mliq.materialID = 7
+        mliq.VertexMap = fill_list(vertex_type, 6)
+        mliq.TileFlags = [0x40, 0x0F]
+
+        for i, vertex in enumerate(mliq.VertexMap):
+            vertex.height = i - 2.5
+
+        chunks.append(mliq)
+
+    return chunks
+
+
+def write_chunk(chunk):
+    f = io.BytesIO()
+    chunk.write(f)
+    return f.getvalue()
+
+
+# bytes written by the original chunk writers, before chunks were packed into preallocated buffers
+EXPECTED_CHUNKS = (
+    # MVER
+    "5245564d0400000011000000",
+    # MOHD
+    "44484f4d40000000100000000e000000120000000f000000110000000d00000013000000010203040c0000000000b040"
+    "0000d0400000f0400000084100001841000028410b000000",
+    # MOTX
+    "58544f4d0f000000615c622e626c700063632e626c7000",
+    # MOMT
+    "544d4f4d800000000e00000013000000010000001a0000000a0b0c0d141516171b00000006070809180000001c000000"
+    "02030405190000000f0000001000000011000000120000002e00000033000000210000003a0000002a2b2c2d34353637"
+    "3b00000026272829380000003c00000022232425390000002f000000300000003100000032000000",
+    # MOGI
+    "49474f4d40000000070000000000803f0000004000004040000080400000a0400000c040080000002700000000000442"
+    "0000084200000c4200001042000014420000184228000000",
+    # MOPT
+    "54504f4d28000000040006000000803f00000040000040400000a04024002600000004420000084200000c4200001442",
+    # MOPR
+    "52504f4d1000000003000100040002002300210024002200",
+    # MOVB
+    "42564f4d080000000100020021002200",
+    # MOLT
+    "544c4f4d60000000080d1209030405060000204100003041000040410000e040000000400000803f0000604100007041"
+    "0000804100008841282d3229232425260000284200002c420000304200001c4200000842000004420000384200003c42"
+    "0000404200004442",
+    # MODD
+    "44444f4d50000000060000050000e0400000004100001041000020410000304100004041000050410000604101020304"
+    "2600002500001c4200002042000024420000284200002c4200003042000034420000384221222324",
+    # MFOG
+    "474f464d600000000c000000000050410000604100007041000080410000803f00002041000088410203040500003041"
+    "00009041060708092c000000000034420000384200003c42000040420000044200002842000044422223242500002c42"
+    "0000484226272829",
+    # MOPY
+    "59504f4d0400000001022122",
+    # MOBA
+    "41424f4d30000000010002000300040005000600090000000c000a0007000b0821002200230024002500260029000000"
+    "2c002a0027002b28",
+    # MOBN
+    "4e424f4d200000000600010002000500040000000000404026002100220025002400000000000c42",
+    # MOGN
+    "4e474f4d08000000000067726f757000",
+    # MOSB
+    "42534f4d0400000000000000",
+    # MOSB
+    "42534f4d07000000736b792e6d3200",
+    # MODS
+    "53444f4d400000005365745f2444656661756c74476c6f62616c00000200000003000000010000005365740000000000"
+    "000000000000000000000000220000002300000021000000",
+    # MODN
+    "4e444f4d11000000612e6d320000000062626262622e6d3200",
+    # MOPV
+    "56504f4d180000000000c03f0000204000006040000080c00000a0400000c840",
+    # MOVV
+    "56564f4d0c0000000000f04000000041000010c1",
+    # MCVP, the original writer failed on any plane, bytes follow the chunk layout
+    "5056434d10000000000000000000803f00000000000020c0",
+    # MOVI
+    "49564f4d0c00000000000100020002000100ffff",
+    # MOVT
+    "54564f4d180000000000803f000000c000006040000088400000a0400000c0c0",
+    # MONR
+    "524e4f4d1800000000000000000000000000803f0000003f000000bf00000000",
+    # MOTV
+    "56544f4d100000000000803e0000403f0000803f0000c0bf",
+    # MOLR
+    "524c4f4d0600000000000300ffff",
+    # MODR
+    "52444f4d0400000005000200",
+    # MOBR
+    "52424f4d0600000000000100409c",
+    # MOCV
+    "56434f4d0800000001020304ff800007",
+    # MOGP
+    "50474f4d440000000e00000007000000080000000000803f0000004000004040000080400000a0400000c04011001000"
+    "1400150016001700090a0b0c0f0000000d0000001200000013000000",
+    # MLIQ
+    "51494c4d50000000030000000200000002000000010000000000c03f000020c000004040070002040301000020c02224"
+    "23210000c0bf42444341000000bf626463610000003f828483810000c03fa2a4a3a100002040400f",
+    # MLIQ
+    "51494c4d50000000030000000200000002000000010000000000c03f000020c000004040070001000200000020c02100"
+    "22000000c0bf41004200000000bf610062000000003f810082000000c03fa100a20000002040400f",
+)
+
+
+class ChunkRoundTripTest(unittest.TestCase):
+    def test_chunks_are_written_as_before(self):
+        chunks = build_chunks(wmo_format)
+        self.assertEqual(len(chunks), len(EXPECTED_CHUNKS))
+
+        for chunk, expected in zip(chunks, EXPECTED_CHUNKS):
+            with self.subTest(chunk=type(chunk).__name__):
+                data = write_chunk(chunk)
+
+                self.assertEqual(data, bytes.fromhex(expected))
+                self.assertEqual(len(data), 8 + chunk.size())
+
+    def test_chunks_read_back_to_the_same_bytes(self):
+        for chunk in build_chunks(wmo_format):
+            with self.subTest(chunk=type(chunk).__name__):
+                data = write_chunk(chunk)
+
+                if isinstance(chunk, wmo_format.MLIQ_chunk):
+                    copy = wmo_format.MLIQ_chunk(chunk.LiquidMaterial)
+                else:
+                    copy = type(chunk)()
+
+                copy.read(io.BytesIO(data))
+
+                self.assertEqual(write_chunk(copy), data)
+
+    def test_pack_into_buffer_offset(self):
+        chunks = build_chunks(wmo_format)
+        buffer = bytearray(3 + sum(8 + chunk.size() for chunk in chunks))
+
+        offset = 3
+        for chunk in chunks:
+            offset = chunk.pack_into(buffer, offset)
+
+        self.assertEqual(offset, len(buffer))
+        self.assertEqual(bytes(buffer[3:]), b''.join(write_chunk(chunk) for chunk in chunks))